@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Воспроизводимые бенчмарки: синтетическая БД и конфиг Xray, нагрузка на API
+подписок и микробенчмарки горячих функций main.py. Результаты — JSON,
+чтобы сравнивать прогоны между собой (bench.run --baseline).
+
+    python -m bench.run --out bench-$(git rev-parse --short HEAD).json
+    python -m bench.run --quick --baseline bench-old.json
+
+bench/bin — фейковые systemctl/xray: кладутся первыми в PATH, reload
+Xray не трогает систему, а вызовы пишутся в $BENCH_FAKE_LOG.
+"""
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Синтетическая БД бота в масштабе прода: пользователи, рефералы, подписки, платежи.
+
+Схема создаётся самим main.db_init() (WAL, все таблицы и индексы), данные
+заливаются пачками через sqlite3. Всё детерминировано от --seed: одинаковые
+параметры дают одинаковые токены, и прогоны сравнимы.
+
+    python -m bench.gen_db --out /tmp/bench/db.sqlite --users 1000000 --subs 500000 --payments 1000000
+"""
+import argparse, asyncio, base64, os, random, sqlite3, sys, time, uuid
+from typing import Iterator, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CHUNK = 50000
+
+PLANS = (("7d", 40.0), ("1m", 100.0), ("3m", 270.0), ("6m", 500.0), ("12m", 900.0))
+METHODS = ("yoomoney", "crypto", "balance")
+STATUSES = ("credited",) * 8 + ("pending", "expired")
+
+
+def token(rng: random.Random) -> str:
+    return base64.urlsafe_b64encode(rng.randbytes(24)).decode()      # как secrets.token_urlsafe(24)
+
+
+def _chunks(it: Iterator[tuple], n: int = CHUNK) -> Iterator[List[tuple]]:
+    buf = []
+    for row in it:
+        buf.append(row)
+        if len(buf) >= n:
+            yield buf; buf = []
+    if buf:
+        yield buf
+
+
+def init_schema(path: str):
+    """Схема — ровно та, что создаёт бот (main.db_init). main читает DB_PATH при импорте."""
+    if "main" in sys.modules:
+        raise RuntimeError("gen_db запускается отдельным процессом: main уже импортирован")
+    os.environ["DB_PATH"] = path
+    sys.path.insert(0, ROOT)
+    import main
+
+    async def run():
+        await main.db_init(); await main.DB.close()
+    asyncio.run(run())
+
+
+def generate(path: str, users: int, subs: int, payments: int, expired: float = 0.02, seed: int = 1) -> dict:
+    if os.path.exists(path):
+        os.unlink(path)
+    init_schema(path)
+    rng = random.Random(seed)
+    now = int(time.time())
+    t0 = time.perf_counter()
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA synchronous=OFF")
+    with con:
+        for rows in _chunks((u, round(rng.random() * 300, 2) if rng.random() < 0.1 else 0.0)
+                            for u in range(1, users + 1)):
+            con.executemany("INSERT INTO users(user_id,balance) VALUES(?,?)", rows)
+        for rows in _chunks((u, rng.randint(1, users)) for u in range(1, users + 1) if rng.random() < 0.1):
+            con.executemany("INSERT OR IGNORE INTO referrals(user_id,ref_by) VALUES(?,?)", rows)
+        # доля expired — уже истёкшие (их снимет GC), остальные раскиданы на полгода вперёд
+        for rows in _chunks((token(rng), rng.randint(1, users), str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+                             now - rng.randint(1, 86400) if rng.random() < expired else now + rng.randint(60, 180 * 86400))
+                            for _ in range(subs)):
+            con.executemany("INSERT INTO subscriptions(token,user_id,uuid,expires_at) VALUES(?,?,?,?)", rows)
+        for rows in _chunks(_payments(rng, users, payments, now)):
+            con.executemany("INSERT INTO payments(payment_id,user_id,method,plan_id,amount,currency,status,meta,created_at) "
+                            "VALUES(?,?,?,?,?,?,?,?,?)", rows)
+    con.execute("ANALYZE")
+    con.close()
+    return {"path": path, "users": users, "subs": subs, "payments": payments, "seed": seed,
+            "size_mb": round(os.path.getsize(path) / 1e6, 1), "gen_s": round(time.perf_counter() - t0, 1)}
+
+
+def _payments(rng: random.Random, users: int, n: int, now: int) -> Iterator[tuple]:
+    for i in range(n):
+        method = rng.choice(METHODS)
+        plan, price = rng.choice(PLANS)
+        if method == "crypto":
+            pid, cur = str(10_000_000 + i), "USDT"
+        else:
+            pid, cur = f"u{rng.randint(1, users)}-{i}", "RUB"
+        yield (pid, rng.randint(1, users), method, plan, price, cur, rng.choice(STATUSES), "", now - rng.randint(0, 365 * 86400))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--subs", type=int, default=500_000)
+    ap.add_argument("--payments", type=int, default=1_000_000)
+    ap.add_argument("--expired", type=float, default=0.02, help="доля уже истёкших подписок")
+    ap.add_argument("--seed", type=int, default=1)
+    a = ap.parse_args()
+    print(generate(a.out, a.users, a.subs, a.payments, a.expired, a.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Синтетический конфиг Xray: один VLESS Reality inbound на N клиентов.
+
+Ключ Reality генерируется (или детерминирован из --seed), клиенты — случайные
+uuid либо uuid подписок из синтетической БД (--db), чтобы конфиг и БД сходились.
+
+    python -m bench.gen_xray --clients 100000 --out /tmp/bench/config.json --db /tmp/bench/db.sqlite
+"""
+import argparse, base64, json, os, random, sqlite3, uuid
+from typing import Iterable, List, Optional, Tuple
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import x25519
+
+
+def _b64u(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).decode().rstrip("=")
+
+
+def x25519_pair(seed: Optional[int] = None) -> Tuple[str, str]:
+    """(privateKey, publicKey) в base64url без паддинга, как печатает `xray x25519`."""
+    raw = random.Random(seed).randbytes(32) if seed is not None else os.urandom(32)
+    priv = x25519.X25519PrivateKey.from_private_bytes(raw)
+    pub = priv.public_key().public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+    return _b64u(raw), _b64u(pub)
+
+
+def db_uuids(db_path: str, limit: int) -> List[str]:
+    con = sqlite3.connect(db_path)
+    try:
+        return [r[0] for r in con.execute("SELECT uuid FROM subscriptions ORDER BY rowid LIMIT ?", (limit,))]
+    finally:
+        con.close()
+
+
+def make_config(clients: int, seed: int = 1, uuids: Iterable[str] = (), port: int = 443) -> dict:
+    rng = random.Random(seed)
+    ids = list(uuids)[:clients]
+    ids += [str(uuid.UUID(int=rng.getrandbits(128), version=4)) for _ in range(clients - len(ids))]
+    priv, _ = x25519_pair(seed)
+    return {
+        "log": {"loglevel": "warning"},
+        "inbounds": [{
+            "tag": "vless-reality", "port": port, "protocol": "vless",
+            "settings": {"clients": [{"id": u, "email": u, "flow": "xtls-rprx-vision"} for u in ids],
+                         "decryption": "none"},
+            "streamSettings": {"network": "tcp", "security": "reality",
+                               "realitySettings": {"dest": "www.microsoft.com:443",
+                                                   "serverNames": ["www.microsoft.com"],
+                                                   "privateKey": priv, "shortIds": ["6ba85179e30d4fc2"]}},
+        }],
+        "outbounds": [{"protocol": "freedom", "tag": "direct"}],
+    }
+
+
+def write_config(path: str, cfg: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cfg, f, ensure_ascii=False, indent=2)   # так же, как пишет _save_xray
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--clients", type=int, default=10000)
+    ap.add_argument("--out", required=True)
+    ap.add_argument("--db", help="брать uuid клиентов из subscriptions этой БД")
+    ap.add_argument("--seed", type=int, default=1)
+    a = ap.parse_args()
+    uuids = db_uuids(a.db, a.clients) if a.db else ()
+    write_config(a.out, make_config(a.clients, a.seed, uuids))
+    print(f"{a.out}: {a.clients} clients, {os.path.getsize(a.out) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузка на API подписок: /sub/{token}, /sub_v2raytun/{token}, /subs/{token}.
+
+Замкнутый цикл: --concurrency клиентов шлют запросы подряд --duration секунд,
+токены берутся случайно из активных подписок синтетической БД. Считаются
+req/s, p50/p90/p99/max и ошибки по каждому эндпоинту. --revalidate повторяет
+запрос с If-None-Match из прошлого ответа (путь 304). --spawn поднимает
+`main.py --role api` (или sub_api.py с --sub-only) на этой БД/конфиге
+с фейковым systemctl в PATH.
+
+    python -m bench.load --db /tmp/bench/db.sqlite --config /tmp/bench/config.json --spawn --duration 10
+    python -m bench.load --db /tmp/bench/db.sqlite --base http://127.0.0.1:8001
+"""
+import argparse, asyncio, json, os, random, sqlite3, subprocess, sys, time, urllib.request
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_BIN = os.path.join(ROOT, "bench", "bin")
+ENDPOINTS = ("/sub/{}", "/sub_v2raytun/{}", "/subs/{}")
+
+
+def sample_tokens(db_path: str, n: int, seed: int = 1) -> List[str]:
+    con = sqlite3.connect(db_path)
+    try:
+        total = con.execute("SELECT COUNT(*) FROM subscriptions WHERE expires_at>?", (int(time.time()),)).fetchone()[0]
+        step = max(1, total // max(1, n))
+        rows = con.execute("SELECT token FROM subscriptions WHERE expires_at>? AND rowid % ? = 0 LIMIT ?",
+                           (int(time.time()), step, n)).fetchall()
+    finally:
+        con.close()
+    tokens = [r[0] for r in rows]
+    random.Random(seed).shuffle(tokens)
+    return tokens
+
+
+def percentile(sorted_lat: Sequence[float], q: float) -> float:
+    if not sorted_lat:
+        return 0.0
+    return sorted_lat[min(len(sorted_lat) - 1, int(q * len(sorted_lat)))]
+
+
+def summarize(lat: List[float], errors: int, elapsed: float, statuses: Dict[int, int]) -> dict:
+    lat.sort()
+    ms = lambda q: round(percentile(lat, q) * 1000, 3)
+    return {"requests": len(lat), "errors": errors, "rps": round(len(lat) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": ms(0.50), "p90_ms": ms(0.90), "p99_ms": ms(0.99), "max_ms": round(lat[-1] * 1000, 3) if lat else 0.0,
+            "status": {str(k): v for k, v in sorted(statuses.items())}}
+
+
+async def run_endpoint(base: str, path: str, tokens: Sequence[str], concurrency: int, duration: float,
+                       revalidate: bool = False, seed: int = 1) -> dict:
+    lat: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    etags: Dict[str, str] = {}
+    rng = random.Random(seed)
+    conn = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=30)
+    async with aiohttp.ClientSession(base, connector=conn, timeout=aiohttp.ClientTimeout(total=30)) as s:
+        stop_at = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < stop_at:
+                tok = rng.choice(tokens)
+                hdrs = {"If-None-Match": etags[tok]} if revalidate and tok in etags else {}
+                t0 = time.perf_counter()
+                try:
+                    async with s.get(path.format(tok), headers=hdrs) as r:
+                        await r.read()
+                        st = r.status
+                        if revalidate and "ETag" in r.headers:
+                            etags[tok] = r.headers["ETag"]
+                except Exception:
+                    errors += 1
+                    continue
+                lat.append(time.perf_counter() - t0)
+                statuses[st] = statuses.get(st, 0) + 1
+                if st >= 400:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return summarize(lat, errors, elapsed, statuses)
+
+
+async def run_load(base: str, tokens: Sequence[str], concurrency: int = 64, duration: float = 10.0,
+                   endpoints: Sequence[str] = ENDPOINTS, revalidate: bool = False, warmup: float = 1.0) -> dict:
+    out = {}
+    for ep in endpoints:
+        if warmup:
+            await run_endpoint(base, ep, tokens, concurrency, warmup)
+        out[ep.replace("{}", "{token}")] = await run_endpoint(base, ep, tokens, concurrency, duration, revalidate)
+    return out
+
+
+API_ENTRY = ("main.py", "--role", "api")       # подписки + вебхуки платёжек и бота
+SUB_ENTRY = ("sub_api.py",)                    # только подписки, без aiogram и SDK платёжек
+
+
+def spawn_api(db: str, config: str, port: int = 18001, workers: int = 1, log: Optional[str] = None,
+              entry: Sequence[str] = API_ENTRY) -> subprocess.Popen:
+    """API на синтетических данных; systemctl/xray — фейковые из bench/bin."""
+    env = dict(os.environ, DB_PATH=db, XRAY_CONFIG=config, API_HOST="127.0.0.1", API_PORT=str(port),
+               API_WORKERS=str(workers), LEADER_LOCK=f"{db}.leader", PUBLIC_HOST="127.0.0.1",
+               PATH=FAKE_BIN + os.pathsep + os.environ.get("PATH", ""))
+    out = open(log or os.devnull, "ab")
+    p = subprocess.Popen([sys.executable, os.path.join(ROOT, entry[0]), *entry[1:]], env=env,
+                         stdout=out, stderr=subprocess.STDOUT, cwd=ROOT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if p.poll() is not None:
+            raise RuntimeError(f"API не поднялся (exit {p.returncode}), см. {log or 'лог'}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return p
+        except OSError:
+            time.sleep(0.2)
+    p.terminate()
+    raise RuntimeError("API не ответил на /health за 60 с")
+
+
+def stop_api(p: subprocess.Popen):
+    p.terminate()
+    try:
+        p.wait(10)
+    except subprocess.TimeoutExpired:
+        p.kill()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", required=True, help="синтетическая БД (токены и, с --spawn, данные API)")
+    ap.add_argument("--config", help="конфиг Xray для --spawn")
+    ap.add_argument("--base", default="", help="уже запущенный API; по умолчанию --spawn")
+    ap.add_argument("--spawn", action="store_true")
+    ap.add_argument("--port", type=int, default=18001)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--sub-only", action="store_true", help="--spawn поднимает sub_api.py вместо main.py --role api")
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--tokens", type=int, default=10000)
+    ap.add_argument("--revalidate", action="store_true")
+    ap.add_argument("--out", help="JSON с результатами (по умолчанию stdout)")
+    a = ap.parse_args()
+    tokens = sample_tokens(a.db, a.tokens)
+    proc = None
+    base = a.base
+    if a.spawn or not base:
+        if not a.config:
+            ap.error("--spawn требует --config")
+        proc = spawn_api(a.db, a.config, a.port, a.workers, entry=SUB_ENTRY if a.sub_only else API_ENTRY)
+        base = f"http://127.0.0.1:{a.port}"
+    try:
+        res = asyncio.run(run_load(base, tokens, a.concurrency, a.duration, revalidate=a.revalidate))
+    finally:
+        if proc:
+            stop_api(proc)
+    doc = json.dumps({"load": res, "params": vars(a)}, indent=2, ensure_ascii=False)
+    if a.out:
+        with open(a.out, "w") as f:
+            f.write(doc)
+    print(doc)
+
+
+if __name__ == "__main__":
+    main()
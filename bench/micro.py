@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Микробенчмарки горячих функций main.py на синтетическом конфиге Xray.
+
+build_vless, pbk_from_private_key (с lru_cache и без), read_xray_reality
+(горячий снапшот и холодный разбор конфига), xray_add_client (полная
+перезапись конфига + фейковый reload) и пачки expire_batch — то, что делает
+expire_gc_loop. Конфиг копируется во временный каталог, исходный не меняется.
+main читает окружение при импорте, поэтому один процесс — один конфиг;
+для нескольких размеров bench.run запускает модуль несколько раз.
+
+    python -m bench.micro --config /tmp/bench/config-100000.json --out micro.json
+"""
+import argparse, asyncio, json, os, shutil, sys, tempfile, time, timeit, uuid
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_BIN = os.path.join(ROOT, "bench", "bin")
+
+
+def setup(config: str, workdir: str):
+    """Окружение для main (до импорта!) и сам main."""
+    if "main" in sys.modules:
+        raise RuntimeError("bench.micro запускается отдельным процессом: main уже импортирован")
+    cfg = os.path.join(workdir, "config.json")
+    shutil.copyfile(config, cfg)
+    os.environ.update(DB_PATH=os.path.join(workdir, "micro.sqlite"), XRAY_CONFIG=cfg, XRAY_BATCH_WINDOW="0",
+                      LEADER_LOCK=os.path.join(workdir, "leader"), XRAY_BACKEND="file", XRAY_SHARDS="0",
+                      PATH=FAKE_BIN + os.pathsep + os.environ.get("PATH", ""))
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+def measure(fn: Callable[[], object], number: int, repeat: int = 3) -> dict:
+    """Лучший из repeat прогонов по number вызовов."""
+    best = min(timeit.Timer(fn).repeat(repeat=repeat, number=number)) / number
+    return {"calls": number, "us_per_op": round(best * 1e6, 3), "ops_per_s": round(1 / best, 1) if best else None}
+
+
+def bench_pure(main, n: int) -> Dict[str, dict]:
+    api = sys.modules["sub_api"]       # сторона чтения конфига живёт в sub_api (main её импортирует)
+    port, net, sni, sid, pbk = api.read_xray_reality()
+    priv = api._get_reality_inbound(api._load_xray())["streamSettings"]["realitySettings"]["privateKey"]
+    u = str(uuid.uuid4())
+    cold_n = max(3, n // 10000)
+    return {
+        "build_vless": measure(lambda: api.build_vless("vpn.example.com", port, u, net, sni, sid, pbk, True, None), n),
+        "pbk_from_private_key": measure(lambda: api.pbk_from_private_key(priv), n),
+        "pbk_from_private_key_uncached": measure(lambda: api.pbk_from_private_key.__wrapped__(priv), max(10, n // 100)),
+        "read_xray_reality": measure(api.read_xray_reality, n),
+        "read_xray_reality_cold": measure(lambda: api._reality_from(api._load_xray()), cold_n, repeat=1),
+    }
+
+
+def bench_xray(main, adds: int, batch: int) -> Dict[str, dict]:
+    log = os.environ.get("BENCH_FAKE_LOG")
+    single = measure(lambda: main.xray_add_client(str(uuid.uuid4())), adds, repeat=1)
+    t0 = time.perf_counter()
+    main.xray_apply({u: main._xray_client(u) for u in (str(uuid.uuid4()) for _ in range(batch))}, set())
+    dt = time.perf_counter() - t0
+    out = {"xray_add_client": single,
+           "xray_apply_batch": {"clients": batch, "ms": round(dt * 1000, 3), "us_per_client": round(dt / batch * 1e6, 3)}}
+    if log and os.path.exists(log):
+        with open(log) as f:
+            out["fake_reloads"] = sum(1 for line in f if line.startswith("systemctl reload"))
+    return out
+
+
+async def bench_expiry(main, sizes: List[int]) -> Dict[str, dict]:
+    """Пачки expire_batch: снятие N клиентов из конфига одной записью + DELETE одной транзакцией."""
+    await main.db_init()
+    main.XRAY.start()
+    clients = main._get_reality_inbound(main._load_xray())["settings"]["clients"]
+    ids = [c["id"] for c in clients]
+    out = {}
+    pos, now = 0, int(time.time())
+    try:
+        for n in sizes:
+            if pos + n > len(ids):
+                break
+            rows = [(now - 1, f"bench-{pos + i}", ids[pos + i]) for i in range(n)]
+            pos += n
+            async with main.DB.write() as db:
+                await db.executemany("INSERT INTO subscriptions(token,user_id,uuid,expires_at) VALUES(?,?,?,?)",
+                                     [(t, 1, u, e) for e, t, u in rows])
+            t0 = time.perf_counter()
+            await main.expire_batch(rows)
+            dt = time.perf_counter() - t0
+            out[str(n)] = {"ms": round(dt * 1000, 3), "us_per_sub": round(dt / n * 1e6, 3)}
+    finally:
+        await main.XRAY.stop()
+        await main.DB.close()
+    return out
+
+
+def run(config: str, n: int = 100000, adds: int = 20, batch: int = 1000, expire: List[int] = (100, 1000, 5000)) -> dict:
+    with tempfile.TemporaryDirectory(prefix="bench-micro-") as d:
+        os.environ.setdefault("BENCH_FAKE_LOG", os.path.join(d, "fake.log"))
+        main = setup(config, d)
+        clients = len(main._get_reality_inbound(main._load_xray())["settings"]["clients"])
+        res = {"clients": clients, "config_mb": round(os.path.getsize(config) / 1e6, 2)}
+        res.update(bench_pure(main, n))
+        res["expire_batch"] = asyncio.run(bench_expiry(main, list(expire)))
+        res.update(bench_xray(main, adds, batch))
+        return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--config", required=True, help="синтетический конфиг (bench.gen_xray)")
+    ap.add_argument("--n", type=int, default=100000, help="вызовов для чистых функций")
+    ap.add_argument("--adds", type=int, default=20, help="последовательных xray_add_client")
+    ap.add_argument("--batch", type=int, default=1000, help="клиентов в одном xray_apply")
+    ap.add_argument("--expire", default="100,1000,5000", help="размеры пачек expire_batch")
+    ap.add_argument("--out")
+    a = ap.parse_args()
+    res = run(a.config, a.n, a.adds, a.batch, [int(x) for x in a.expire.split(",") if x])
+    doc = json.dumps(res, indent=2)
+    if a.out:
+        with open(a.out, "w") as f:
+            f.write(doc)
+    print(doc)
+
+
+if __name__ == "__main__":
+    main()
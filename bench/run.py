@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Полный прогон: синтетическая БД и конфиги Xray -> нагрузка на API -> время старта
+и память по режимам (bench.startup) -> микробенчмарки для каждого размера конфига -> один JSON. Данные кэшируются в --workdir
+(повторный прогон с теми же параметрами их не пересоздаёт).
+
+    python -m bench.run --out bench.json
+    python -m bench.run --quick --out new.json --baseline old.json --fail-over 20
+
+--baseline печатает изменение каждой метрики к прошлому прогону; с --fail-over
+код выхода 1, если какая-то метрика ухудшилась больше чем на столько процентов.
+"""
+import argparse, asyncio, json, os, platform, subprocess, sys, time
+from typing import Dict, Iterator, Tuple
+
+from bench import gen_xray, startup
+from bench.load import run_load, sample_tokens, spawn_api, stop_api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# чем меньше, тем лучше — всё, кроме пропускной способности
+HIGHER_IS_BETTER = ("rps", "ops_per_s")
+COMPARED = ("p50_ms", "p99_ms", "rps", "us_per_op", "us_per_sub", "us_per_client", "import_ms", "ready_ms", "rss_mb")
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return ""
+
+
+def _py(module: str, *args: str) -> str:
+    return subprocess.check_output([sys.executable, "-m", module, *args], cwd=ROOT, text=True)
+
+
+def prepare(a) -> Tuple[str, Dict[int, str]]:
+    os.makedirs(a.workdir, exist_ok=True)
+    tag = f"u{a.users}-s{a.subs}-p{a.payments}-seed{a.seed}"
+    db = os.path.join(a.workdir, f"db-{tag}.sqlite")
+    if not os.path.exists(db):
+        print(f"generating {db} ...", file=sys.stderr)
+        _py("bench.gen_db", "--out", db, "--users", str(a.users), "--subs", str(a.subs),
+            "--payments", str(a.payments), "--seed", str(a.seed))
+    configs = {}
+    for n in a.clients:
+        path = os.path.join(a.workdir, f"config-{n}-seed{a.seed}.json")
+        if not os.path.exists(path):
+            gen_xray.write_config(path, gen_xray.make_config(n, a.seed, gen_xray.db_uuids(db, n)))
+        configs[n] = path
+    return db, configs
+
+
+def flatten(doc, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(doc, dict):
+        for k, v in doc.items():
+            yield from flatten(v, f"{prefix}.{k}" if prefix else k)
+    elif isinstance(doc, (int, float)) and prefix.rsplit(".", 1)[-1] in COMPARED:
+        yield prefix, float(doc)
+
+
+def compare(new: dict, old: dict) -> Tuple[list, float]:
+    """[(метрика, было, стало, % ухудшения)], худшее ухудшение в %."""
+    was = dict(flatten(old.get("results", {})))
+    rows, worst = [], 0.0
+    for k, v in flatten(new.get("results", {})):
+        if k not in was or not was[k]:
+            continue
+        change = (v - was[k]) / was[k] * 100
+        worse = -change if k.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        rows.append((k, was[k], v, round(worse, 1)))
+        worst = max(worst, worse)
+    return rows, worst
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workdir", default="/tmp/rel-bench")
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--subs", type=int, default=500_000)
+    ap.add_argument("--payments", type=int, default=1_000_000)
+    ap.add_argument("--clients", default="10000,100000", help="размеры конфига Xray")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--duration", type=float, default=10.0)
+    ap.add_argument("--workers", type=int, default=1, help="uvicorn-воркеров API")
+    ap.add_argument("--port", type=int, default=18001)
+    ap.add_argument("--quick", action="store_true", help="уменьшенный масштаб для быстрой проверки")
+    ap.add_argument("--skip-load", action="store_true")
+    ap.add_argument("--skip-micro", action="store_true")
+    ap.add_argument("--skip-startup", action="store_true")
+    ap.add_argument("--out", default="")
+    ap.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    ap.add_argument("--fail-over", type=float, default=0.0, help="падать при ухудшении больше чем на N%%")
+    a = ap.parse_args()
+    if a.quick:
+        a.users, a.subs, a.payments, a.duration = 100_000, 50_000, 100_000, 3.0
+        a.clients = "1000,10000"
+    a.clients = [int(x) for x in a.clients.split(",") if x]
+
+    t0 = time.time()
+    db, configs = prepare(a)
+    results = {}
+    if not a.skip_load:
+        proc = spawn_api(db, configs[a.clients[0]], a.port, a.workers, log=os.path.join(a.workdir, "api.log"))
+        try:
+            tokens = sample_tokens(db, 10000, a.seed)
+            base = f"http://127.0.0.1:{a.port}"
+            results["load"] = asyncio.run(run_load(base, tokens, a.concurrency, a.duration))
+            results["load_revalidate"] = asyncio.run(run_load(base, tokens, a.concurrency, a.duration,
+                                                              endpoints=("/sub/{}",), revalidate=True))
+        finally:
+            stop_api(proc)
+    if not a.skip_startup:
+        results["startup"] = startup.run(db, configs[a.clients[0]], a.port + 10, a.workers)
+    if not a.skip_micro:
+        results["micro"] = {str(n): json.loads(_py("bench.micro", "--config", path)) for n, path in configs.items()}
+
+    doc = {"meta": {"git": _git_rev(), "ts": int(t0), "elapsed_s": round(time.time() - t0, 1),
+                    "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                    "params": {k: v for k, v in vars(a).items() if k not in ("out", "baseline")}},
+           "results": results}
+    text = json.dumps(doc, indent=2, ensure_ascii=False)
+    if a.out:
+        with open(a.out, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if a.baseline:
+        with open(a.baseline) as f:
+            rows, worst = compare(doc, json.load(f))
+        for k, was, now, worse in rows:
+            print(f"{k:70s} {was:>12g} -> {now:<12g} {'+' if worse > 0 else ''}{worse}%", file=sys.stderr)
+        if a.fail_over and worst > a.fail_over:
+            print(f"regression: {worst:.1f}% > {a.fail_over}%", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
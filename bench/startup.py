@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Время старта и память по режимам запуска.
+
+import: холодный импорт модуля в чистом интерпретаторе — время, RSS после
+импорта, число модулей и какие тяжёлые стеки (aiogram, SDK платёжек, uvicorn)
+подтянулись. serve: от запуска процесса до первого 200 на /health и RSS всего
+дерева процессов (uvicorn-родитель + воркеры) после этого.
+
+    python -m bench.startup --db /tmp/bench/db.sqlite --config /tmp/bench/config.json
+"""
+import argparse, json, os, statistics, subprocess, sys, time, urllib.request
+from typing import Dict, List, Sequence
+
+from bench.load import API_ENTRY, SUB_ENTRY, spawn_api, stop_api
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("aiogram", "yoomoney", "aiocryptopay", "uvicorn", "grpc")
+MODES = {"sub_api": ("sub_api", SUB_ENTRY), "main": ("main", API_ENTRY)}
+
+_PROBE = """
+import json, resource, sys, time
+t0 = time.perf_counter()
+import %s
+dt = time.perf_counter() - t0
+rss = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1])
+print(json.dumps({"import_ms": dt * 1000, "rss_mb": rss / 1024, "modules": len(sys.modules),
+                  "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def _rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _tree(pid: int) -> List[int]:
+    out = [pid]
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                for c in f.read().split():
+                    out += _tree(int(c))
+    except OSError:
+        pass
+    return out
+
+
+def measure_import(module: str, env: Dict[str, str], runs: int = 3) -> dict:
+    res = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", _PROBE % (module, HEAVY)], cwd=ROOT, env=env, text=True)
+        res.append(json.loads(out))
+    return {"import_ms": round(statistics.median(r["import_ms"] for r in res), 1),
+            "rss_mb": round(statistics.median(r["rss_mb"] for r in res), 1),
+            "modules": res[0]["modules"], "loaded": res[0]["loaded"]}
+
+
+def measure_serve(db: str, config: str, entry: Sequence[str], port: int, workers: int) -> dict:
+    t0 = time.perf_counter()
+    p = spawn_api(db, config, port, workers, entry=entry)
+    ready = time.perf_counter() - t0
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5):
+            pass
+        pids = _tree(p.pid)
+        rss = sum(_rss_kb(x) for x in pids)
+    finally:
+        stop_api(p)
+    return {"ready_ms": round(ready * 1000, 1), "processes": len(pids), "rss_mb": round(rss / 1024, 1)}
+
+
+def run(db: str, config: str, port: int = 18011, workers: int = 1, runs: int = 3) -> dict:
+    env = dict(os.environ, DB_PATH=db, XRAY_CONFIG=config)
+    out = {}
+    for name, (module, entry) in MODES.items():
+        out[name] = {"import": measure_import(module, env, runs),
+                     "serve": measure_serve(db, config, entry, port, workers)}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", required=True)
+    ap.add_argument("--config", required=True)
+    ap.add_argument("--port", type=int, default=18011)
+    ap.add_argument("--workers", type=int, default=1)
+    ap.add_argument("--runs", type=int, default=3)
+    a = ap.parse_args()
+    print(json.dumps(run(a.db, a.config, a.port, a.workers, a.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Общий клиент CryptoBot и пакетная проверка статусов инвойсов.
+
+Один AioCryptoPay (одна aiohttp-сессия, одно TLS-соединение) живёт всё
+время работы приложения; main() закрывает его при остановке.
+Проверки статуса, пришедшие в течение window секунд, склеиваются в один
+get_invoices(invoice_ids=[...]); ответ кэшируется на ttl секунд, а
+конечные статусы (paid/expired) — до перезапуска, чтобы повторные нажатия
+«Проверить оплату» не ходили в API.
+"""
+import asyncio, time
+from typing import Callable, Dict, List, Optional, Tuple
+
+FINAL = ("paid", "expired")
+
+
+class CryptoBatcher:
+    def __init__(self, client_factory: Callable[[], object], window: float = 0.5, ttl: float = 5.0,
+                 max_batch: int = 100):
+        self.client_factory = client_factory
+        self.window = window
+        self.ttl = ttl
+        self.max_batch = max_batch            # лимит id в одном getInvoices
+        self.max_cache = 10000
+        self._client = None
+        self._waiting: Dict[int, List[asyncio.Future]] = {}
+        self._flush: Optional[asyncio.Task] = None
+        self._cache: Dict[int, Tuple[Optional[str], float]] = {}
+        # метрики
+        self.checks = 0
+        self.cache_hits = 0
+        self.api_calls = 0
+        self.errors = 0
+        self.last_error = ""
+        self.observe: Optional[Callable[[str, float, bool], None]] = None   # (метод API, секунды, успех)
+
+    def client(self):
+        """Общий клиент; создаётся при первом обращении внутри работающего цикла."""
+        if self._client is None:
+            self._client = self.client_factory()
+        return self._client
+
+    async def close(self):
+        if self._flush is not None and not self._flush.done():
+            self._flush.cancel()
+        if self._client is not None:
+            await self._client.close()
+        self._client = None
+
+    def remember(self, invoice_id: int, status: str):
+        """Статус, пришедший не из API (вебхук): следующая проверка возьмёт его из кэша."""
+        self._cache[int(invoice_id)] = (status, time.monotonic())
+
+    async def status(self, invoice_id: int) -> Optional[str]:
+        """Статус инвойса (active/paid/expired) или None, если CryptoBot его не знает."""
+        invoice_id = int(invoice_id)
+        self.checks += 1
+        hit = self._cache.get(invoice_id)
+        if hit and (hit[0] in FINAL or time.monotonic() - hit[1] < self.ttl):
+            self.cache_hits += 1
+            return hit[0]
+        fut = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(invoice_id, []).append(fut)
+        if self._flush is None or self._flush.done():
+            self._flush = asyncio.create_task(self._run())
+        return await fut
+
+    async def _run(self):
+        await asyncio.sleep(self.window)
+        while self._waiting:
+            batch = dict(list(self._waiting.items())[:self.max_batch])
+            for i in batch:
+                del self._waiting[i]
+            try:
+                found = await self._fetch(list(batch))
+            except Exception as e:
+                self.errors += 1; self.last_error = repr(e)
+                for futs in batch.values():
+                    for f in futs:
+                        if not f.done(): f.set_exception(e)
+                continue
+            now = time.monotonic()
+            if len(self._cache) > self.max_cache:
+                self._cache.clear()
+            for i, futs in batch.items():
+                st = found.get(i)
+                self._cache[i] = (st, now)
+                for f in futs:
+                    if not f.done(): f.set_result(st)
+
+    async def _fetch(self, ids: List[int]) -> Dict[int, str]:
+        self.api_calls += 1
+        t0 = time.perf_counter(); ok = False
+        try:
+            res = await self.client().get_invoices(invoice_ids=ids, count=len(ids))
+            ok = True
+        finally:
+            if self.observe is not None:
+                self.observe("getInvoices", time.perf_counter() - t0, ok)
+        if res is None:
+            items = []
+        elif isinstance(res, list):
+            items = res
+        else:
+            items = getattr(res, "items", None) or [res]
+        return {int(inv.invoice_id): getattr(inv, "status", None) for inv in items}
+
+    def stats(self) -> dict:
+        return {"checks": self.checks, "cache_hits": self.cache_hits, "api_calls": self.api_calls,
+                "waiting": len(self._waiting), "cached": len(self._cache),
+                "errors": self.errors, "last_error": self.last_error}
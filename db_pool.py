@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Общий пул соединений SQLite для бота и API.
+
+Открывается один раз при старте: БД в режиме WAL, несколько read-only
+соединений для чтения (эндпоинты FastAPI, выборки бота) и ровно одно
+соединение-писатель, доступ к которому сериализован asyncio.Lock.
+
+    async with DB.read() as db:  ... только SELECT
+    async with DB.write() as db: ... мутации; commit на выходе, rollback при исключении
+"""
+import asyncio, contextlib, time
+from typing import Callable, Optional, List
+
+import aiosqlite
+
+
+class _WaitStats:
+    __slots__ = ("acquired", "waited", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.acquired = 0      # сколько раз выдали соединение
+        self.waited = 0        # из них пришлось ждать
+        self.wait_total = 0.0  # суммарное ожидание, сек
+        self.wait_max = 0.0
+
+    def add(self, dt: float):
+        self.acquired += 1
+        if dt > 0.0005:
+            self.waited += 1
+        self.wait_total += dt
+        if dt > self.wait_max:
+            self.wait_max = dt
+
+    def as_dict(self) -> dict:
+        return {"acquired": self.acquired, "waited": self.waited,
+                "wait_total_ms": round(self.wait_total * 1000, 3),
+                "wait_avg_ms": round(self.wait_total * 1000 / self.acquired, 3) if self.acquired else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3)}
+
+
+class SqlitePool:
+    def __init__(self, path: str, readers: int = 4, writer: bool = True, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.readers = max(1, int(readers))
+        self.has_writer = writer
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle: Optional[asyncio.Queue] = None
+        self._all: List[aiosqlite.Connection] = []
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._wlock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+        self._rstats = _WaitStats()
+        self._wstats = _WaitStats()
+        # observe(kind, phase, секунды): kind read|write, phase wait (ожидание соединения/лока) | hold (запросы)
+        self.observe: Optional[Callable[[str, str, float], None]] = None
+
+    async def _connect(self, readonly: bool) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path)
+        await db.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        if readonly:
+            await db.execute("PRAGMA query_only=ON")
+        return db
+
+    async def open(self, schema: Optional[str] = None):
+        """Открыть соединения (повторный вызов — no-op). schema выполняется писателем."""
+        async with self._open_lock:
+            if self._opened:
+                return
+            if self.has_writer:
+                w = await self._connect(readonly=False)
+                await w.execute("PRAGMA journal_mode=WAL")
+                await w.execute("PRAGMA synchronous=NORMAL")
+                if schema:
+                    await w.executescript(schema)
+                await w.commit()
+                self._writer = w
+                self._all.append(w)
+            self._idle = asyncio.Queue()
+            for _ in range(self.readers):
+                r = await self._connect(readonly=True)
+                self._all.append(r)
+                self._idle.put_nowait(r)
+            self._opened = True
+
+    async def close(self):
+        async with self._open_lock:
+            for db in self._all:
+                with contextlib.suppress(Exception):
+                    await db.close()
+            self._all.clear()
+            self._writer = None
+            self._idle = None
+            self._opened = False
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        if not self._opened:
+            await self.open()
+        t0 = time.perf_counter()
+        db = await self._idle.get()
+        t1 = time.perf_counter()
+        self._rstats.add(t1 - t0)
+        try:
+            yield db
+        finally:
+            self._idle.put_nowait(db)
+            if self.observe is not None:
+                self.observe("read", "wait", t1 - t0); self.observe("read", "hold", time.perf_counter() - t1)
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        if not self._opened:
+            await self.open()
+        if self._writer is None:
+            raise RuntimeError("SqlitePool открыт без писателя")
+        t0 = time.perf_counter()
+        async with self._wlock:
+            t1 = time.perf_counter()
+            self._wstats.add(t1 - t0)
+            try:
+                yield self._writer
+            except BaseException:
+                with contextlib.suppress(Exception):
+                    await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+            finally:
+                if self.observe is not None:
+                    self.observe("write", "wait", t1 - t0); self.observe("write", "hold", time.perf_counter() - t1)
+
+    def stats(self) -> dict:
+        idle = self._idle.qsize() if self._idle is not None else 0
+        return {
+            "readers": {"size": self.readers if self._opened else 0, "idle": idle,
+                        "in_use": (self.readers - idle) if self._opened else 0, **self._rstats.as_dict()},
+            "writer": {"size": 1 if self._writer is not None else 0, "locked": self._wlock.locked(),
+                       **self._wstats.as_dict()},
+        }
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Планировщик истечения подписок по дедлайнам.
+
+Вместо сканирования таблицы раз в минуту держим min-heap (expires_at, token, uuid)
+для подписок, истекающих в ближайший horizon секунд; heap пополняется из БД
+по индексу subscriptions(expires_at). Задача спит ровно до ближайшего дедлайна
+(или до schedule() с более ранним сроком), забирает всё, что истекло, и отдаёт
+пачкой в expire(rows) — одно обновление конфига Xray и одна транзакция в БД.
+"""
+import asyncio, heapq, time
+from typing import Awaitable, Callable, List, Set, Tuple
+
+Row = Tuple[int, str, str]   # (expires_at, token, uuid)
+
+
+class ExpiryScheduler:
+    def __init__(self,
+                 load: Callable[[int], Awaitable[List[Row]]],
+                 expire: Callable[[List[Row]], Awaitable[None]],
+                 horizon: int = 3600, retry_delay: float = 5.0):
+        self.load = load              # load(until) -> подписки с expires_at <= until
+        self.expire = expire          # expire(rows): снять клиентов и удалить строки
+        self.horizon = horizon
+        self.retry_delay = retry_delay
+        self._heap: List[Row] = []
+        self._tokens: Set[str] = set()
+        self._loaded_until = 0
+        self._wake = asyncio.Event()
+        # метрики
+        self.expired = 0
+        self.batches = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._lag_sum = 0.0
+
+    def schedule(self, token: str, uuid: str, expires_at: int):
+        """Сообщить о новой подписке (если она попадает в уже загруженный горизонт)."""
+        if expires_at > self._loaded_until or token in self._tokens:
+            return
+        head = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (int(expires_at), token, uuid)); self._tokens.add(token)
+        if head is None or expires_at < head:
+            self._wake.set()
+
+    async def _refill(self, now: float):
+        until = int(now) + self.horizon
+        for row in await self.load(until):
+            if row[1] not in self._tokens:
+                heapq.heappush(self._heap, (int(row[0]), row[1], row[2])); self._tokens.add(row[1])
+        self._loaded_until = until
+
+    def _pop_due(self, now: float) -> List[Row]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            row = heapq.heappop(self._heap); self._tokens.discard(row[1])
+            due.append(row)
+        return due
+
+    async def run(self):
+        while True:
+            now = time.time()
+            if now >= self._loaded_until - self.horizon / 2:
+                try:
+                    await self._refill(now)
+                except Exception:
+                    await asyncio.sleep(self.retry_delay); continue
+            due = self._pop_due(now)
+            if due:
+                try:
+                    await self.expire(due)
+                except Exception:
+                    for row in due:   # вернём в heap и повторим позже
+                        heapq.heappush(self._heap, row); self._tokens.add(row[1])
+                    await asyncio.sleep(self.retry_delay); continue
+                done = time.time()
+                for exp, _, _ in due:
+                    lag = max(0.0, done - exp)
+                    self._lag_sum += lag
+                    if lag > self.lag_max: self.lag_max = lag
+                self.lag_last = max(0.0, done - due[0][0])
+                self.expired += len(due); self.batches += 1
+                continue
+            wake_at = self._loaded_until - self.horizon / 2
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(0.0, wake_at - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {"pending": len(self._heap), "next_due": self._heap[0][0] if self._heap else None,
+                "expired": self.expired, "batches": self.batches,
+                "lag_last_s": round(self.lag_last, 3), "lag_max_s": round(self.lag_max, 3),
+                "lag_avg_s": round(self._lag_sum / self.expired, 3) if self.expired else 0.0}
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Локальные заглушки внешних сервисов (Xray API, платёжки, Telegram) для офлайн-проверок и бенчмарков."""
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Фейковый Telegram Bot API: /bot<token>/<method> (JSON или form-urlencoded, как шлёт aiogram).
+
+Отвечает на getMe, setWebhook/deleteWebhook/getWebhookInfo, sendMessage,
+answerCallbackQuery (и «ok» на всё остальное), запоминает вызовы в calls.
+deliver() отправляет апдейт на зарегистрированный setWebhook URL с секретом —
+так проверяется вебхук-режим без выхода в сеть.
+
+    python -m fakes.telegram --port 8081
+    TELEGRAM_API_BASE=http://127.0.0.1:8081 BOT_MODE=webhook python main.py
+"""
+import argparse, itertools, json, threading, time, urllib.error, urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "u"}
+    msg = {"message_id": update_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+           "from": user, "text": text}
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": msg}
+
+
+def callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "u"}
+    msg = {"message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}, "text": "menu"}
+    return {"update_id": update_id, "callback_query": {"id": str(update_id), "from": user, "chat_instance": "x",
+                                                       "message": msg, "data": data}}
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency               # имитация RTT до api.telegram.org
+        self.calls: List[Tuple[str, dict]] = []
+        self.webhook_url = ""
+        self.webhook_secret = ""
+        self.lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def sent(self, method: str = "sendMessage") -> List[dict]:
+        with self.lock:
+            return [p for m, p in self.calls if m == method]
+
+    def call(self, method: str, params: dict):
+        with self.lock:
+            self.calls.append((method, params))
+        if self.latency:
+            time.sleep(self.latency)
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook_url = params.get("url", ""); self.webhook_secret = params.get("secret_token", "")
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = ""
+            return True
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url, "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "getUpdates":
+            time.sleep(min(1.0, float(params.get("timeout") or 0)))
+            return []
+        if method in ("sendMessage", "editMessageText"):
+            return {"message_id": next(self._ids), "date": int(time.time()),
+                    "chat": {"id": int(params.get("chat_id", 0)), "type": "private"}, "text": params.get("text", "")}
+        return True
+
+    def deliver(self, update: dict) -> int:
+        req = urllib.request.Request(self.webhook_url, data=json.dumps(update).encode(), method="POST",
+                                     headers={"Content-Type": "application/json",
+                                              "X-Telegram-Bot-Api-Secret-Token": self.webhook_secret})
+        try:
+            with urllib.request.urlopen(req, timeout=10) as r:
+                return r.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> int:
+        fake = self
+
+        class H(BaseHTTPRequestHandler):
+            def _params(self) -> dict:
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+                if "json" in (self.headers.get("Content-Type") or ""):
+                    return json.loads(body or "{}")
+                p = {k: v[0] for k, v in parse_qs(body).items()}
+                p.update({k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()})
+                return p
+
+            def _serve(self):
+                parts = urlparse(self.path).path.strip("/").split("/")
+                if len(parts) != 2 or not parts[0].startswith("bot"):
+                    self.send_error(404); return
+                data = json.dumps({"ok": True, "result": fake.call(parts[1], self._params())}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _serve
+
+            def log_message(self, *a):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), H)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.httpd.server_address[1]
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown(); self.httpd.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--latency", type=float, default=0.0)
+    a = ap.parse_args()
+    fake = FakeTelegram(a.latency)
+    port = fake.start(a.port, a.host)
+    print(f"fake telegram api on http://{a.host}:{port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Фейковый gRPC-сервер Xray: HandlerService/AlterInbound (add/remove user) и
+StatsService/QueryStats, GetSysStats (uptime; restart() — имитация перезапуска).
+
+Держит пользователей в памяти по тегу inbound'а и отвечает теми же ошибками,
+что и настоящий Xray ("already exists" / "not found"). Трафик накручивается
+через add_traffic() (или --traffic: случайные байты всем пользователям раз в
+секунду) и отдаётся счётчиками user>>>EMAIL>>>traffic>>>uplink/downlink.
+
+    python -m fakes.xray_api --port 10085
+    python -m fakes.xray_api --port 10085 --traffic 100000
+    XRAY_BACKEND=api XRAY_API_ADDR=127.0.0.1:10085 TRAFFIC_INTERVAL=10 python main.py
+"""
+import argparse, random, threading, time
+from concurrent import futures
+from typing import Dict, Optional
+
+import grpc
+
+from xray_api import HANDLER_SERVICE, STATS_SERVICE, T_ADD_USER, T_REMOVE_USER, pb_bytes, pb_fields, pb_uint
+
+
+def _msg(buf: bytes) -> Dict[int, object]:
+    return {f: v for f, _, v in pb_fields(buf)}
+
+
+class FakeXray:
+    def __init__(self):
+        self.users: Dict[str, Dict[str, str]] = {}   # tag -> {email: uuid}
+        self.counters: Dict[str, int] = {}           # имя счётчика StatsService -> значение
+        self.calls = 0
+        self.stats_calls = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.server: Optional[grpc.Server] = None
+
+    def alter_inbound(self, req: bytes, ctx) -> bytes:
+        self.calls += 1
+        m = _msg(req)
+        tag = m.get(1, b"").decode()
+        op = _msg(m.get(2, b""))
+        op_type, op_val = op.get(1, b"").decode(), op.get(2, b"")
+        with self.lock:
+            users = self.users.setdefault(tag, {})
+            if op_type == T_ADD_USER:
+                user = _msg(_msg(op_val).get(1, b""))
+                email = user.get(2, b"").decode()
+                account = _msg(_msg(user.get(3, b"")).get(2, b""))
+                if email in users:
+                    ctx.abort(grpc.StatusCode.UNKNOWN, f"User {email} already exists.")
+                users[email] = account.get(1, b"").decode()
+            elif op_type == T_REMOVE_USER:
+                email = _msg(op_val).get(1, b"").decode()
+                if email not in users:
+                    ctx.abort(grpc.StatusCode.UNKNOWN, f"User {email} not found.")
+                del users[email]
+            else:
+                ctx.abort(grpc.StatusCode.UNIMPLEMENTED, f"unknown operation {op_type}")
+        return b""
+
+    def add_traffic(self, email: str, up: int = 0, down: int = 0):
+        with self.lock:
+            for name, n in ((f"user>>>{email}>>>traffic>>>uplink", up), (f"user>>>{email}>>>traffic>>>downlink", down)):
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def query_stats(self, req: bytes, ctx) -> bytes:
+        # как в Xray без regexp: подстрока в имени; reset отдаёт значения и обнуляет их
+        self.stats_calls += 1
+        m = _msg(req)
+        pattern, reset = m.get(1, b"").decode(), bool(m.get(2, 0))
+        out = b""
+        with self.lock:
+            for name, value in self.counters.items():
+                if pattern in name:
+                    out += pb_bytes(1, pb_bytes(1, name) + pb_uint(2, value))
+                    if reset:
+                        self.counters[name] = 0
+        return out
+
+    def sys_stats(self, req: bytes, ctx) -> bytes:
+        return pb_uint(10, int(time.time() - self.started))
+
+    def restart(self):
+        """Как перезапуск Xray без постоянного конфига: пользователи из API и счётчики пропадают."""
+        with self.lock:
+            self.users.clear(); self.counters.clear()
+            self.started = time.time()
+
+    def handlers(self):
+        return [grpc.method_handlers_generic_handler(HANDLER_SERVICE, {
+            "AlterInbound": grpc.unary_unary_rpc_method_handler(self.alter_inbound),
+        }), grpc.method_handlers_generic_handler(STATS_SERVICE, {
+            "QueryStats": grpc.unary_unary_rpc_method_handler(self.query_stats),
+            "GetSysStats": grpc.unary_unary_rpc_method_handler(self.sys_stats),
+        })]
+
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> int:
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=8))
+        self.server.add_generic_rpc_handlers(self.handlers())
+        port = self.server.add_insecure_port(f"{host}:{port}")
+        self.server.start()
+        return port
+
+    def stop(self):
+        if self.server:
+            self.server.stop(0)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=10085)
+    ap.add_argument("--traffic", type=int, default=0, help="до стольких байт в секунду каждому пользователю")
+    a = ap.parse_args()
+    fx = FakeXray()
+    port = fx.start(a.port, a.host)
+    print(f"fake xray api on {a.host}:{port}")
+    try:
+        while True:
+            time.sleep(1 if a.traffic else 3600)
+            for email in [e for users in list(fx.users.values()) for e in list(users)] if a.traffic else ():
+                fx.add_traffic(email, random.randint(0, a.traffic // 8), random.randint(0, a.traffic))
+    except KeyboardInterrupt:
+        fx.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Фейковый YooMoney API: POST /api/operation-history (form-urlencoded, как настоящий).
+
+Поддерживает type, label, from, start_record, records — этого хватает
+yoomoney.Client и фоновому сверщику. Платёж можно «провести» из кода
+(FakeYooMoney.pay) или запросом POST /fake/pay с label=...&amount=...
+
+    python -m fakes.yoomoney --port 8765
+    YOOMONEY_API_BASE=http://127.0.0.1:8765/api/ python main.py
+"""
+import argparse, json, threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs
+
+
+class FakeYooMoney:
+    def __init__(self):
+        self.ops: List[dict] = []          # новые в конце; отдаём от новых к старым, как API
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def pay(self, label: str, amount: float, when: Optional[datetime] = None, status: str = "success") -> dict:
+        with self.lock:
+            op = {"operation_id": f"op{len(self.ops) + 1}", "status": status, "direction": "in",
+                  "type": "deposition", "label": label, "amount": float(amount), "title": "fake",
+                  "datetime": (when or datetime.utcnow()).strftime("%Y-%m-%dT%H:%M:%SZ")}
+            self.ops.append(op)
+            return op
+
+    def history(self, form: dict) -> dict:
+        self.requests += 1
+        g = lambda k: (form.get(k) or [None])[0]
+        with self.lock:
+            ops = list(reversed(self.ops))
+        if g("type"):
+            ops = [o for o in ops if o["type"] in g("type").split()]
+        if g("label"):
+            ops = [o for o in ops if o["label"] == g("label")]
+        if g("from"):
+            since = datetime.strptime(g("from"), "%Y-%m-%dT%H:%M:%S")
+            ops = [o for o in ops if datetime.strptime(o["datetime"], "%Y-%m-%dT%H:%M:%SZ") >= since]
+        start = int(g("start_record") or 0)
+        records = int(g("records") or 30)
+        page = ops[start:start + records]
+        res = {"operations": page}
+        if start + records < len(ops):
+            res["next_record"] = str(start + records)
+        return res
+
+    def start(self, port: int = 0, host: str = "127.0.0.1") -> int:
+        fake = self
+
+        class H(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode()
+                form = parse_qs(body)
+                if self.path.rstrip("/").endswith("/operation-history"):
+                    res = fake.history(form)
+                elif self.path.startswith("/fake/pay"):
+                    res = fake.pay(form["label"][0], float(form.get("amount", ["0"])[0]))
+                else:
+                    self.send_error(404); return
+                data = json.dumps(res).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *a):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), H)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.httpd.server_address[1]
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown(); self.httpd.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    a = ap.parse_args()
+    fake = FakeYooMoney()
+    port = fake.start(a.port, a.host)
+    print(f"fake yoomoney on http://{a.host}:{port}/api/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Хранилище FSM aiogram в SQLite (таблица fsm).
+
+Состояние диалога (PaymentState и данные вроде выбранной валюты) переживает
+рестарт бота и одно на все процессы — в отличие от MemoryStorage.
+Работает через общий SqlitePool.
+"""
+import json
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+FSM_SQL = """
+CREATE TABLE IF NOT EXISTS fsm (
+  key        TEXT PRIMARY KEY,
+  state      TEXT,
+  data       TEXT
+);
+"""
+
+
+def _key(k: StorageKey) -> str:
+    return f"{k.bot_id}:{k.chat_id}:{k.user_id}:{k.thread_id or ''}:{k.business_connection_id or ''}:{k.destiny}"
+
+
+class SqliteStorage(BaseStorage):
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        st = state.state if isinstance(state, State) else state
+        async with self.pool.write() as db:
+            await db.execute("INSERT INTO fsm(key,state) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET state=excluded.state",
+                             (_key(key), st))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with self.pool.read() as db:
+            cur = await db.execute("SELECT state FROM fsm WHERE key=?", (_key(key),))
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        async with self.pool.write() as db:
+            await db.execute("INSERT INTO fsm(key,data) VALUES(?,?) ON CONFLICT(key) DO UPDATE SET data=excluded.data",
+                             (_key(key), json.dumps(dict(data), ensure_ascii=False)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with self.pool.read() as db:
+            cur = await db.execute("SELECT data FROM fsm WHERE key=?", (_key(key),))
+            row = await cur.fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        pass                             # пул закрывает main()
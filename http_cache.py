@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Условные GET для эндпоинтов подписки (ETag / Last-Modified / 304).
+
+ETag самопроверяемый: "<версия конфига>.<expires_at>.<mac>", где
+mac = blake2b(key, token|extra|expires_at|версия). Связка token -> uuid
+в subscriptions неизменна, поэтому токен в mac однозначно задаёт
+(uuid, срок, версия Reality) — и If-None-Match можно подтвердить без
+похода в БД: достаточно сверить mac, текущую версию и что срок не истёк.
+Подписку, снятую раньше срока, так не увидеть — эндпоинты кладут в extra
+эпоху (время // ETAG_TTL), и со сменой эпохи запрос снова идёт в БД.
+"""
+import hashlib, hmac, time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Optional
+
+
+def sub_etag(key: bytes, token: str, exp: int, ver: str, extra: str = "") -> str:
+    mac = hashlib.blake2b(f"{token}|{extra}|{exp}|{ver}".encode(), key=key[:64], digest_size=9).hexdigest()
+    return f'"{ver}.{int(exp)}.{mac}"'
+
+
+def etag_fresh(header: Optional[str], key: bytes, token: str, ver: str,
+               now: Optional[float] = None, extra: str = "") -> Optional[str]:
+    """Совпавший актуальный ETag из If-None-Match (если подписка ещё не истекла), иначе None."""
+    if not header:
+        return None
+    now = time.time() if now is None else now
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        parts = tag.strip('"').split(".")
+        if len(parts) != 3 or parts[0] != ver or not parts[1].isdigit():
+            continue
+        exp = int(parts[1])
+        if exp > now and hmac.compare_digest(tag, sub_etag(key, token, exp, ver, extra)):
+            return tag
+    return None
+
+
+def http_date(ts: float) -> str:
+    return formatdate(ts, usegmt=True)
+
+
+def not_modified_since(header: Optional[str], last_modified: float) -> bool:
+    if not header:
+        return False
+    try:
+        return int(last_modified) <= parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+def sub_headers(etag: str, last_modified: float, update_interval_h: int) -> Dict[str, str]:
+    # no-cache: клиент может хранить ответ, но обязан ревалидировать — это дешёвый 304
+    return {"ETag": etag, "Last-Modified": http_date(last_modified),
+            "Cache-Control": "private, no-cache", "profile-update-interval": str(update_interval_h)}
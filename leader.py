@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Выбор лидера между процессами на одной машине через flock.
+
+Лидер держит эксклюзивную блокировку файла, пока жив процесс: ядро
+снимет её само при падении, так что «зависшего» лидера не бывает.
+Остальные кандидаты раз в poll секунд пробуют взять блокировку и ждут.
+"""
+import asyncio, fcntl, os, time
+from typing import Optional
+
+
+class FileLeader:
+    def __init__(self, path: str, poll: float = 2.0):
+        self.path = path
+        self.poll = poll
+        self._fd: Optional[int] = None
+        self.since = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None
+
+    def try_acquire(self) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd, self.since = fd, time.time()
+        return True
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.poll)
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def stats(self) -> dict:
+        return {"leader": self.is_leader, "pid": os.getpid(), "since": int(self.since) if self.since else None}
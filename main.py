@@ -1,41 +1,88 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os, json, time, base64, asyncio, secrets, contextlib, uuid, subprocess
-from typing import Optional, Tuple, List, Dict
-from urllib.parse import quote
+import os, json, time, asyncio, secrets, contextlib, uuid, subprocess, hashlib, tempfile, argparse, re
+from typing import Optional, Tuple, List, Dict, Set, NamedTuple, Callable, Awaitable
 from decimal import Decimal
 
-import aiosqlite
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import PlainTextResponse, HTMLResponse, RedirectResponse
-import uvicorn
+from fastapi import HTTPException, Request
+from fastapi.responses import PlainTextResponse
 
-from cryptography.hazmat.primitives.asymmetric import x25519
-from cryptography.hazmat.primitives import serialization
-
-from aiogram import Bot, Dispatcher, Router, F
+from aiogram import Bot, Dispatcher, Router, F, BaseMiddleware
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton
-from aiogram.filters import CommandStart
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
 
-from yoomoney import Client as YooClient, Quickpay
-from aiocryptopay import AioCryptoPay, Networks
+# SDK платёжек (yoomoney, aiocryptopay) импортируются лениво — в фабриках клиентов ниже
+from sub_api import (app, DB, DB_PATH, XRAY_CONFIG, XRAY_SHARDS, PUBLIC_BASE, API_HOST, API_PORT, API_WORKERS,
+                     SCHEMA_SQL, METRICS, TRACER, HEALTH, API_ROUTES, TRAFFIC_QUOTA, _shards, _load_xray, _cfg_stamp,
+                     _get_reality_inbound, _set_reality, node_view)
+from xray_ctl import XrayController
+from expiry import ExpiryScheduler
+from yoo_reconcile import YooReconciler
+from crypto_batch import CryptoBatcher
+from singleflight import SingleFlight
+from outbox import OUTBOX_SQL, Outbox, Reminders
+from tg_webhook import WebhookFeeder
+from xray_jobs import XRAY_JOBS_SQL, JobQueue, JobRunner
+from traffic import TRAFFIC_SQL, USER_PREFIX, TrafficCollector
+from nodes import NODES_SQL, NodeSync, NodeProber, assign as assign_nodes, revoke as revoke_nodes
+from leader import FileLeader
+from fsm_sqlite import FSM_SQL, SqliteStorage
+from metrics import SLOW_BUCKETS
+from tracing import SPAN_KIND_CLIENT
+from pay_hooks import CRYPTO_SIG_HEADER, cryptobot_verify, parse_form, yoomoney_verify, yoomoney_accepted
 
 # ===================== Конфигурация =====================
 BOT_TOKEN   = os.getenv("BOT_TOKEN", "CHANGE_ME")
 
-DB_PATH     = os.getenv("DB_PATH", "/root/rel/bot_database.db")
-XRAY_CONFIG = os.getenv("XRAY_CONFIG", "/usr/local/etc/xray/config.json")
+# DB_PATH, XRAY_CONFIG, XRAY_SHARDS, PUBLIC_*/API_* и прочее, что нужно API подписок, — в sub_api.py
 XRAY_SERVICE= os.getenv("XRAY_SERVICE", "xray")
-
-PUBLIC_HOST = os.getenv("PUBLIC_HOST", "127.0.0.1")
-PUBLIC_BASE = os.getenv("PUBLIC_BASE", f"http://{PUBLIC_HOST}:8001")  # все ссылки, пока нет nginx
-API_HOST    = os.getenv("API_HOST", "0.0.0.0")
-API_PORT    = int(os.getenv("API_PORT", "8001"))
+# file — правим конфиг и делаем reload; api — пользователи добавляются через gRPC HandlerService
+# без reload, а конфиг пишется только как постоянная копия
+XRAY_BACKEND  = os.getenv("XRAY_BACKEND", "file")
+XRAY_API_ADDR = os.getenv("XRAY_API_ADDR", "127.0.0.1:10085")
+XRAY_BATCH_WINDOW = float(os.getenv("XRAY_BATCH_WINDOW", "0.2"))  # окно склейки мутаций, сек
+EXPIRY_HORIZON    = int(os.getenv("EXPIRY_HORIZON", "3600"))       # сколько секунд вперёд держать в heap
+# учёт трафика из StatsService Xray (traffic.py, нужен XRAY_API_ADDR при любом XRAY_BACKEND):
+# период опроса, сек (0 — выключен) и сроки хранения минутных/часовых/дневных точек, дней
+TRAFFIC_INTERVAL = float(os.getenv("TRAFFIC_INTERVAL", "0"))
+TRAFFIC_KEEP     = [int(float(x)*86400) for x in os.getenv("TRAFFIC_KEEP_DAYS", "2,90,730").split(",")]
+# несколько серверов (nodes.py, реестр — `python nodes.py add ...`): клиенты ставятся на узлы через их gRPC API.
+# Период прохода очереди node_clients и проверок здоровья, таймаут вызова API узла, сек
+NODE_SYNC_INTERVAL  = float(os.getenv("NODE_SYNC_INTERVAL", "1"))
+NODE_PROBE_INTERVAL = float(os.getenv("NODE_PROBE_INTERVAL", "10"))
+NODE_API_TIMEOUT    = float(os.getenv("NODE_API_TIMEOUT", "5"))
+# на сколько узлов ставить новую подписку (placement.py: по ёмкости и загрузке); 0 — на все.
+# Тот же NODE_REPLICAS нужен `nodes.py add/set/rebalance`, чтобы перераспределять существующих
+NODE_REPLICAS       = int(os.getenv("NODE_REPLICAS", "0"))
+
+# топология процессов: all — всё в одном; api — uvicorn с API_WORKERS процессами; bot — только бот;
+# worker — фоновые задачи. Конфиг Xray, истечение и рассылки ведёт один лидер (flock на LEADER_LOCK),
+# остальные кладут мутации Xray в таблицу xray_jobs
+ROLE        = os.getenv("ROLE", "all")
+LEADER_LOCK = os.getenv("LEADER_LOCK", f"{DB_PATH}.leader")
+
+# бот: polling (по умолчанию) или webhook — апдейты приходят на тот же uvicorn, что и API
+BOT_MODE        = os.getenv("BOT_MODE", "polling")
+WEBHOOK_PATH    = os.getenv("WEBHOOK_PATH", "/tg/webhook")
+WEBHOOK_URL     = os.getenv("WEBHOOK_URL", f"{PUBLIC_BASE}{WEBHOOK_PATH}")   # снаружи нужен https (nginx)
+WEBHOOK_SECRET  = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook|{BOT_TOKEN}".encode()).hexdigest()[:48]
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))    # параллельно обрабатываемых апдейтов
+WEBHOOK_QUEUE   = int(os.getenv("WEBHOOK_QUEUE", "1000"))    # больше — 503, Telegram повторит
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "")       # свой Bot API server или fakes.telegram
+
+# рассылки/напоминания (см. outbox.py): лимиты Telegram ~30 msg/s на бота, ~1 msg/s в чат
+ADMIN_IDS       = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ","").split(",") if x}
+OUTBOX_RATE     = float(os.getenv("OUTBOX_RATE", "25"))
+OUTBOX_PER_CHAT = float(os.getenv("OUTBOX_PER_CHAT", "1"))
+REMIND_INTERVAL = float(os.getenv("REMIND_INTERVAL", "60"))
 
 # Цены (руб.)
 PRICE_7D  = float(os.getenv("PRICE_7D",  "40"))
@@ -51,11 +98,17 @@ YOOMONEY_FEE_PERCENT  = float(os.getenv("YOOMONEY_FEE_PERCENT", "0.05"))
 # YooMoney
 YOOMONEY_WALLET = os.getenv("YOOMONEY_WALLET", "4100118758572112")
 YOOMONEY_TOKEN  = os.getenv("YOOMONEY_TOKEN",  "CHANGE_ME")
+YOOMONEY_API_BASE    = os.getenv("YOOMONEY_API_BASE", "")         # пусто — боевой https://yoomoney.ru/api/
+YOOMONEY_POLL_SEC    = float(os.getenv("YOOMONEY_POLL_SEC", "20"))  # период фоновой сверки истории
+YOOMONEY_NOTIFY_SECRET = os.getenv("YOOMONEY_NOTIFY_SECRET", "")  # секрет HTTP-уведомлений; пусто — вебхук выключен
+YOOMONEY_PENDING_TTL = int(os.getenv("YOOMONEY_PENDING_TTL", str(3*86400)))  # старше — больше не ищем
 
 # CryptoBot (инвойсы в фиате RUB)
 CRYPTO_TOKEN    = os.getenv("CRYPTO_TOKEN", "CHANGE_ME")
 CRYPTO_NETWORK  = os.getenv("CRYPTO_NETWORK", "TEST_NET")  # TEST_NET | MAIN_NET
 CRYPTO_ACCEPTED = os.getenv("CRYPTO_ACCEPTED", "USDT,TON,BTC,ETH,BNB,TRX")  # или "all"
+CRYPTO_BATCH_WINDOW = float(os.getenv("CRYPTO_BATCH_WINDOW", "0.5"))  # склейка проверок в один getInvoices
+CRYPTO_CACHE_TTL    = float(os.getenv("CRYPTO_CACHE_TTL", "5"))       # сколько верим ответу про неоплаченный инвойс
 
 PLANS = {
     "7d":  {"title": "7 дней",    "days": 7,   "price": PRICE_7D},
@@ -65,147 +118,170 @@ PLANS = {
     "12m": {"title": "12 месяцев","days": 365, "price": PRICE_12M},
 }
 
-# ===================== База =====================
-SCHEMA_SQL = """
-CREATE TABLE IF NOT EXISTS users (
-  user_id    INTEGER PRIMARY KEY,
-  balance    REAL NOT NULL DEFAULT 0
-);
-CREATE TABLE IF NOT EXISTS subscriptions (
-  token      TEXT PRIMARY KEY,
-  user_id    INTEGER NOT NULL,
-  uuid       TEXT NOT NULL,
-  expires_at INTEGER NOT NULL
-);
-CREATE TABLE IF NOT EXISTS referrals (
-  user_id    INTEGER PRIMARY KEY,
-  ref_by     INTEGER
-);
-CREATE TABLE IF NOT EXISTS payments (
-  payment_id TEXT PRIMARY KEY,
-  user_id    INTEGER NOT NULL,
-  method     TEXT NOT NULL,
-  plan_id    TEXT,
-  amount     REAL NOT NULL,
-  currency   TEXT NOT NULL,
-  status     TEXT NOT NULL,
-  meta       TEXT,
-  created_at INTEGER NOT NULL
-);
-CREATE INDEX IF NOT EXISTS idx_pay_user ON payments(user_id);
-"""
+# ===================== Метрики (/metrics) ===============
+# реестр, HTTP/SQLite-метрики и трассировщик — общие с API подписок (sub_api.py)
+M_XRAY_SAVE=METRICS.histogram("xray_config_write_seconds", "Запись конфига Xray", ["mode"], buckets=SLOW_BUCKETS)
+M_XRAY_RELOAD=METRICS.histogram("xray_reload_seconds", "systemctl reload/restart xray", buckets=SLOW_BUCKETS)
+M_PROVIDER=METRICS.histogram("payment_provider_seconds", "Вызовы API платёжек", ["provider","method"], buckets=SLOW_BUCKETS)
+M_PROVIDER_ERR=METRICS.counter("payment_provider_errors_total", "Ошибки вызовов API платёжек", ["provider","method"])
+M_BOT=METRICS.histogram("bot_handler_seconds", "Обработчики бота по префиксу callback_data / команде", ["handler"], max_series=100)
+
+TRACER.resource["process.role"]=ROLE
+
+def _provider_observer(provider:str):
+    def observe(method:str, secs:float, ok:bool):
+        M_PROVIDER.observe(secs, provider, method)
+        if not ok: M_PROVIDER_ERR.inc(provider, method)
+        TRACER.record(f"{provider}.{method}", secs, kind=SPAN_KIND_CLIENT, error="" if ok else "failed")
+    return observe
+
+@contextlib.contextmanager
+def _provider_timer(provider:str, method:str):
+    t0=time.perf_counter()
+    try:
+        with TRACER.span(f"{provider}.{method}", kind=SPAN_KIND_CLIENT): yield
+    except BaseException:
+        M_PROVIDER_ERR.inc(provider, method); raise
+    finally: M_PROVIDER.observe(time.perf_counter()-t0, provider, method)
 
 async def db_init():
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.executescript(SCHEMA_SQL)
-        await db.commit()
+    await DB.open(SCHEMA_SQL + TRAFFIC_SQL + NODES_SQL + OUTBOX_SQL + XRAY_JOBS_SQL + FSM_SQL)
 
 async def ensure_user(uid:int, ref_by:Optional[int]=None):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur=await db.execute("SELECT 1 FROM users WHERE user_id=?", (uid,))
-        if not await cur.fetchone():
-            await db.execute("INSERT INTO users(user_id,balance) VALUES(?,0)", (uid,))
+    async with DB.write() as db:
+        await db.execute("INSERT OR IGNORE INTO users(user_id,balance) VALUES(?,0)", (uid,))
         if ref_by and ref_by!=uid:
-            cur2=await db.execute("SELECT 1 FROM referrals WHERE user_id=?", (uid,))
-            if not await cur2.fetchone():
-                await db.execute("INSERT INTO referrals(user_id,ref_by) VALUES(?,?)", (uid, ref_by))
-        await db.commit()
+            await db.execute("INSERT OR IGNORE INTO referrals(user_id,ref_by) VALUES(?,?)", (uid, ref_by))
 
 async def add_balance(uid:int, delta:float):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB.write() as db:
         await db.execute("UPDATE users SET balance=balance+? WHERE user_id=?", (delta, uid))
-        await db.commit()
 
 async def get_balance(uid:int)->float:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB.read() as db:
         cur=await db.execute("SELECT balance FROM users WHERE user_id=?", (uid,))
         row=await cur.fetchone()
     return float(row[0]) if row else 0.0
 
 async def get_referrer(uid:int)->Optional[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB.read() as db:
         cur=await db.execute("SELECT ref_by FROM referrals WHERE user_id=?", (uid,))
         row=await cur.fetchone()
         return int(row[0]) if row and row[0] is not None else None
 
-# ================= Reality / XRAY =================
-def _b64u(b:bytes)->str: return base64.urlsafe_b64encode(b).decode().rstrip("=")
-
-def pbk_from_private_key(pk_str:str)->str:
-    raw=None
-    with contextlib.suppress(Exception): raw=base64.urlsafe_b64decode(pk_str+"==")
-    if raw is None:
-        with contextlib.suppress(Exception): raw=bytes.fromhex(pk_str)
-    if raw is None or len(raw)!=32:
-        raise ValueError("Reality privateKey должен быть 32 байта (base64url/hex).")
-    priv=x25519.X25519PrivateKey.from_private_bytes(raw)
-    pub=priv.public_key().public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
-    return _b64u(pub)
-
-def _load_xray()->dict:
-    with open(XRAY_CONFIG,"r",encoding="utf-8") as f: return json.load(f)
-
+# ================= Reality / XRAY (запись) =================
+# чтение конфига и снапшот Reality-параметров — в sub_api.py
 def _save_xray(data:dict):
-    tmp="/tmp/xray_cfg_tmp.json"
-    with open(tmp,"w",encoding="utf-8") as f: json.dump(data,f,ensure_ascii=False,indent=2)
-    os.replace(tmp, XRAY_CONFIG)
-
-def _reload_xray():
+    with M_XRAY_SAVE.time("file"), TRACER.span("xray.write", mode="file"): _write_xray(data)
+    # мы только что записали конфиг сами — пересобираем снапшот из data без повторного парсинга
+    with contextlib.suppress(Exception): _set_reality(data, _cfg_stamp(os.stat(XRAY_CONFIG)))
+
+def _write_xray(data:dict):
+    # временный файл в той же директории: os.replace атомарен только в пределах одной ФС
+    d=os.path.dirname(os.path.abspath(XRAY_CONFIG))
+    fd,tmp=tempfile.mkstemp(prefix=".xray_cfg_", suffix=".json", dir=d)
     try:
-        subprocess.run(["systemctl","reload",XRAY_SERVICE], check=True)
-    except Exception:
-        subprocess.run(["systemctl","restart",XRAY_SERVICE], check=False)
-
-def _get_reality_inbound(data:dict):
-    for ib in data.get("inbounds",[]):
-        ss=ib.get("streamSettings",{}) or {}
-        if ss.get("security")=="reality" or ss.get("realitySettings"):
-            return ib
-    return None
+        with os.fdopen(fd,"w",encoding="utf-8") as f:
+            json.dump(data,f,ensure_ascii=False,indent=2); f.flush(); os.fsync(f.fileno())
+        with contextlib.suppress(OSError): os.chmod(tmp, os.stat(XRAY_CONFIG).st_mode & 0o777)
+        os.replace(tmp, XRAY_CONFIG)
+    except BaseException:
+        with contextlib.suppress(OSError): os.unlink(tmp)
+        raise
 
-def read_xray_reality()->Tuple[int,str,str,str,str]:
-    data=_load_xray()
-    inbound=_get_reality_inbound(data)
-    if not inbound: raise RuntimeError("Reality inbound не найден")
-    port=int(inbound.get("port"))
-    network=(inbound.get("streamSettings",{}) or {}).get("network","tcp")
-    rs=(inbound.get("streamSettings",{}) or {}).get("realitySettings",{}) or {}
-    sni=(rs.get("serverNames") or [""])[0]
-    sid=(rs.get("shortIds") or [""])[0]
-    pk=rs.get("privateKey") or ""
-    pbk=pbk_from_private_key(pk) if pk else ""
-    return port, network, sni, sid, pbk
-
-def xray_add_client(new_uuid:str):
+def _reload_xray():
+    with M_XRAY_RELOAD.time(), TRACER.span("xray.reload", service=XRAY_SERVICE):
+        try:
+            subprocess.run(["systemctl","reload",XRAY_SERVICE], check=True)
+        except Exception:
+            subprocess.run(["systemctl","restart",XRAY_SERVICE], check=False)
+
+def _xray_client(u:str)->dict: return {"id": u, "email": u, "flow": "xtls-rprx-vision"}
+
+_xray_clients:Optional[int]=None      # клиентов в конфиге после последней записи (метрика)
+
+def _xray_persist(adds:Dict[str,dict], removes:Set[str])->Tuple[bool,List[Tuple[str,dict]],List[Tuple[str,dict]]]:
+    """Записать пачку в конфиг. Возвращает (изменился ли файл, [(tag, добавленный)], [(tag, удалённый)])."""
+    global _xray_clients
+    if XRAY_SHARDS>1:
+        st=_shards()
+        with M_XRAY_SAVE.time("shards"), TRACER.span("xray.write", mode="shards"): touched, added, removed = st.apply(adds, removes)
+        _xray_clients=sum(st.counts)
+        if 0 in touched:
+            with contextlib.suppress(Exception): _set_reality(st.docs[0], st.stamps[0])
+        return bool(touched), added, removed
     data=_load_xray()
     inbound=_get_reality_inbound(data)
-    if not inbound: raise RuntimeError("Reality inbound не найден")
+    if not inbound:
+        if adds: raise RuntimeError("Reality inbound не найден")
+        return False, [], []
+    tag=inbound.get("tag") or ""
     settings=inbound.setdefault("settings",{})
     clients=settings.setdefault("clients",[])
-    if any(c.get("id")==new_uuid for c in clients): return
-    clients.append({"id": new_uuid, "flow": "xtls-rprx-vision"})
-    _save_xray(data); _reload_xray()
+    removed=[]; added=[]
+    if removes:
+        new_clients=[]
+        for c in clients:
+            if c.get("id") in removes: removed.append((tag,c))
+            else: new_clients.append(c)
+        if removed: settings["clients"]=clients=new_clients
+    if adds:
+        have={c.get("id") for c in clients}
+        for u,c in adds.items():
+            if u not in have: clients.append(c); have.add(u); added.append((tag,c))
+    changed=bool(added or removed)
+    if changed: _save_xray(data)
+    _xray_clients=len(clients)
+    return changed, added, removed
+
+_xray_apis:Dict[str,object]={}
+
+def _node_api(addr:str):
+    """gRPC-клиент Xray по адресу (канал на адрес, потокобезопасен): локальный XRAY_API_ADDR и узлы реестра."""
+    api=_xray_apis.get(addr)
+    if api is None:
+        from xray_api import XrayApi
+        api=_xray_apis[addr]=XrayApi(addr, timeout=NODE_API_TIMEOUT)
+    return api
+
+def _get_xray_api(): return _node_api(XRAY_API_ADDR)
+
+def _xray_apply_api(adds:Dict[str,dict], removes:Set[str])->bool:
+    """Живые изменения через HandlerService. False — нужен reload (нет tag/email или API недоступен)."""
+    changed, added, removed = _xray_persist(adds, removes)
+    if not changed: return True
+    if any(not tag for tag,_ in added+removed): return False
+    api=_get_xray_api()
+    try:
+        for tag,c in added:
+            api.add_user(tag, c["id"], c.get("email") or c["id"], c.get("flow",""))
+        for tag,c in removed:
+            if not c.get("email"): return False   # старые клиенты без email удалить через API нельзя
+            api.remove_user(tag, c["email"])
+    except Exception:
+        return False
+    return True
+
+def xray_apply(adds:Dict[str,dict], removes:Set[str]):
+    """Применить пачку мутаций: одно чтение, одна атомарная запись и один reload (или вызовы API) на пачку."""
+    if not adds and not removes: return
+    if XRAY_BACKEND=="api":
+        if not _xray_apply_api(adds, removes): _reload_xray()
+        return
+    changed, _, _ = _xray_persist(adds, removes)
+    if changed: _reload_xray()
 
-def xray_remove_client(rm_uuid:str):
-    data=_load_xray()
-    inbound=_get_reality_inbound(data)
-    if not inbound: return
-    settings=inbound.setdefault("settings",{})
-    clients=settings.setdefault("clients",[])
-    new_clients=[c for c in clients if c.get("id")!=rm_uuid]
-    if len(new_clients)!=len(clients):
-        settings["clients"]=new_clients
-        _save_xray(data); _reload_xray()
-
-def build_vless(host,port,uuid,network,sni,sid,pbk,vision:bool,name:Optional[str]):
-    base=f"vless://{uuid}@{host}:{port}?type={network}&security=reality&fp=chrome&alpn=h2,http/1.1"
-    if pbk: base+=f"&pbk={pbk}"
-    if sni: base+=f"&sni={sni}"
-    if sid: base+=f"&sid={sid}"
-    if vision: base+="&flow=xtls-rprx-vision"; name=name or "Reality Vision"
-    else: name=name or "Reality NoFlow"
-    return f"{base}#{name}"
+def xray_add_client(new_uuid:str): xray_apply({new_uuid: _xray_client(new_uuid)}, set())
+
+def xray_remove_client(rm_uuid:str): xray_apply({}, {rm_uuid})
+
+def _xray_apply_traced(adds:Dict[str,dict], removes:Set[str]):
+    # пачка применяется в потоке контроллера, вне трассы вызвавшего — своя корневая
+    with TRACER.root("xray.apply", adds=len(adds), removes=len(removes), backend=XRAY_BACKEND): xray_apply(adds, removes)
+
+# единственный писатель конфига: мутации из бота/GC склеиваются в пачки и применяются вне event loop
+XRAY=XrayController(_xray_apply_traced, window=XRAY_BATCH_WINDOW)
 
 # ================ v2RayTun URLs/Keyboard ================
 def _urls(token:str)->dict:
@@ -221,118 +297,137 @@ def kb_v2raytun(token)->InlineKeyboardMarkup:
         [InlineKeyboardButton(text="📄 Текст подписки (ручной импорт)", url=u["sub_txt"])],
     ])
 
-def text_v2raytun(token)->str:
+async def text_v2raytun(token)->str:
     u=_urls(token)
+    profiles=("Импортируется по профилю на каждый ваш сервер." if (await node_view()).nodes
+              else "Импортируются 2 профиля: NoFlow и Vision.")
     return ("Ключ готов! ✨\n\n"
             "1) Откройте страницу и нажмите «Добавить в v2RayTun».\n"
             "2) Если deep-link не сработал — импортируйте вручную:\n"
             f"{u['sub_txt']}\n\n"
-            "Импортируются 2 профиля: NoFlow и Vision.")
+            f"{profiles}")
 
 # ================== выдача/истечение ==================
-async def create_subscription(uid:int, days:int)->str:
+async def _insert_subscription(db, uid:int, seconds:int)->Tuple[str,str,int]:
+    """INSERT в уже открытой транзакции писателя; Xray и планировщик — забота вызывающего.
+    Узлы реестра получают uuid через node_clients в той же транзакции."""
     new_uuid=str(uuid.uuid4())
-    xray_add_client(new_uuid)
     token=secrets.token_urlsafe(24)
-    now=int(time.time()); exp=now + days*86400
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO subscriptions(token,user_id,uuid,expires_at) VALUES(?,?,?,?)",
-            (token, uid, new_uuid, exp)
-        )
-        await db.commit()
+    exp=int(time.time()) + seconds
+    await db.execute(
+        "INSERT OR REPLACE INTO subscriptions(token,user_id,uuid,expires_at) VALUES(?,?,?,?)",
+        (token, uid, new_uuid, exp)
+    )
+    await assign_nodes(db, new_uuid, NODE_REPLICAS)
+    return token, new_uuid, exp
+
+async def _provision(token:str, new_uuid:str, exp:int):
+    """Клиент в Xray + таймер истечения. Не лидер — задание в xray_jobs, применит лидер."""
+    if not LEADER.is_leader:
+        with TRACER.span("xray_jobs.add"): await JOBS.add(new_uuid, _xray_client(new_uuid), token, exp)
+        return
+    with TRACER.span("xray.add"): await XRAY.add(new_uuid, _xray_client(new_uuid))
+    EXPIRY.schedule(token, new_uuid, exp)
+    NODE_SYNC.kick()
+
+async def create_subscription(uid:int, days:int, seconds:int=0)->str:
+    async with DB.write() as db:
+        token, new_uuid, exp = await _insert_subscription(db, uid, days*86400 + seconds)
+    await _provision(token, new_uuid, exp)
     return token
 
-async def get_sub(token:str):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur=await db.execute("SELECT user_id, uuid, expires_at FROM subscriptions WHERE token=?", (token,))
-        return await cur.fetchone()
+async def _load_expiring(until:int)->List[Tuple[int,str,str]]:
+    async with DB.read() as db:
+        cur=await db.execute("SELECT expires_at, token, uuid FROM subscriptions WHERE expires_at<=?", (until,))
+        return await cur.fetchall()
+
+async def expire_batch(rows:List[Tuple[int,str,str]]):
+    """Снять пачку истёкших: одно обновление Xray, затем одна транзакция в БД."""
+    with TRACER.root("expiry.batch", subs=len(rows)):
+        with TRACER.span("xray.remove_many"): await XRAY.remove_many(u for _, _, u in rows)
+        async with DB.write() as db:
+            await db.executemany("DELETE FROM subscriptions WHERE token=? AND expires_at<=?",
+                                 [(tkn, exp) for exp, tkn, _ in rows])
+            await revoke_nodes(db, [u for _, _, u in rows])
+        NODE_SYNC.kick()
+
+EXPIRY=ExpiryScheduler(_load_expiring, expire_batch, horizon=EXPIRY_HORIZON)
+
+LEADER=FileLeader(LEADER_LOCK)
+NODE_SYNC=NodeSync(DB, _node_api, interval=NODE_SYNC_INTERVAL)
+NODE_PROBER=NodeProber(DB, _node_api, interval=NODE_PROBE_INTERVAL, timeout=NODE_API_TIMEOUT, on_change=NODE_SYNC.kick)
+JOBS=JobQueue(DB)
+JOB_RUNNER=JobRunner(DB, XRAY, EXPIRY.schedule)
 
 async def expire_gc_loop():
-    while True:
-        try:
-            now=int(time.time())
-            async with aiosqlite.connect(DB_PATH) as db:
-                cur=await db.execute("SELECT token, uuid FROM subscriptions WHERE expires_at<=?", (now,))
-                rows=await cur.fetchall()
-                if rows:
-                    for tkn, u in rows:
-                        xray_remove_client(u)
-                    await db.execute("DELETE FROM subscriptions WHERE expires_at<=?", (now,))
-                    await db.commit()
-        except Exception:
-            pass
-        await asyncio.sleep(60)
+    await EXPIRY.run()
+
+def _traffic_query()->Dict[str,int]:
+    """Счётчики со всех серверов: локальный XRAY_API_ADDR и узлы реестра. Недоступный сервер пропускается —
+    его счётчики не обнулены и придут в следующий проход."""
+    addrs=list(dict.fromkeys([XRAY_API_ADDR]+[n.api for n in NODE_SYNC.nodes.values()]))
+    out:Dict[str,int]={}; errors=[]
+    for addr in addrs:
+        try: stats=_node_api(addr).query_stats(USER_PREFIX, reset=True)
+        except Exception as e:
+            errors.append(f"{addr}: {e!r}"); continue
+        for k,v in stats.items(): out[k]=out.get(k,0)+v
+    if len(errors)==len(addrs): raise RuntimeError("; ".join(errors))
+    return out
+
+# выбравшие квоту TRAFFIC_QUOTA_GB снимаются тем же путём, что и истёкшие
+TRAFFIC=TrafficCollector(DB, _traffic_query, expire_batch, interval=TRAFFIC_INTERVAL, quota=TRAFFIC_QUOTA, keep=TRAFFIC_KEEP)
 
 # ====================== FastAPI =========================
-app=FastAPI(title="rel v2raytun")
-
-@app.get("/health")
-async def health(): return {"ok":True,"ts":int(time.time())}
-
-@app.get("/sub/{token}", response_class=PlainTextResponse)
-async def sub_plain(token:str):
-    row=await get_sub(token)
-    if not row: raise HTTPException(404,"Token not found")
-    uid, user_uuid, exp = int(row[0]), row[1], int(row[2])
-    if exp <= int(time.time()):
-        raise HTTPException(410, "Subscription expired")
-    port,network,sni,sid,pbk=read_xray_reality()
-    v_no  = build_vless(PUBLIC_HOST,port,user_uuid,network,sni,sid,pbk,False,f"user{uid}-NoFlow")
-    v_vis = build_vless(PUBLIC_HOST,port,user_uuid,network,sni,sid,pbk,True ,f"user{uid}-Vision")
-    return PlainTextResponse(v_no+"\n"+v_vis, media_type="text/plain; charset=utf-8")
-
-@app.get("/sub_v2raytun/{token}", response_class=PlainTextResponse)
-async def sub_v2(token:str): return await sub_plain(token)
-
-@app.get("/subs/{token}", response_class=HTMLResponse)
-async def subs_page(token:str):
-    row=await get_sub(token)
-    uid, exp = (int(row[0]), int(row[2])) if row else (None, None)
-    now=int(time.time())
-    if not uid: status="<span style='color:#e67e22'>Не найдена</span>"
-    elif exp and exp<=now: status="<span style='color:#e74c3c'>Истекла</span>"
-    else: status="<span style='color:#2ecc71'>Активна</span>"
-
-    sub_url=f"{PUBLIC_BASE}/sub_v2raytun/{token}"
-    deep=f"v2raytun://import-sub?url={sub_url}"
-    html=f"""<!doctype html><html lang="ru"><head><meta charset="utf-8"/>
-<meta name="viewport" content="width=device-width, initial-scale=1"/><title>Подписка</title>
-<style>body{{font-family:system-ui,Segoe UI,Roboto,Ubuntu,sans-serif;background:#0b0f14;color:#fff;margin:0}}
-.wrap{{max-width:720px;margin:28px auto;padding:0 16px}}.card{{background:#0f151d;border:1px solid #1f2a38;border-radius:14px;padding:16px;margin:14px 0}}
-.btn{{display:inline-block;background:#1e90ff;color:#fff;padding:12px 16px;border-radius:12px;text-decoration:none}}</style>
-</head><body><div class="wrap"><h2>Подписка</h2>
-<div class="card">Статус: {status}</div>
-<div class="card">
-  <p><a class="btn" href="{deep}">Добавить подписку в v2RayTun</a></p>
-  <p style="opacity:.7">Если deep-link не сработал — импортируйте вручную:<br/><code>{sub_url}</code></p>
-</div></div></body></html>"""
-    return HTMLResponse(html)
-
-@app.get("/v2raytun_import_one/{token}")
-async def v2raytun_import_one(token:str, vision:int=0):
-    text=await sub_plain(token); links=text.body.decode().splitlines()
-    url=links[1] if vision else links[0]
-    return RedirectResponse(f"v2raytun://import/{quote(url, safe='')}")
+# приложение и маршруты подписок — sub_api.app; здесь добавляются вебхуки и секции /health
+HEALTH.update({"role":lambda: ROLE, "xray":lambda: XRAY.stats(), "expiry":lambda: EXPIRY.stats(),
+               "crypto":lambda: CRYPTO.stats(), "pay_checks":lambda: PAY_FLIGHT.stats(), "outbox":lambda: OUTBOX.stats(),
+               "tg_webhook":lambda: FEEDER.stats() if FEEDER else None, "leader":lambda: LEADER.stats(),
+               "jobs":lambda: JOB_RUNNER.stats() if LEADER.is_leader else JOBS.stats(),
+               "traffic":lambda: TRAFFIC.stats() if LEADER.is_leader and TRAFFIC_INTERVAL>0 else None,
+               "nodes":lambda: {**NODE_SYNC.stats(), "probe":NODE_PROBER.stats()} if LEADER.is_leader else None})
+API_ROUTES.extend(("/pay", "/"+WEBHOOK_PATH.strip("/").split("/")[0]))
+
+# --- gauges: считаются при скрейпе ---
+def _count_xray_clients()->int:
+    if XRAY_SHARDS>1: return sum(_shards().counts)
+    ib=_get_reality_inbound(_load_xray()) or {}
+    return len(ib.get("settings",{}).get("clients",[]))
+
+async def _xray_clients_gauge()->Optional[int]:
+    global _xray_clients
+    if not LEADER.is_leader: return None            # конфиг ведёт только лидер
+    if _xray_clients is None: _xray_clients=await asyncio.to_thread(_count_xray_clients)
+    return _xray_clients
+
+def _expiry_gauge(key:str):
+    return lambda: EXPIRY.stats()[key] if LEADER.is_leader else None
+
+METRICS.gauge("xray_clients", "Клиентов в конфиге Xray (только лидер)", _xray_clients_gauge)
+METRICS.gauge("expiry_pending", "Таймеров истечения в heap (только лидер)", _expiry_gauge("pending"))
+for _k in ("lag_last_s","lag_max_s","lag_avg_s"):
+    METRICS.gauge(f"expiry_{_k}", "Опоздание снятия истёкших ключей, с (только лидер)", _expiry_gauge(_k))
 
 # ====================== Payments =========================
 async def _record_payment(payment_id:str, user_id:int, method:str, plan_id:Optional[str], amount:float, currency:str, status:str, meta:str=""):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with DB.write() as db:
         await db.execute(
             "INSERT OR REPLACE INTO payments(payment_id,user_id,method,plan_id,amount,currency,status,meta,created_at) VALUES(?,?,?,?,?,?,?,?,?)",
             (payment_id, user_id, method, plan_id, amount, currency, status, meta, int(time.time()))
         )
-        await db.commit()
 
-async def _credit_referral(user_id:int, net_rub:float):
-    ref = await get_referrer(user_id)
-    if ref:
+async def _credit_referral(db, user_id:int, net_rub:float):
+    """Бонус пригласившему — внутри транзакции выдачи (db — соединение писателя)."""
+    cur=await db.execute("SELECT ref_by FROM referrals WHERE user_id=?", (user_id,))
+    row=await cur.fetchone()
+    if row and row[0] is not None:
         bonus = max(0.0, round(net_rub * REFERRAL_PERCENT, 2))
         if bonus > 0:
-            await add_balance(ref, bonus)
+            await db.execute("UPDATE users SET balance=balance+? WHERE user_id=?", (bonus, int(row[0])))
 
 # --- YooMoney ---
 def _yoo_make_link(user_id:int, plan_id:str, amount_rub:float)->tuple[str,str]:
+    from yoomoney import Quickpay
     label=f"ym_{user_id}_{plan_id}_{secrets.token_hex(6)}"
     qp=Quickpay(
         receiver=YOOMONEY_WALLET, quickpay_form="shop",
@@ -340,20 +435,52 @@ def _yoo_make_link(user_id:int, plan_id:str, amount_rub:float)->tuple[str,str]:
     )
     return qp.redirected_url, label
 
+async def _yoo_pending()->Dict[str,int]:
+    since=int(time.time())-YOOMONEY_PENDING_TTL
+    async with DB.read() as db:
+        cur=await db.execute("SELECT payment_id, created_at FROM payments WHERE method='yoomoney' AND status='pending' AND created_at>=?", (since,))
+        return {r[0]: int(r[1]) for r in await cur.fetchall()}
+
+async def _yoo_mark_paid(found:List[Tuple[str,float,str]]):
+    async with DB.write() as db:
+        await db.executemany(
+            "UPDATE payments SET status='paid', amount=?, meta=? WHERE payment_id=? AND method='yoomoney' AND status='pending'",
+            [(amount, f"op:{op_id}", label) for label, amount, op_id in found]
+        )
+
+def _yoo_client():
+    from yoomoney import Client
+    return Client(YOOMONEY_TOKEN, base_url=YOOMONEY_API_BASE or None)
+
+# один клиент и один проход по истории на все ожидающие платежи (см. yoo_reconcile.py)
+YOO=YooReconciler(_yoo_client,
+                  _yoo_pending, _yoo_mark_paid, interval=YOOMONEY_POLL_SEC)
+YOO.observe=_provider_observer("yoomoney")
+
+async def _yoo_status(label:str)->Tuple[Optional[str],float]:
+    async with DB.read() as db:
+        cur=await db.execute("SELECT status, amount FROM payments WHERE payment_id=?", (label,))
+        row=await cur.fetchone()
+    return (row[0], float(row[1])) if row else (None, 0.0)
+
 async def _yoo_check_paid(label:str)->Optional[float]:
-    loop=asyncio.get_running_loop()
-    def _check():
-        client=YooClient(YOOMONEY_TOKEN)
-        ops=client.operation_history(label=label)
-        for op in ops.operations or []:
-            if getattr(op,"label",None)==label and op.status=="success" and op.direction=="in":
-                return float(op.amount)
-        return None
-    return await loop.run_in_executor(None, _check)
+    """Локальная проверка: статус в payments проставляет фоновый сверщик YOO."""
+    status, amount = await _yoo_status(label)
+    if status=="pending":
+        await YOO.refresh()            # внеочередной проход, если давно не ходили в API
+        status, amount = await _yoo_status(label)
+    return amount if status in ("paid","credited") else None
 
 # --- CryptoBot общие ---
-def _cp_net():
-    return Networks.MAIN_NET if CRYPTO_NETWORK.upper()=="MAIN_NET" else Networks.TEST_NET
+def _crypto_client():
+    from aiocryptopay import AioCryptoPay, Networks
+    net=Networks.MAIN_NET if CRYPTO_NETWORK.upper()=="MAIN_NET" else Networks.TEST_NET
+    return AioCryptoPay(token=CRYPTO_TOKEN, network=net)
+
+# один клиент (одна сессия) на всё приложение; создаётся при первом обращении, закрывается в main()
+CRYPTO=CryptoBatcher(_crypto_client,
+                     window=CRYPTO_BATCH_WINDOW, ttl=CRYPTO_CACHE_TTL)
+CRYPTO.observe=_provider_observer("cryptobot")
 
 def _accepted_assets():
     s = CRYPTO_ACCEPTED.strip()
@@ -363,7 +490,8 @@ def _accepted_assets():
 
 async def _crypto_create_invoice_fiat(amount_rub: float, description: str, accepted: List[str] | str, swap_to: Optional[str]=None):
     """Создаёт фиат-инвойс в RUB. Если swap_to не поддерживается — тихо повторяет без него."""
-    async with AioCryptoPay(token=CRYPTO_TOKEN, network=_cp_net()) as cp:
+    cp=CRYPTO.client()
+    with _provider_timer("cryptobot", "createInvoice"):
         try:
             inv = await cp.create_invoice(
                 amount=float(amount_rub),
@@ -384,23 +512,194 @@ async def _crypto_create_invoice_fiat(amount_rub: float, description: str, accep
                 allow_anonymous=True,
                 allow_comments=True,
             )
-        url = getattr(inv, "bot_invoice_url", None) or getattr(inv, "pay_url", None)
-        if not url:
-            raise RuntimeError("CryptoBot не вернул ссылку на инвойс.")
-        return inv, url
+    url = getattr(inv, "bot_invoice_url", None) or getattr(inv, "pay_url", None)
+    if not url:
+        raise RuntimeError("CryptoBot не вернул ссылку на инвойс.")
+    return inv, url
 
 async def _crypto_check_paid(invoice_id: str) -> bool:
-    async with AioCryptoPay(token=CRYPTO_TOKEN, network=_cp_net()) as cp:
-        res = await cp.get_invoices(invoice_ids=[int(invoice_id)])
-        if isinstance(res, list):
-            inv = res[0] if res else None
+    # параллельные проверки склеиваются в один getInvoices, ответ кэшируется на CRYPTO_CACHE_TTL
+    return await CRYPTO.status(int(invoice_id))=="paid"
+
+# ================== Зачисление оплаты ===================
+class Fulfilled(NamedTuple):
+    payment_id:str
+    user_id:int
+    method:str
+    plan_id:Optional[str]   # None — пополнение баланса
+    days:int
+    amount:float
+    net:float               # база для реферального бонуса
+    token:Optional[str]     # выданная подписка
+
+async def _payment_row(payment_id:str)->Optional[tuple]:
+    async with DB.read() as db:
+        cur=await db.execute("SELECT user_id, method, plan_id, amount, status FROM payments WHERE payment_id=?", (payment_id,))
+        return await cur.fetchone()
+
+async def _fulfill_payment(payment_id:str)->Optional[Fulfilled]:
+    """Выдаёт оплаченное ровно один раз, одной транзакцией: pending/paid -> credited,
+    реферальный бонус, баланс или подписка — один commit, при ошибке не применяется ничего.
+    Клиент в Xray ставится в очередь после commit. Повторный вызов вернёт None."""
+    token=new_uuid=None; exp=0
+    async with DB.write() as db:
+        # условный UPDATE первым: он открывает транзакцию и берёт блокировку записи, так что из двух
+        # процессов (вебхук в api, кнопка в bot) строку переведёт в credited только один
+        cur=await db.execute("UPDATE payments SET status='credited' WHERE payment_id=? AND status IN ('pending','paid')", (payment_id,))
+        if cur.rowcount!=1: return None
+        cur=await db.execute("SELECT user_id, method, plan_id, amount FROM payments WHERE payment_id=?", (payment_id,))
+        row=await cur.fetchone()
+        uid, method, plan_id, amount = int(row[0]), row[1], row[2], float(row[3])
+        net=round(amount*(1.0-YOOMONEY_FEE_PERCENT),2) if method=="yoomoney" else amount
+        days=PLANS.get(plan_id, {"days":30})["days"] if plan_id else 0
+        if plan_id:
+            await _credit_referral(db, uid, net_rub=net)
+            token, new_uuid, exp = await _insert_subscription(db, uid, days*86400)
+        else:
+            await db.execute("INSERT OR IGNORE INTO users(user_id,balance) VALUES(?,0)", (uid,))
+            await db.execute("UPDATE users SET balance=balance+? WHERE user_id=?", (amount, uid))
+            await _credit_referral(db, uid, net_rub=amount)
+    if token:
+        await _provision(token, new_uuid, exp)
+    return Fulfilled(payment_id, uid, method, plan_id, days, amount, net, token)
+
+async def _send_fulfilled(bot:Optional[Bot], f:Fulfilled):
+    """Без бота (процесс api) сообщения уходят через outbox — их отправит лидер."""
+    async def say(text:str, kb:Optional[InlineKeyboardMarkup]=None):
+        if bot is not None:
+            await bot.send_message(f.user_id, text, reply_markup=kb, disable_web_page_preview=True)
         else:
-            inv = res.items[0] if getattr(res, "items", None) else None
-        return bool(inv and getattr(inv, "status", None) == "paid")
+            await OUTBOX.enqueue(f.user_id, text, "payment", markup=kb.model_dump_json(exclude_none=True) if kb else None)
+    if f.token is None:
+        bal=await get_balance(f.user_id)
+        await say(f"✅ Оплата получена. Баланс пополнен на {f.amount:.2f} ₽.\nТекущий баланс: {bal:.2f} ₽", main_menu())
+        return
+    if f.method=="yoomoney":
+        await say(f"Оплата YooMoney: {f.amount:.2f}₽ (зачислено {f.net:.2f}₽).\nВыдана подписка на {f.days} дней.")
+    else:
+        await say(f"Оплата через @CryptoBot получена.\nВыдана подписка на {f.days} дней.")
+    await say(await text_v2raytun(f.token), kb_v2raytun(f.token))
+
+async def _check_payment(payment_id:str, provider_paid:Callable[[str],Awaitable[bool]])->Tuple[str,Optional[Fulfilled]]:
+    """credited — уже выдано (провайдера не трогаем); unpaid; fulfilled — выдали сейчас."""
+    row=await _payment_row(payment_id)
+    if row is None: return "unpaid", None
+    if row[4]=="credited": return "credited", None
+    if row[4]!="paid" and not await provider_paid(payment_id): return "unpaid", None
+    f=await _fulfill_payment(payment_id)
+    return ("fulfilled", f) if f else ("credited", None)
+
+# одна проверка у провайдера и одна выдача на payment_id, сколько бы раз ни нажали кнопку
+PAY_FLIGHT=SingleFlight()
+
+async def _settle(payment_id:str, provider_paid:Callable[[str],Awaitable[bool]])->Tuple[str,Optional[Fulfilled]]:
+    (status, f), leader = await PAY_FLIGHT.do(payment_id, lambda: _check_payment(payment_id, provider_paid))
+    if status=="fulfilled" and not leader:
+        return "credited", None        # выдачу и сообщение делает лидер
+    return status, f
+
+async def _yoo_paid(label:str)->bool: return await _yoo_check_paid(label) is not None
+
+async def _no_provider(payment_id:str)->bool: return False
+
+# бот появляется в main(); в процессах api его нет — тогда уведомления идут через outbox
+BOT:Optional[Bot]=None
+
+async def _fulfill_and_notify(payment_id:str):
+    # статус уже выставлен вебхуком в paid — провайдера не спрашиваем
+    _, f = await _settle(payment_id, _no_provider)
+    if f and BOT is not None:
+        # провайдеру отвечаем сразу, сообщение в Telegram уходит фоном
+        asyncio.create_task(_send_fulfilled(BOT, f))
+    elif f:
+        await _send_fulfilled(None, f)
+
+# ---- вебхуки провайдеров: подпись -> paid -> зачисление; повторы ничего не меняют ----
+@app.post("/pay/cryptobot")
+async def cryptobot_webhook(request:Request):
+    body=await request.body()
+    if not cryptobot_verify(CRYPTO_TOKEN, body, request.headers.get(CRYPTO_SIG_HEADER)):
+        raise HTTPException(401, "bad signature")
+    try: upd=json.loads(body)
+    except ValueError: raise HTTPException(400, "bad json")
+    if not isinstance(upd, dict): raise HTTPException(400, "bad update")
+    inv=upd.get("payload") or {}
+    if upd.get("update_type")!="invoice_paid" or inv.get("status")!="paid" or not inv.get("invoice_id"):
+        return {"ok":True}
+    invoice_id=str(inv["invoice_id"])
+    CRYPTO.remember(int(invoice_id), "paid")
+    async with DB.write() as db:
+        await db.execute("UPDATE payments SET status='paid' WHERE payment_id=? AND method='crypto' AND status='pending'", (invoice_id,))
+    await _fulfill_and_notify(invoice_id)
+    return {"ok":True}
+
+@app.post("/pay/yoomoney")
+async def yoomoney_webhook(request:Request):
+    if not YOOMONEY_NOTIFY_SECRET: raise HTTPException(404)
+    form=parse_form(await request.body())
+    if not yoomoney_verify(form, YOOMONEY_NOTIFY_SECRET):
+        raise HTTPException(401, "bad signature")
+    label=form.get("label") or ""
+    if not label or not yoomoney_accepted(form):
+        return PlainTextResponse("ok")
+    try: amount=float(form.get("amount") or 0)
+    except ValueError: raise HTTPException(400, "bad amount")
+    await _yoo_mark_paid([(label, amount, form.get("operation_id",""))])
+    await _fulfill_and_notify(label)
+    return PlainTextResponse("ok")
+
+# ================ Рассылки и напоминания ================
+async def _outbox_send(chat_id:int, text:str, markup:Optional[str]):
+    if BOT is None: raise RuntimeError("бот не запущен")
+    kb=InlineKeyboardMarkup.model_validate_json(markup) if markup else None
+    await BOT.send_message(chat_id, text, reply_markup=kb, disable_web_page_preview=True)
+
+OUTBOX=Outbox(DB, _outbox_send, rate=OUTBOX_RATE, burst=int(OUTBOX_RATE), per_chat=OUTBOX_PER_CHAT)
+
+_REMIND_KB=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🛒 Продлить", callback_data="buy")]]).model_dump_json(exclude_none=True)
+
+def _remind_text(window:str, token:str, exp:int)->Tuple[str,Optional[str]]:
+    left="24 часа" if window=="24h" else "1 час"
+    return (f"⏳ Подписка закончится меньше чем через {left} "
+            f"({time.strftime('%d.%m %H:%M', time.gmtime(exp))} UTC). Продлите, чтобы VPN не отключился."), _REMIND_KB
+
+REMINDERS=Reminders(DB, OUTBOX, _remind_text, interval=REMIND_INTERVAL)
+
+# в webhook-режиме создаётся в main()
+FEEDER:Optional[WebhookFeeder]=None
+
+@app.post(WEBHOOK_PATH, include_in_schema=False)
+async def tg_webhook(request:Request):
+    if FEEDER is None: raise HTTPException(404)
+    return await FEEDER.handle(request)
 
 # ===================== Aiogram 3 ========================
 router=Router()
 
+_CB_SUFFIX=re.compile(r"_[A-Z0-9]+$")
+
+def _handler_label(event)->str:
+    """Метка для bot_handler_seconds: префикс callback_data без id/валюты или команда."""
+    if isinstance(event, CallbackQuery):
+        return "cb:"+_CB_SUFFIX.sub("", (event.data or "").split(":",1)[0])
+    text=getattr(event, "text", None) or ""
+    return "msg:"+text.split()[0].split("@")[0] if text.startswith("/") else "msg:text"
+
+class HandlerTimer(BaseMiddleware):
+    """Гистограмма bot_handler_seconds и корневой span трассы на каждый апдейт."""
+    async def __call__(self, handler, event, data):
+        label=_handler_label(event); user=getattr(event, "from_user", None)
+        with M_BOT.time(label), TRACER.root("bot "+label, **{"bot.handler":label,"user.id":user.id if user else None}):
+            return await handler(event, data)
+
+class BotApiSpans(BaseRequestMiddleware):
+    """Дочерние span'ы на вызовы Bot API (sendMessage, answerCallbackQuery...)."""
+    async def __call__(self, make_request, bot, method):
+        with TRACER.span("telegram."+type(method).__name__, kind=SPAN_KIND_CLIENT): return await make_request(bot, method)
+
+router.message.middleware(HandlerTimer())
+router.callback_query.middleware(HandlerTimer())
+
 class PaymentState(StatesGroup):
     waiting_for_currency_selection = State()
     waiting_for_cryptobot_amount   = State()
@@ -424,6 +723,20 @@ async def cmd_start(m:Message):
     await ensure_user(m.from_user.id, ref_by=ref_by)
     await m.answer("Привет! Выберите действие:", reply_markup=main_menu())
 
+@router.message(Command("broadcast"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_broadcast(m:Message, command:CommandObject):
+    if not command.args:
+        await m.answer("Использование: /broadcast текст"); return
+    n=await OUTBOX.broadcast(command.args)
+    await m.answer(f"В очереди {n} сообщений. Прогресс: /outbox")
+
+@router.message(Command("outbox"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_outbox(m:Message):
+    st=await OUTBOX.stats()
+    q=", ".join(f"{k}: {v}" for k,v in sorted(st["queue"].items())) or "пусто"
+    await m.answer(f"Очередь: {q}\nОтправлено: {st['sent']}, ошибок: {st['failed']}, dead: {st['dead']}, "
+                   f"RetryAfter: {st['retry_after']}\nСкорость: {st['rate_1m']} msg/s, пауза: {st['paused_s']} с")
+
 @router.callback_query(lambda c: c.data=="balance")
 async def cb_balance(c:CallbackQuery):
     bal=await get_balance(c.from_user.id)
@@ -432,18 +745,14 @@ async def cb_balance(c:CallbackQuery):
 @router.callback_query(lambda c: c.data=="test_sub")
 async def cb_test1d(c:CallbackQuery):
     token=await create_subscription(c.from_user.id, days=1)
-    await c.message.answer(text_v2raytun(token), reply_markup=kb_v2raytun(token), disable_web_page_preview=True)
+    await c.message.answer(await text_v2raytun(token), reply_markup=kb_v2raytun(token), disable_web_page_preview=True)
     await c.answer()
 
 @router.callback_query(lambda c: c.data=="test_2m")
 async def cb_test2m(c:CallbackQuery):
-    new_uuid=str(uuid.uuid4()); xray_add_client(new_uuid)
-    token=secrets.token_urlsafe(24); now=int(time.time()); exp=now+120
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("INSERT OR REPLACE INTO subscriptions(token,user_id,uuid,expires_at) VALUES(?,?,?,?)",
-                         (token,c.from_user.id,new_uuid,exp)); await db.commit()
+    token=await create_subscription(c.from_user.id, days=0, seconds=120)
     await c.message.answer("Выдал подписку на 2 минуты для проверки истечения.")
-    await c.message.answer(text_v2raytun(token), reply_markup=kb_v2raytun(token), disable_web_page_preview=True)
+    await c.message.answer(await text_v2raytun(token), reply_markup=kb_v2raytun(token), disable_web_page_preview=True)
     await c.answer()
 
 def plan_keyboard()->InlineKeyboardMarkup:
@@ -491,20 +800,11 @@ async def cb_pay_yoo(c:CallbackQuery):
 @router.callback_query(lambda c: c.data and c.data.startswith("chk_yoo:"))
 async def cb_chk_yoo(c:CallbackQuery):
     label=c.data.split(":",1)[1]
-    paid=await _yoo_check_paid(label)
-    if not paid:
+    status, f = await _settle(label, _yoo_paid)
+    if status=="unpaid":
         await c.message.answer("Оплата не найдена. Подождите и проверьте ещё раз."); await c.answer(); return
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur=await db.execute("SELECT plan_id FROM payments WHERE payment_id=?", (label,))
-        row=await cur.fetchone()
-    plan_id=row[0] if row else "1m"
-    days=PLANS.get(plan_id, {"days":30})["days"]
-    net=round(float(paid)*(1.0-YOOMONEY_FEE_PERCENT),2)
-    await _record_payment(label, c.from_user.id, "yoomoney", plan_id, float(paid), "RUB", "credited", "")
-    await _credit_referral(c.from_user.id, net_rub=net)
-    token=await create_subscription(c.from_user.id, days=days)
-    await c.message.answer(f"Оплата YooMoney: {paid:.2f}₽ (зачислено {net:.2f}₽).\nВыдана подписка на {days} дней.")
-    await c.message.answer(text_v2raytun(token), reply_markup=kb_v2raytun(token), disable_web_page_preview=True)
+    if f: await _send_fulfilled(c.bot, f)
+    else: await c.message.answer("Эта оплата уже зачислена.")
     await c.answer()
 
 # ---- CryptoBot подписка (фиат) ----
@@ -531,19 +831,11 @@ async def cb_pay_crypto(c:CallbackQuery):
 @router.callback_query(lambda c: c.data and c.data.startswith("chk_crypto:"))
 async def cb_chk_crypto(c:CallbackQuery):
     invoice_id=c.data.split(":",1)[1]
-    ok=await _crypto_check_paid(invoice_id)
-    if not ok:
+    status, f = await _settle(invoice_id, _crypto_check_paid)
+    if status=="unpaid":
         await c.message.answer("Инвойс ещё не оплачен. Проверь позже."); await c.answer(); return
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur=await db.execute("SELECT plan_id, user_id, amount FROM payments WHERE payment_id=?", (invoice_id,))
-        row=await cur.fetchone()
-    plan_id=row[0]; uid=row[1]; amount=float(row[2])
-    days=PLANS.get(plan_id, {"days":30})["days"]
-    await _record_payment(invoice_id, uid, "crypto", plan_id, amount, "FIAT/CRYPTO", "credited", "")
-    await _credit_referral(uid, net_rub=amount)
-    token=await create_subscription(uid, days=days)
-    await c.message.answer(f"Оплата через @CryptoBot получена.\nВыдана подписка на {days} дней.")
-    await c.message.answer(text_v2raytun(token), reply_markup=kb_v2raytun(token), disable_web_page_preview=True)
+    if f: await _send_fulfilled(c.bot, f)
+    else: await c.message.answer("Эта оплата уже зачислена.")
     await c.answer()
 
 # ================== Пополнение баланса через CryptoBot (с выбором валюты) ===========
@@ -619,21 +911,12 @@ async def process_cryptopay_payment(message: Message, state: FSMContext):
 async def check_cryptopay_payment(callback: CallbackQuery, state: FSMContext):
     await callback.answer("⌛ Проверяю оплату…")
     invoice_id = callback.data.split(":",1)[1]
-    ok = await _crypto_check_paid(invoice_id)
-    if not ok:
+    status, f = await _settle(invoice_id, _crypto_check_paid)
+    if status=="unpaid":
         await callback.message.answer("⌛ Платёж ещё не найден. Подождите и проверьте ещё раз.")
         return
-    # зачесть баланс и рефералку
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur=await db.execute("SELECT amount FROM payments WHERE payment_id=?", (invoice_id,))
-        row=await cur.fetchone()
-    pay_amount=float(row[0]) if row else 0.0
-    await _record_payment(invoice_id, callback.from_user.id, "crypto", None, pay_amount, "FIAT/CRYPTO", "credited", "")
-    await add_balance(callback.from_user.id, pay_amount)
-    await _credit_referral(callback.from_user.id, net_rub=pay_amount)
-    bal=await get_balance(callback.from_user.id)
-    await callback.message.answer(f"✅ Оплата получена. Баланс пополнен на {pay_amount:.2f} ₽.\nТекущий баланс: {bal:.2f} ₽",
-                                  reply_markup=main_menu())
+    if f: await _send_fulfilled(callback.bot, f)
+    else: await callback.message.answer("Эта оплата уже зачислена.", reply_markup=main_menu())
 
 @router.callback_query(lambda c: c.data=="menu")
 async def cb_menu(c:CallbackQuery):
@@ -641,24 +924,81 @@ async def cb_menu(c:CallbackQuery):
 
 # ==================== RUNNERS ===========================
 async def run_fastapi():
+    import uvicorn
     config=uvicorn.Config(app, host=API_HOST, port=API_PORT, log_level="info", loop="asyncio")
     server=uvicorn.Server(config); await server.serve()
 
-async def main():
+async def lead():
+    """Ждём flock лидера, затем ведём всё, что должно идти в одном экземпляре."""
+    await LEADER.acquire()
+    XRAY.start()
+    loops=[expire_gc_loop(), YOO.run(), OUTBOX.run(), REMINDERS.run(), JOB_RUNNER.run(), NODE_SYNC.run(), NODE_PROBER.run()]
+    if TRAFFIC_INTERVAL>0: loops.append(TRAFFIC.run())     # QueryStats с reset — только в одном процессе
+    await asyncio.gather(*loops)
+
+async def run_bot(bot:Bot, serve_api:bool):
+    global FEEDER
+    dp=Dispatcher(storage=SqliteStorage(DB)); dp.include_router(router)
+    if BOT_MODE=="webhook":
+        FEEDER=WebhookFeeder(dp, bot, WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE)
+        FEEDER.start()
+        try:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=dp.resolve_used_update_types())
+            await run_fastapi()          # один uvicorn: и API, и апдейты бота
+        finally:
+            await FEEDER.stop()
+        return
+    await bot.delete_webhook()           # getUpdates не работает, пока висит вебхук
+    api_task=asyncio.create_task(run_fastapi()) if serve_api else None
+    try:
+        await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        if api_task:
+            api_task.cancel()
+            with contextlib.suppress(Exception): await api_task
+
+async def main(role:str=ROLE):
     if not BOT_TOKEN or BOT_TOKEN=="CHANGE_ME":
         raise SystemExit("Задай BOT_TOKEN через переменные окружения.")
     await db_init()
-    asyncio.create_task(expire_gc_loop())
-
-    bot=Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp=Dispatcher(); dp.include_router(router)
-
-    api_task=asyncio.create_task(run_fastapi())
+    global BOT, ROLE
+    ROLE=role; TRACER.resource["process.role"]=role
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else None
+    bot=BOT=Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(BotApiSpans())
+    lead_task=asyncio.create_task(lead()) if role in ("all","worker") else None
     try:
-        await dp.start_polling(bot)
+        if role=="worker":
+            await lead_task
+        else:
+            await run_bot(bot, serve_api=(role=="all"))
     finally:
-        api_task.cancel()
-        with contextlib.suppress(Exception): await api_task
+        if lead_task:
+            lead_task.cancel()
+            with contextlib.suppress(BaseException): await lead_task
+        await XRAY.stop()
+        LEADER.release()
+        YOO.close()
+        await CRYPTO.close()
+        await bot.session.close()
+        await DB.close()
+        TRACER.close()
+
+def run_api():
+    """HTTP с вебхуками платёжек и бота: uvicorn с API_WORKERS процессами, каждый со своим пулом БД.
+    Реплике, которая только раздаёт подписки, хватает sub_api.py."""
+    import uvicorn
+    async def init():
+        await db_init(); await DB.close()
+    asyncio.run(init())                  # схема — один раз в родителе
+    os.environ["ROLE"]="api"             # дочерние процессы uvicorn импортируют main заново
+    uvicorn.run("main:app", host=API_HOST, port=API_PORT, workers=API_WORKERS, log_level="info",
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
 
 if __name__=="__main__":
-    asyncio.run(main())
+    ap=argparse.ArgumentParser()
+    ap.add_argument("--role", choices=("all","api","bot","worker"), default=ROLE)
+    role=ap.parse_args().role
+    if role=="api": run_api()
+    else: asyncio.run(main(role))
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Метрики в текстовом формате Prometheus (0.0.4) без внешних зависимостей.
+
+Counter / Histogram — обычные числа в словаре по кортежу меток: observe() —
+это bisect по границам бакетов и пара сложений, без блокировок и аллокаций
+на горячем пути (всё работает в одном event loop; из потоков to_thread
+пишутся только редкие метрики Xray). Число разных наборов меток ограничено
+max_series — лишнее сливается в "other", чтобы случайные callback_data не
+раздули память. Gauge считается в момент скрейпа функцией (можно async).
+
+В каждом процессе (uvicorn-воркеры, бот, лидер) свой реестр: /metrics
+отдаёт метрики того процесса, который ответил.
+"""
+import asyncio, bisect, contextlib, time
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple, Union
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INF = 'le="+Inf"'
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), max_series: int = 200):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labels)
+        self.max_series = max_series
+
+    def _key(self, values: Tuple[str, ...], series: dict) -> Tuple[str, ...]:
+        if values in series or len(series) < self.max_series:
+            return values
+        return tuple("other" for _ in values)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1.0):
+        k = self._key(labels, self.series)
+        self.series[k] = self.series.get(k, 0.0) + value
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in self.series.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS,
+                 max_series: int = 200):
+        super().__init__(name, doc, labels, max_series)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple[str, ...], list] = {}   # [counts по бакетам (не кумулятивно)..., +Inf, sum]
+
+    def observe(self, value: float, *labels: str):
+        k = self._key(labels, self.series)
+        s = self.series.get(k)
+        if s is None:
+            s = self.series[k] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect.bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, *labels: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, s in self.series.items():
+            acc = 0
+            for b, c in zip(self.buckets, s):
+                acc += c
+                le = 'le="%g"' % b
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            acc += s[len(self.buckets)]
+            out.append(f"{self.name}_bucket{_labels(self.labelnames, k, INF)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {s[-1]:.6g}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {acc}")
+        return out
+
+
+GaugeValue = Union[float, Dict[Tuple[str, ...], float]]
+
+
+class Gauge(_Metric):
+    """Значение снимается при скрейпе: fn() -> число или {(метки...): число}."""
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, fn: Callable[[], Union[GaugeValue, Awaitable[GaugeValue]]],
+                 labels: Sequence[str] = ()):
+        super().__init__(name, doc, labels)
+        self.fn = fn
+
+    async def collect(self) -> List[str]:
+        v = self.fn()
+        if asyncio.iscoroutine(v):
+            v = await v
+        if v is None:
+            return []
+        if not isinstance(v, dict):
+            v = {(): v}
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {float(x):g}" for k, x in v.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, m):
+        self.metrics.append(m)
+        return m
+
+    def counter(self, name: str, doc: str, labels: Sequence[str] = (), **kw) -> Counter:
+        return self.register(Counter(name, doc, labels, **kw))
+
+    def histogram(self, name: str, doc: str, labels: Sequence[str] = (), **kw) -> Histogram:
+        return self.register(Histogram(name, doc, labels, **kw))
+
+    def gauge(self, name: str, doc: str, fn, labels: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, doc, fn, labels))
+
+    async def render(self) -> str:
+        out: List[str] = []
+        for m in self.metrics:
+            if isinstance(m, Gauge):
+                try:
+                    out.extend(await m.collect())
+                except Exception:
+                    continue          # упавший сборщик не должен ронять весь скрейп
+            else:
+                out.extend(m.render())
+        return "\n".join(out) + "\n"
+
+
+class AsgiTimer:
+    """ASGI-обёртка: латентность и коды ответов по маршруту (первый сегмент пути)."""
+
+    def __init__(self, app, hist: Histogram, codes: Counter, routes: Sequence[str]):
+        self.app = app
+        self.hist = hist
+        self.codes = codes
+        self.routes = frozenset(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        seg = "/" + scope["path"].split("/", 2)[1]
+        route = seg if seg in self.routes else "other"
+        status = [500]
+
+        async def send_wrapped(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            await send(msg)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapped)
+        finally:
+            self.hist.observe(time.perf_counter() - t0, route)
+            self.codes.inc(route, str(status[0]))
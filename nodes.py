@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""
+Несколько серверов Xray: реестр узлов, раздача клиентов и проверки здоровья.
+
+nodes — реестр: публичный host/port и Reality-параметры для ссылок, адрес
+gRPC API (HandlerService/StatsService) и тег inbound'а для управления,
+ёмкость и здоровье. node_clients — на каких узлах должен быть uuid и чем
+кончилась последняя попытка: add/remove ждут применения, ok — клиент на узле.
+
+Любой процесс пишет намерение в той же транзакции, что и подписку
+(assign/revoke), — поэтому ни выдача, ни истечение не теряются при падении.
+NodeSync в лидере забирает ожидающие строки и применяет их на всех узлах
+параллельно (по потоку на узел); неудача — повтор с экспоненциальной паузой,
+ошибка остаётся в строке. Узлы, признанные больными, пропускаются, пока не
+поднимутся.
+
+NodeProber в лидере раз в interval секунд проверяет каждый узел сам:
+TCP-подключение к публичному порту и GetSysStats через API. Узел выпадает
+из подписок после fall неудач подряд и возвращается после rise успехов.
+Если uptime Xray уменьшился — узел перезапускался и мог потерять клиентов,
+добавленных через API: все его строки ok снова ставятся в add.
+
+С NODE_REPLICAS=K uuid ставится не на все узлы, а на K по
+rendezvous-хэшу с учётом ёмкости и загрузки (placement.py). Добавление,
+выключение узла или смена capacity пересчитывают размещение (rebalance):
+переезжают только те, чьи K узлов изменились, разница пишется в node_clients
+пачками. Снятие со старого узла откладывается на --grace-h часов — клиенты
+успевают перечитать подписку с новым узлом.
+
+Пока реестр пуст, всё работает как раньше — один сервер из XRAY_CONFIG.
+
+    DB_PATH=/root/rel/bot_database.db python nodes.py add de1 --host de1.example.com --port 443 \\
+        --api 10.0.0.2:10085 --sni www.microsoft.com --sid 6ba85179e30d4fc2 --pbk <public key>
+    python nodes.py list
+    python nodes.py set de1 --disable
+    NODE_REPLICAS=2 python nodes.py rebalance --dry-run
+"""
+import argparse, asyncio, hashlib, json, os, re, sqlite3, time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from placement import NodeLoad, diff_batches, place, plan
+
+NODES_SQL = """
+CREATE TABLE IF NOT EXISTS nodes (
+  id         INTEGER PRIMARY KEY,
+  name       TEXT NOT NULL UNIQUE,
+  host       TEXT NOT NULL,
+  port       INTEGER NOT NULL,
+  api        TEXT NOT NULL,
+  tag        TEXT NOT NULL,
+  network    TEXT NOT NULL DEFAULT 'tcp',
+  sni        TEXT NOT NULL DEFAULT '',
+  sid        TEXT NOT NULL DEFAULT '',
+  pbk        TEXT NOT NULL DEFAULT '',
+  flow       TEXT NOT NULL DEFAULT 'xtls-rprx-vision',
+  capacity   INTEGER NOT NULL DEFAULT 0,
+  enabled    INTEGER NOT NULL DEFAULT 1,
+  healthy    INTEGER NOT NULL DEFAULT 1,
+  changed_at INTEGER NOT NULL DEFAULT 0,
+  checked_at INTEGER,
+  rtt_ms     REAL,
+  uptime     INTEGER,
+  last_error TEXT
+);
+CREATE TABLE IF NOT EXISTS node_clients (
+  uuid       TEXT NOT NULL,
+  node_id    INTEGER NOT NULL,
+  state      TEXT NOT NULL,
+  attempts   INTEGER NOT NULL DEFAULT 0,
+  next_at    INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  updated_at INTEGER NOT NULL,
+  PRIMARY KEY (uuid, node_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_node_clients_todo ON node_clients(next_at) WHERE state!='ok';
+CREATE INDEX IF NOT EXISTS idx_node_clients_node ON node_clients(node_id, state);
+"""
+
+NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,32}$")   # имя узла попадает в имена профилей и YAML/JSON без экранирования
+
+
+class Node(NamedTuple):
+    id: int
+    name: str
+    host: str
+    port: int
+    api: str
+    tag: str
+    network: str
+    sni: str
+    sid: str
+    pbk: str
+    flow: str
+    capacity: int
+    healthy: bool
+    changed_at: int
+
+    def params(self) -> Tuple[str, str, int, str, str, str, str, str]:
+        """(name, host, port, network, sni, sid, pbk, flow) для sub_formats.Renderer.render_nodes."""
+        return self.name, self.host, self.port, self.network, self.sni, self.sid, self.pbk, self.flow
+
+
+_COLS = "id, name, host, port, api, tag, network, sni, sid, pbk, flow, capacity, healthy, changed_at"
+
+
+async def load_nodes(db) -> List[Node]:
+    """Включённые узлы (и здоровые, и нет) по id."""
+    cur = await db.execute(f"SELECT {_COLS} FROM nodes WHERE enabled=1 ORDER BY id")
+    return [Node(*r[:12], bool(r[12]), int(r[13])) for r in await cur.fetchall()]
+
+
+def nodes_version(nodes: Iterable[Node]) -> str:
+    """Хэш всего, что влияет на текст подписки: параметры, ёмкость и здоровье узлов; changed_at —
+    чтобы перестановка клиентов по узлам (rebalance) тоже сбрасывала ETag."""
+    h = hashlib.blake2b(digest_size=6)
+    for n in nodes:
+        h.update(f"{n.id}|{n.params()}|{n.capacity}|{int(n.healthy)}|{n.changed_at};".encode())
+    return "n" + h.hexdigest()
+
+
+_LOADS_SQL = ("SELECT n.id, n.capacity, (SELECT COUNT(*) FROM node_clients c WHERE c.node_id=n.id AND c.state!='remove'), "
+              "n.healthy FROM nodes n WHERE n.enabled=1 ORDER BY n.id")
+
+
+async def assign(db, uuid: str, replicas: int = 0, now: Optional[int] = None):
+    """Поставить uuid на узлы (внутри транзакции писателя, вместе с подпиской): replicas<=0 — на все
+    включённые, иначе на replicas узлов по placement.place (ёмкость, текущая загрузка, здоровье)."""
+    now = int(now or time.time())
+    if replicas <= 0:
+        await db.execute(
+            "INSERT INTO node_clients(uuid,node_id,state,updated_at) SELECT ?, id, 'add', ? FROM nodes WHERE enabled=1 "
+            "ON CONFLICT(uuid,node_id) DO UPDATE SET state='add', attempts=0, next_at=0, last_error=NULL",
+            (uuid, now))
+        return
+    cur = await db.execute(_LOADS_SQL)
+    loads = [NodeLoad(nid, cap, n, bool(ok)) for nid, cap, n, ok in await cur.fetchall()]
+    await db.executemany(
+        "INSERT INTO node_clients(uuid,node_id,state,updated_at) VALUES(?,?,'add',?) "
+        "ON CONFLICT(uuid,node_id) DO UPDATE SET state='add', attempts=0, next_at=0, last_error=NULL",
+        [(uuid, nid, now) for nid in place(uuid, loads, replicas)])
+
+
+async def revoke(db, uuids: Iterable[str], now: Optional[int] = None):
+    """Снять uuid со всех узлов, где он есть или ждёт добавления."""
+    now = int(now or time.time())
+    await db.executemany("UPDATE node_clients SET state='remove', attempts=0, next_at=0, last_error=NULL, updated_at=? "
+                         "WHERE uuid=?", [(now, u) for u in uuids])
+
+
+# api_factory(addr) -> клиент с add_user(tag, uuid, email, flow) / remove_user(tag, email) / uptime()
+ApiFactory = Callable[[str], object]
+
+
+class _NodeStats:
+    __slots__ = ("added", "removed", "failed", "last_error")
+
+    def __init__(self):
+        self.added = self.removed = self.failed = 0
+        self.last_error = ""
+
+    def as_dict(self) -> dict:
+        return {"added": self.added, "removed": self.removed, "failed": self.failed, "last_error": self.last_error}
+
+
+class NodeSync:
+    """Лидер: node_clients (add/remove) -> API узлов, все узлы параллельно."""
+
+    def __init__(self, pool, api: ApiFactory, interval: float = 1.0, batch: int = 2000,
+                 backoff_max: int = 300, give_up_after: int = 3):
+        self.pool = pool
+        self.api = api
+        self.interval = interval
+        self.batch = batch
+        self.backoff_max = backoff_max
+        self.give_up_after = give_up_after   # столько ошибок подряд на узле — остаток пачки не трогаем
+        self.nodes: Dict[int, Node] = {}     # последний снимок реестра (его же берёт сбор трафика)
+        self._wake = asyncio.Event()
+        # метрики
+        self.passes = 0
+        self.errors = 0
+        self.last_error = ""
+        self.per_node: Dict[str, _NodeStats] = {}
+
+    def kick(self):
+        """Выдача/снятие в этом процессе — не ждать interval."""
+        self._wake.set()
+
+    def _apply_node(self, node: Node, ops: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+        """[(uuid, op)] на одном узле, в потоке. -> [(uuid, op, ошибка или "")]."""
+        api, out, streak = self.api(node.api), [], 0
+        for i, (uuid, op) in enumerate(ops):
+            try:
+                if op == "add":
+                    api.add_user(node.tag, uuid, uuid, node.flow)
+                else:
+                    api.remove_user(node.tag, uuid)
+                out.append((uuid, op, "")); streak = 0
+            except Exception as e:
+                out.append((uuid, op, repr(e))); streak += 1
+                if streak >= self.give_up_after:
+                    # узел, похоже, лёг: остаток пачки — тоже в повтор, без таймаута на каждый вызов
+                    out.extend((u, o, f"skipped after {streak} errors: {e!r}") for u, o in ops[i + 1:])
+                    break
+        return out
+
+    async def _pass(self) -> int:
+        now = int(time.time())
+        async with self.pool.read() as db:
+            cur = await db.execute(f"SELECT {_COLS} FROM nodes")
+            self.nodes = {r[0]: Node(*r[:12], bool(r[12]), int(r[13])) for r in await cur.fetchall()}
+            # строки больных узлов не выбираем: ждут, пока узел поднимется, и не забивают пачку
+            cur = await db.execute("SELECT c.uuid, c.node_id, c.state, c.attempts FROM node_clients c "
+                                   "LEFT JOIN nodes n ON n.id=c.node_id WHERE c.state!='ok' AND c.next_at<=? "
+                                   "AND (n.id IS NULL OR n.healthy=1) ORDER BY c.next_at LIMIT ?", (now, self.batch))
+            rows = await cur.fetchall()
+        if not rows:
+            return 0
+        by_node: Dict[int, List[Tuple[str, str]]] = {}
+        attempts: Dict[Tuple[str, int], int] = {}
+        orphans = []
+        for uuid, node_id, state, att in rows:
+            node = self.nodes.get(node_id)
+            if node is None:
+                orphans.append((uuid, node_id))            # узел удалён из реестра
+            else:
+                by_node.setdefault(node_id, []).append((uuid, state)); attempts[(uuid, node_id)] = att
+        nids = list(by_node)
+        results = await asyncio.gather(*(asyncio.to_thread(self._apply_node, self.nodes[i], by_node[i]) for i in nids))
+        done, removed, failed = [], [], []
+        for node_id, res in zip(nids, results):
+            st = self.per_node.setdefault(self.nodes[node_id].name, _NodeStats())
+            for uuid, op, err in res:
+                if err:
+                    att = attempts[(uuid, node_id)] + 1
+                    failed.append((att, now + min(self.backoff_max, 2 ** att), err[:300], now, uuid, node_id, op))
+                    st.failed += 1; st.last_error = err
+                elif op == "add":
+                    done.append((now, uuid, node_id)); st.added += 1
+                else:
+                    removed.append((uuid, node_id)); st.removed += 1
+        async with self.pool.write() as db:
+            # условие на state: пока шёл вызов, строку могли перевести в другое состояние — её не трогаем
+            await db.executemany("UPDATE node_clients SET state='ok', attempts=0, last_error=NULL, updated_at=? "
+                                 "WHERE uuid=? AND node_id=? AND state='add'", done)
+            await db.executemany("DELETE FROM node_clients WHERE uuid=? AND node_id=? AND state='remove'", removed)
+            await db.executemany("UPDATE node_clients SET attempts=?, next_at=?, last_error=?, updated_at=? "
+                                 "WHERE uuid=? AND node_id=? AND state=?", failed)
+            await db.executemany("DELETE FROM node_clients WHERE uuid=? AND node_id=?", orphans)
+        self.passes += 1
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                n = await self._pass()
+            except Exception as e:
+                self.errors += 1; self.last_error = repr(e); n = 0
+            if n < self.batch:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self) -> dict:
+        return {"passes": self.passes, "errors": self.errors, "last_error": self.last_error,
+                "nodes": {k: v.as_dict() for k, v in self.per_node.items()}}
+
+
+class NodeProber:
+    """Лидер: здоровье узлов в nodes.healthy (его читают API подписок во всех процессах)."""
+
+    def __init__(self, pool, api: ApiFactory, interval: float = 10.0, timeout: float = 3.0,
+                 fall: int = 3, rise: int = 2, on_change: Optional[Callable[[], None]] = None):
+        self.pool = pool
+        self.api = api
+        self.interval = interval
+        self.timeout = timeout
+        self.fall = fall
+        self.rise = rise
+        self.on_change = on_change           # узел поменял здоровье или перезапускался (NodeSync.kick)
+        self._streak: Dict[int, int] = {}    # >0 — успехов подряд, <0 — неудач подряд
+        # метрики
+        self.rounds = 0
+        self.restarts = 0
+
+    async def _probe(self, host: str, port: int, api_addr: str) -> Tuple[Optional[int], float, str]:
+        """(uptime или None при неудаче, rtt TCP в мс, ошибка)."""
+        t0 = time.perf_counter()
+        try:
+            _, w = await asyncio.wait_for(asyncio.open_connection(host, port), self.timeout)
+            rtt = (time.perf_counter() - t0) * 1000
+            w.close()
+        except Exception as e:
+            return None, 0.0, f"tcp {host}:{port}: {e!r}"
+        try:
+            return await asyncio.wait_for(asyncio.to_thread(lambda: self.api(api_addr).uptime()), self.timeout), rtt, ""
+        except Exception as e:
+            return None, rtt, f"api {api_addr}: {e!r}"
+
+    async def round(self) -> Dict[str, bool]:
+        async with self.pool.read() as db:
+            cur = await db.execute("SELECT id, name, host, port, api, healthy, uptime FROM nodes WHERE enabled=1")
+            nodes = await cur.fetchall()
+        res = await asyncio.gather(*(self._probe(h, p, a) for _, _, h, p, a, _, _ in nodes))
+        now, updates, restarted, changed = int(time.time()), [], [], False
+        for (nid, name, _, _, _, healthy, prev_uptime), (uptime, rtt, err) in zip(nodes, res):
+            s = self._streak.get(nid, 0)
+            s = max(s, 0) + 1 if uptime is not None else min(s, 0) - 1
+            self._streak[nid] = s
+            new = bool(healthy)
+            if healthy and s <= -self.fall:
+                new = False
+            elif not healthy and s >= self.rise:
+                new = True
+            if uptime is not None and prev_uptime is not None and uptime < prev_uptime:
+                restarted.append((now, nid)); self.restarts += 1
+            changed |= new != bool(healthy)
+            updates.append((int(new), now, round(rtt, 3), uptime, err or None, int(new), now, nid))
+        async with self.pool.write() as db:
+            await db.executemany("UPDATE nodes SET healthy=?, checked_at=?, rtt_ms=?, uptime=COALESCE(?,uptime), last_error=?, "
+                                 "changed_at=CASE WHEN healthy!=? THEN ? ELSE changed_at END WHERE id=?", updates)
+            # перезапуск без постоянного конфига: клиенты из API пропали — добавить заново
+            await db.executemany("UPDATE node_clients SET state='add', attempts=0, next_at=0, updated_at=? "
+                                 "WHERE node_id=? AND state='ok'", restarted)
+        self.rounds += 1
+        if (changed or restarted) and self.on_change is not None:
+            self.on_change()
+        return {name: bool(u[0]) for (_, name, *_), u in zip(nodes, updates)}
+
+    async def run(self):
+        while True:
+            try:
+                await self.round()
+            except Exception:
+                pass                         # следующий раунд; состояние узлов в БД остаётся прежним
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"rounds": self.rounds, "restarts": self.restarts}
+
+
+# ---------- перераспределение (синхронно, из командной строки) ----------
+def rebalance(con: sqlite3.Connection, replicas: int, dry_run: bool = False, grace: int = 86400,
+              batch: int = 1000) -> dict:
+    """Привести node_clients действующих подписок к размещению placement.plan на replicas узлов.
+
+    Отчёт — сколько uuid переедет и что станет с каждым узлом. Без dry_run разница пишется
+    пачками по batch uuid, каждая своей транзакцией: добавления сразу в очередь NodeSync,
+    снятия — через grace секунд (в подписке старого узла уже нет, клиент на нём пока есть).
+    """
+    now = int(time.time())
+    current: Dict[str, Set[int]] = {}
+    for uuid, ids in con.execute(
+            "SELECT s.uuid, group_concat(c.node_id) FROM subscriptions s LEFT JOIN node_clients c "
+            "ON c.uuid=s.uuid AND c.state!='remove' WHERE s.expires_at>? GROUP BY s.uuid", (now,)):
+        current[uuid] = {int(x) for x in (ids or "").split(",") if x}
+    loads = [NodeLoad(nid, cap, n, bool(ok)) for nid, cap, n, ok in con.execute(_LOADS_SQL)]
+    p = plan(current, loads, replicas)
+    names, caps = {}, {}
+    for nid, name, cap in con.execute("SELECT id, name, capacity FROM nodes"):
+        names[nid], caps[nid] = name, cap
+    report = {"replicas": replicas, "dry_run": dry_run, **p.report(names, caps)}
+    if dry_run or not p.moved:
+        return report
+    con.commit()
+    for adds, removes in diff_batches(p, batch):
+        with con:
+            # подписка могла истечь с момента чтения — тогда её строк уже нет, и добавлять нечего
+            con.executemany("INSERT INTO node_clients(uuid,node_id,state,updated_at) "
+                            "SELECT uuid, ?, 'add', ? FROM subscriptions WHERE uuid=? AND expires_at>? "
+                            "ON CONFLICT(uuid,node_id) DO UPDATE SET state='add', attempts=0, next_at=0, last_error=NULL "
+                            "WHERE node_clients.state='remove'",
+                            [(nid, now, uuid, now) for uuid, nid in adds])
+            # уже снимаемые (истечение) не трогаем, иначе их снятие отложилось бы на grace
+            con.executemany("UPDATE node_clients SET state='remove', attempts=0, next_at=?, last_error=NULL, updated_at=? "
+                            "WHERE uuid=? AND node_id=? AND state!='remove'",
+                            [(now + grace, now, uuid, nid) for uuid, nid in removes])
+    # новая версия реестра — у затронутых подписок сменится ETag, клиенты заберут новый состав узлов
+    touched = set(p.adds) | set(p.removes)
+    with con:
+        con.executemany("UPDATE nodes SET changed_at=? WHERE id=?", [(now, nid) for nid in touched])
+    return report
+
+
+# ---------- реестр из командной строки ----------
+def _cli_add(con: sqlite3.Connection, a) -> str:
+    now = int(time.time())
+    cur = con.execute("INSERT INTO nodes(name,host,port,api,tag,network,sni,sid,pbk,flow,capacity,changed_at) "
+                      "VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
+                      (a.name, a.host, a.port, a.api, a.tag, a.network, a.sni, a.sid, a.pbk, a.flow, a.capacity, now))
+    if a.replicas > 0:
+        return f"{a.name}: id {cur.lastrowid}" + _auto_rebalance(con, a)
+    # действующие подписки — и на новый узел
+    n = con.execute("INSERT OR IGNORE INTO node_clients(uuid,node_id,state,updated_at) "
+                    "SELECT uuid, ?, 'add', ? FROM subscriptions WHERE expires_at>?", (cur.lastrowid, now, now)).rowcount
+    return f"{a.name}: id {cur.lastrowid}, {n} clients queued"
+
+
+def _cli_set(con: sqlite3.Connection, a) -> str:
+    row = con.execute("SELECT id, enabled FROM nodes WHERE name=?", (a.name,)).fetchone()
+    if not row:
+        raise SystemExit(f"no node {a.name}")
+    nid, now, fields = row[0], int(time.time()), {}
+    for k in ("host", "port", "api", "tag", "network", "sni", "sid", "pbk", "flow", "capacity"):
+        if getattr(a, k) is not None:
+            fields[k] = getattr(a, k)
+    if a.enable or a.disable:
+        fields["enabled"] = int(bool(a.enable))
+    if fields:
+        fields["changed_at"] = now
+        con.execute(f"UPDATE nodes SET {', '.join(f'{k}=?' for k in fields)} WHERE id=?", (*fields.values(), nid))
+    if a.replicas > 0:
+        if a.disable or a.enable or a.capacity is not None:
+            return f"{a.name}: updated {sorted(fields)}" + _auto_rebalance(con, a)
+    elif a.disable and row[1]:
+        con.execute("UPDATE node_clients SET state='remove', attempts=0, next_at=0 WHERE node_id=?", (nid,))
+    if a.enable and not row[1]:
+        con.execute("INSERT INTO node_clients(uuid,node_id,state,updated_at) SELECT uuid, ?, 'add', ? FROM subscriptions "
+                    "WHERE expires_at>? ON CONFLICT(uuid,node_id) DO UPDATE SET state='add', attempts=0, next_at=0",
+                    (nid, now, now))
+    return f"{a.name}: updated {sorted(fields) or 'nothing'}"
+
+
+def _auto_rebalance(con: sqlite3.Connection, a) -> str:
+    if a.no_rebalance:
+        return "; placement unchanged (run `nodes.py rebalance`)"
+    r = rebalance(con, a.replicas, grace=int(a.grace_h * 3600), batch=a.batch)
+    return f"; rebalanced: {r['users_moved']} of {r['users']} users moved"
+
+
+def _cli_rebalance(con: sqlite3.Connection, a) -> str:
+    if a.replicas <= 0:
+        raise SystemExit("rebalance нужен только при NODE_REPLICAS>0 (или --replicas N)")
+    return json.dumps(rebalance(con, a.replicas, a.dry_run, int(a.grace_h * 3600), a.batch), indent=2, ensure_ascii=False)
+
+
+def _cli_list(con: sqlite3.Connection, a) -> str:
+    out = []
+    for r in con.execute("SELECT n.name, n.host, n.port, n.api, n.capacity, n.enabled, n.healthy, n.rtt_ms, n.last_error, "
+                         "(SELECT COUNT(*) FROM node_clients c WHERE c.node_id=n.id AND c.state='ok'), "
+                         "(SELECT COUNT(*) FROM node_clients c WHERE c.node_id=n.id AND c.state!='ok') "
+                         "FROM nodes n ORDER BY n.id"):
+        name, host, port, api, cap, en, ok, rtt, err, n_ok, n_pending = r
+        state = "disabled" if not en else ("healthy" if ok else "DOWN")
+        out.append(f"{name:12s} {host}:{port} api={api} cap={cap or '-'} {state} rtt={rtt}ms "
+                   f"clients={n_ok} pending={n_pending}" + (f" err={err}" if err else ""))
+    return "\n".join(out) or "no nodes"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--db", default=os.getenv("DB_PATH", "/root/rel/bot_database.db"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    for cmd in ("add", "set", "rebalance"):
+        p = sub.add_parser(cmd)
+        p.add_argument("--replicas", type=int, default=int(os.getenv("NODE_REPLICAS", "0")),
+                       help="узлов на подписку (как NODE_REPLICAS у бота); 0 — все узлы, без перераспределения")
+        p.add_argument("--grace-h", type=float, default=24.0, help="через сколько часов снимать клиента со старого узла")
+        p.add_argument("--batch", type=int, default=1000, help="uuid на транзакцию")
+        if cmd == "rebalance":
+            p.add_argument("--dry-run", action="store_true", help="только отчёт: сколько переедет и куда")
+            continue
+        p.add_argument("--no-rebalance", action="store_true", help="не пересчитывать размещение после изменения")
+        p.add_argument("name")
+        req = cmd == "add"
+        p.add_argument("--host", required=req, help="публичный адрес для ссылок")
+        p.add_argument("--port", type=int, default=443 if req else None)
+        p.add_argument("--api", required=req, help="host:port gRPC API Xray")
+        p.add_argument("--tag", default="vless-reality" if req else None, help="тег Reality inbound'а на узле")
+        p.add_argument("--network", default="tcp" if req else None)
+        p.add_argument("--sni", default="" if req else None)
+        p.add_argument("--sid", default="" if req else None)
+        p.add_argument("--pbk", default="" if req else None, help="публичный ключ Reality")
+        p.add_argument("--flow", default="xtls-rprx-vision" if req else None)
+        p.add_argument("--capacity", type=int, default=0 if req else None, help="клиентов; 0 — без ограничения")
+        if cmd == "set":
+            p.add_argument("--enable", action="store_true")
+            p.add_argument("--disable", action="store_true")
+    a = ap.parse_args()
+    if a.cmd in ("add", "set") and not NAME_RE.match(a.name):
+        ap.error("имя узла: 1-32 символа [A-Za-z0-9_.-]")
+    con = sqlite3.connect(a.db)
+    try:
+        con.executescript(NODES_SQL)
+        with con:
+            print({"add": _cli_add, "set": _cli_set, "list": _cli_list, "rebalance": _cli_rebalance}[a.cmd](con, a))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
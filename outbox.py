@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Исходящие сообщения бота: постоянная очередь (таблица outbox) + отправка с лимитами.
+
+Всё, что шлётся не в ответ на действие пользователя (напоминания об
+окончании подписки, рассылки), кладётся в outbox и уходит отсюда:
+- глобальный token bucket (Telegram: ~30 сообщений/с на бота),
+- не чаще одного сообщения в per_chat секунд в один чат,
+- TelegramRetryAfter ставит на паузу всю отправку на retry_after секунд,
+  сообщение возвращается в очередь; прочие ошибки — экспоненциальный
+  повтор, после max_attempts или если бот заблокирован — status='dead'.
+Очередь переживает рестарт: строки со status='queued' дочитываются.
+
+Reminders раз в interval секунд ищет по idx_sub_exp подписки, которые
+пересекли горизонт «осталось 24 ч» / «остался 1 ч», и кладёт напоминания
+в outbox; dedup-ключ remind:<окно>:<token> не даёт продублировать.
+"""
+import asyncio, collections, contextlib, time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+
+OUTBOX_SQL = """
+CREATE TABLE IF NOT EXISTS outbox (
+  id         INTEGER PRIMARY KEY AUTOINCREMENT,
+  chat_id    INTEGER NOT NULL,
+  text       TEXT NOT NULL,
+  markup     TEXT,
+  kind       TEXT NOT NULL,
+  dedup      TEXT UNIQUE,
+  status     TEXT NOT NULL DEFAULT 'queued',
+  attempts   INTEGER NOT NULL DEFAULT 0,
+  not_before REAL NOT NULL DEFAULT 0,
+  created_at INTEGER NOT NULL,
+  sent_at    INTEGER,
+  error      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, not_before);
+"""
+
+# send(chat_id, text, markup_json) — обёртка над bot.send_message
+SendFn = Callable[[int, str, Optional[str]], Awaitable[None]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now); continue
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Outbox:
+    def __init__(self, pool, send: SendFn, rate: float = 25.0, burst: int = 25, per_chat: float = 1.0,
+                 workers: int = 8, batch: int = 500, idle: float = 1.0, max_attempts: int = 5):
+        self.pool = pool
+        self.send = send
+        self.bucket = TokenBucket(rate, burst)
+        self.per_chat = per_chat
+        self.workers = workers
+        self.batch = batch
+        self.idle = idle
+        self.max_attempts = max_attempts
+        self._wake = asyncio.Event()
+        self._chat_next: Dict[int, float] = {}
+        self._done: List[tuple] = []          # (status, attempts, not_before, sent_at, error, id) — пишем пачкой
+        self._recent = collections.deque()     # monotonic времена последних отправок — для msg/s
+        # метрики
+        self.sent = 0
+        self.failed = 0
+        self.dead = 0
+        self.retry_after = 0
+        self.passes = 0
+        self.last_error = ""
+
+    # ---------- постановка в очередь ----------
+    async def enqueue(self, chat_id: int, text: str, kind: str = "message", markup: Optional[str] = None,
+                      dedup: Optional[str] = None) -> bool:
+        async with self.pool.write() as db:
+            cur = await db.execute(
+                "INSERT OR IGNORE INTO outbox(chat_id,text,markup,kind,dedup,created_at) VALUES(?,?,?,?,?,?)",
+                (chat_id, text, markup, kind, dedup, int(time.time())))
+            added = cur.rowcount == 1
+        if added:
+            self._wake.set()
+        return added
+
+    async def enqueue_many(self, rows: Sequence[Tuple[int, str, Optional[str], str, Optional[str]]]) -> int:
+        """rows: (chat_id, text, markup, kind, dedup)."""
+        if not rows:
+            return 0
+        async with self.pool.write() as db:
+            before = db.total_changes
+            await db.executemany(
+                "INSERT OR IGNORE INTO outbox(chat_id,text,markup,kind,dedup,created_at) VALUES(?,?,?,?,?,?)",
+                [(*r, int(time.time())) for r in rows])
+            added = db.total_changes - before
+        if added:
+            self._wake.set()
+        return added
+
+    async def broadcast(self, text: str, markup: Optional[str] = None) -> int:
+        """Рассылка всем пользователям одним INSERT ... SELECT."""
+        async with self.pool.write() as db:
+            cur = await db.execute(
+                "INSERT INTO outbox(chat_id,text,markup,kind,created_at) SELECT user_id, ?, ?, 'broadcast', ? FROM users",
+                (text, markup, int(time.time())))
+            added = cur.rowcount
+        self._wake.set()
+        return added
+
+    # ---------- отправка ----------
+    async def _load_due(self) -> List[tuple]:
+        async with self.pool.read() as db:
+            cur = await db.execute(
+                "SELECT id, chat_id, text, markup, attempts FROM outbox WHERE status='queued' AND not_before<=? "
+                "ORDER BY id LIMIT ?", (time.time(), self.batch))
+            return await cur.fetchall()
+
+    async def _flush(self):
+        done, self._done = self._done, []
+        if done:
+            async with self.pool.write() as db:
+                await db.executemany(
+                    "UPDATE outbox SET status=?, attempts=?, not_before=?, sent_at=?, error=? WHERE id=?", done)
+
+    async def _deliver(self, row: tuple):
+        mid, chat_id, text, markup, attempts = row
+        # per-chat: следующий в тот же чат — не раньше per_chat секунд
+        now = time.monotonic()
+        wait = self._chat_next.get(chat_id, 0.0) - now
+        self._chat_next[chat_id] = max(now, self._chat_next.get(chat_id, 0.0)) + self.per_chat
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await self.bucket.acquire()
+        try:
+            await self.send(chat_id, text, markup)
+        except TelegramRetryAfter as e:
+            self.retry_after += 1
+            self.bucket.pause(e.retry_after)
+            self._done.append(("queued", attempts, time.time() + e.retry_after, None, "retry_after", mid))
+            return
+        except TelegramForbiddenError as e:          # бот заблокирован / чат удалён — повторять бессмысленно
+            self.dead += 1; self.last_error = repr(e)
+            self._done.append(("dead", attempts + 1, 0, None, str(e)[:200], mid))
+            return
+        except (TelegramAPIError, OSError, asyncio.TimeoutError) as e:
+            self.failed += 1; self.last_error = repr(e)
+            attempts += 1
+            status = "dead" if attempts >= self.max_attempts else "queued"
+            self._done.append((status, attempts, time.time() + min(600, 5 * 2 ** attempts), None, str(e)[:200], mid))
+            return
+        self.sent += 1
+        self._recent.append(time.monotonic())
+        self._done.append(("sent", attempts + 1, 0, int(time.time()), None, mid))
+
+    async def _pass(self) -> int:
+        rows = await self._load_due()
+        if not rows:
+            return 0
+        q: asyncio.Queue = asyncio.Queue()
+        for r in rows:
+            q.put_nowait(r)
+
+        async def worker():
+            while not q.empty():
+                await self._deliver(q.get_nowait())
+                if len(self._done) >= 100:
+                    await self._flush()
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(rows)))))
+        await self._flush()
+        self.passes += 1
+        # per-chat метки старше окна не нужны
+        now = time.monotonic()
+        self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                n = await self._pass()
+            except Exception as e:
+                self.last_error = repr(e); n = 0
+            if n < self.batch:
+                self._wake.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), self.idle)
+
+    async def stats(self) -> dict:
+        async with self.pool.read() as db:
+            cur = await db.execute("SELECT status, count(*) FROM outbox GROUP BY status")
+            by_status = {s: n for s, n in await cur.fetchall()}
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+        return {"queue": by_status, "sent": self.sent, "failed": self.failed, "dead": self.dead,
+                "retry_after": self.retry_after, "passes": self.passes,
+                "rate_1m": round(len(self._recent) / 60, 2),
+                "paused_s": round(max(0.0, self.bucket.paused_until - now), 1), "last_error": self.last_error}
+
+
+class Reminders:
+    """Напоминания «подписка истекает через 24 ч / 1 ч» через outbox."""
+
+    def __init__(self, pool, outbox: Outbox, render: Callable[[str, str, int], Tuple[str, Optional[str]]],
+                 windows: Sequence[Tuple[str, int]] = (("24h", 86400), ("1h", 3600)), interval: float = 60.0):
+        self.pool = pool
+        self.outbox = outbox
+        self.render = render               # render(окно, token, expires_at) -> (text, markup_json)
+        self.windows = windows
+        self.interval = interval
+        self._cursor: Dict[str, int] = {}  # окно -> до какого expires_at уже просмотрели
+        self.queued = 0
+
+    async def scan(self) -> int:
+        now = int(time.time())
+        rows = []
+        wins = sorted(self.windows, key=lambda w: -w[1])
+        for i, (name, ahead) in enumerate(wins):
+            hi = now + ahead
+            # до ближайшего меньшего окна: кому осталось < 1 ч, «24 ч» уже не шлём
+            floor = now + (wins[i + 1][1] if i + 1 < len(wins) else 0)
+            lo = max(self._cursor.get(name, now), floor)
+            async with self.pool.read() as db:
+                cur = await db.execute(
+                    "SELECT token, user_id, expires_at FROM subscriptions WHERE expires_at>? AND expires_at<=?",
+                    (lo, hi))
+                for token, uid, exp in await cur.fetchall():
+                    text, markup = self.render(name, token, exp)
+                    rows.append((uid, text, markup, "remind", f"remind:{name}:{token}"))
+            self._cursor[name] = hi
+        n = await self.outbox.enqueue_many(rows)
+        self.queued += n
+        return n
+
+    async def run(self):
+        while True:
+            with contextlib.suppress(Exception):
+                await self.scan()
+            await asyncio.sleep(self.interval)
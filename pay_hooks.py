@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Проверка входящих уведомлений об оплате.
+
+CryptoBot: тело запроса подписано HMAC-SHA256 с ключом sha256(API-токена),
+подпись приходит в заголовке crypto-pay-api-signature (hex).
+YooMoney: HTTP-уведомление (form-urlencoded) с полем sha1_hash =
+sha1("notification_type&operation_id&amount&currency&datetime&sender&codepro&secret&label").
+
+Обе функции только проверяют подлинность; повторы и дубликаты гасит
+идемпотентное зачисление в main._fulfill_payment.
+"""
+import hashlib, hmac
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+CRYPTO_SIG_HEADER = "crypto-pay-api-signature"
+_YOO_FIELDS = ("notification_type", "operation_id", "amount", "currency", "datetime", "sender", "codepro")
+
+
+def cryptobot_verify(token: str, body: bytes, signature: Optional[str]) -> bool:
+    if not signature:
+        return False
+    key = hashlib.sha256(token.encode()).digest()
+    return hmac.compare_digest(hmac.new(key, body, hashlib.sha256).hexdigest(), signature.strip().lower())
+
+
+def parse_form(body: bytes) -> Dict[str, str]:
+    # без python-multipart: уведомление YooMoney — обычный application/x-www-form-urlencoded
+    return {k: v[0] for k, v in parse_qs(body.decode("utf-8"), keep_blank_values=True).items()}
+
+
+def yoomoney_verify(form: Dict[str, str], secret: str) -> bool:
+    got = form.get("sha1_hash") or ""
+    if not secret or not got:
+        return False
+    s = "&".join([form.get(k, "") for k in _YOO_FIELDS] + [secret, form.get("label", "")])
+    return hmac.compare_digest(hashlib.sha1(s.encode("utf-8")).hexdigest(), got.lower())
+
+
+def yoomoney_accepted(form: Dict[str, str]) -> bool:
+    """Деньги реально зачислены: не защищённый кодом протекции и не «неакцептованный» перевод."""
+    return form.get("codepro", "false") != "true" and form.get("unaccepted", "false") != "true"
+
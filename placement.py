@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Размещение подписок по узлам: rendezvous-хэш (HRW).
+
+Для uuid каждый узел получает очко h = hash(uuid, узел), равномерное в (0, 1);
+uuid живёт на K узлах с лучшими очками. При добавлении или удалении узла
+меняется выбор только у тех uuid, для которых этот узел входит в их K лучших,
+— остальные не двигаются (минимально возможное число переездов).
+
+Веса у всех узлов равные: capacity в очки не входит, иначе её смена у одного
+узла перетасовала бы ранги всех uuid. capacity — только допуск: узел, где
+активных клиентов уже capacity, пропускается, и uuid уходит на следующий по
+очкам; с переполненного узла (capacity уменьшили) plan() снимает ровно лишних.
+Когда мест впритык, uuid, которому не хватило K узлов, добирает их вторым
+проходом — из освободившихся мест или обменом узлом с одним другим uuid.
+
+plan() сравнивает текущее размещение с целевым и выдаёт разницу — что
+добавить и что снять на каждом узле; применяет её nodes.py пачками.
+"""
+import hashlib
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+
+class NodeLoad(NamedTuple):
+    id: int
+    capacity: int      # 0 — без лимита
+    load: int          # активных клиентов на узле сейчас
+    healthy: bool = True
+
+
+def _unit(key: str, node_id: int) -> float:
+    """Детерминированное равномерное число в (0, 1) для пары (uuid, узел)."""
+    x = int.from_bytes(hashlib.blake2b(f"{key}|{node_id}".encode(), digest_size=8).digest(), "big")
+    return (x + 1) / (2 ** 64 + 1)
+
+
+def rank(key: str, node_ids: Iterable[int]) -> List[int]:
+    """Узлы по убыванию очков HRW для key."""
+    return sorted(node_ids, key=lambda nid: _unit(key, nid), reverse=True)
+
+
+def _has_room(n: NodeLoad, load: int) -> bool:
+    return not n.capacity or load < n.capacity
+
+
+def place(key: str, nodes: Sequence[NodeLoad], k: int, prefer_healthy: bool = True) -> List[int]:
+    """K узлов для нового uuid: лучшие по очкам среди тех, где есть место (и, если хватает, здоровых)."""
+    if not nodes:
+        return []
+    load = {n.id: n for n in nodes}
+    order = rank(key, load)
+    room = [nid for nid in order if not load[nid].capacity or load[nid].load < load[nid].capacity]
+    if prefer_healthy:
+        live = [nid for nid in room if load[nid].healthy]
+        room = live + [nid for nid in room if nid not in live]
+    return (room or order)[:k]     # всё заполнено — лучше перегрузить узел, чем не выдать ключ
+
+
+class Plan(NamedTuple):
+    adds: Dict[int, List[str]]            # узел -> uuid, которые на него ставим
+    removes: Dict[int, List[str]]         # узел -> uuid, которые с него снимаем
+    moved: int                            # uuid, у которых меняется хотя бы один узел
+    total: int
+    before: Dict[int, int]                # клиентов на узле до / после
+    after: Dict[int, int]
+
+    def report(self, names: Optional[Dict[int, str]] = None, caps: Optional[Dict[int, int]] = None) -> dict:
+        name = (lambda i: (names or {}).get(i, str(i)))
+        nodes = sorted(set(self.before) | set(self.after) | set(self.adds) | set(self.removes))
+        return {"users": self.total, "users_moved": self.moved,
+                "moved_pct": round(self.moved * 100 / self.total, 2) if self.total else 0.0,
+                "replica_adds": sum(map(len, self.adds.values())),
+                "replica_removes": sum(map(len, self.removes.values())),
+                "nodes": {name(i): {"before": self.before.get(i, 0), "after": self.after.get(i, 0),
+                                    "add": len(self.adds.get(i, ())), "remove": len(self.removes.get(i, ())),
+                                    "capacity": (caps or {}).get(i, 0)} for i in nodes}}
+
+
+def plan(current: Dict[str, Set[int]], nodes: Sequence[NodeLoad], k: int) -> Plan:
+    """Разница между текущим размещением и целевым (HRW с допуском по capacity).
+
+    current — {uuid: узлы, где он есть или ставится}; nodes — включённые узлы (load в них не
+    используется: загрузка считается по current). Узлы вне nodes (выключенные/удалённые)
+    теряют всех своих клиентов. uuid обходятся в порядке сортировки — результат детерминирован;
+    вторым проходом недостающие до K реплики добираются из мест, освободившихся позже, или
+    обменом с одним другим uuid. Если не помогает и это, uuid остаётся на меньшем числе узлов.
+    """
+    valid = {n.id: n for n in nodes}
+    before: Dict[int, int] = {}
+    for cur in current.values():
+        for nid in cur:
+            before[nid] = before.get(nid, 0) + 1
+    load = {nid: before.get(nid, 0) for nid in valid}
+    need = min(k, len(valid))
+    target: Dict[str, List[int]] = {}
+    for u in sorted(current):
+        cur = current[u]
+        want: List[int] = []
+        dropped: Set[int] = set()              # сняты с переполненного узла (capacity уменьшили)
+        for nid in rank(u, valid):
+            if len(want) == k:
+                break
+            cap = valid[nid].capacity
+            if nid in cur:
+                if not cap or load[nid] <= cap:
+                    want.append(nid)
+                else:
+                    dropped.add(nid); load[nid] -= 1
+            elif not cap or load[nid] < cap:
+                want.append(nid); load[nid] += 1
+        # не хватило места: сохраняем то, что было, лишь бы у uuid оставалось K узлов
+        for nid in sorted(cur & valid.keys()):
+            if len(want) >= need:
+                break
+            if nid not in want:
+                want.append(nid)
+                if nid in dropped:
+                    dropped.discard(nid); load[nid] += 1
+        for nid in cur - set(want):
+            if nid in load and nid not in dropped:
+                load[nid] -= 1
+        target[u] = want
+    # второй проход: кому не хватило K — места, освобождённые uuid дальше по порядку, а если
+    # свободно только там, где uuid уже есть, — обмен: другой uuid с полного узла переезжает на
+    # свободный, и освободившееся место отдаётся этому
+    short = [u for u in sorted(current) if len(target[u]) < need]
+    members: Dict[int, List[str]] = {}
+    if short:
+        for v in sorted(current):
+            for nid in target[v]:
+                members.setdefault(nid, []).append(v)
+    for u in short:
+        want = target[u]
+        for nid in rank(u, valid):
+            if len(want) < need and nid not in want and _has_room(valid[nid], load[nid]):
+                want.append(nid); load[nid] += 1; members.setdefault(nid, []).append(u)
+        for nid in rank(u, valid):
+            if len(want) >= need:
+                break
+            if nid in want:
+                continue
+            free = [m for m in want if _has_room(valid[m], load[m])]
+            # сначала те, кто на nid ещё только ставится: их переезд ничего не стоит
+            for v in sorted(members.get(nid, ()), key=lambda v: (nid in current[v], v)):
+                m = next((m for m in free if m not in target[v]), None)
+                if m is None:
+                    continue
+                target[v].remove(nid); target[v].append(m); load[m] += 1
+                members[nid].remove(v); members.setdefault(m, []).append(v)
+                want.append(nid); members[nid].append(u)
+                break
+    adds: Dict[int, List[str]] = {}
+    removes: Dict[int, List[str]] = {}
+    moved = 0
+    for u in sorted(current):
+        cur, want = current[u], set(target[u])
+        add, rem = want - cur, cur - want
+        if not add and not rem:
+            continue
+        moved += 1
+        for nid in add:
+            adds.setdefault(nid, []).append(u)
+        for nid in rem:
+            removes.setdefault(nid, []).append(u)
+    after = {nid: n for nid, n in load.items() if n}
+    return Plan(adds, removes, moved, len(current), before, after)
+
+
+def diff_batches(p: Plan, size: int) -> Iterable[Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]]:
+    """Разница пачками по size uuid (все изменения одного uuid — в одной пачке):
+    ([(uuid, узел) добавить], [(uuid, узел) снять])."""
+    per: Dict[str, Tuple[List[int], List[int]]] = {}
+    for nid, us in p.adds.items():
+        for u in us:
+            per.setdefault(u, ([], []))[0].append(nid)
+    for nid, us in p.removes.items():
+        for u in us:
+            per.setdefault(u, ([], []))[1].append(nid)
+    items = sorted(per.items())
+    for i in range(0, len(items), size):
+        chunk = items[i:i + size]
+        yield ([(u, nid) for u, (a, _) in chunk for nid in a], [(u, nid) for u, (_, r) in chunk for nid in r])
@@ -1,15 +1,18 @@
-import json, sqlite3, subprocess, shlex
+import json, sqlite3, base64, functools, html
 from pathlib import Path
 from typing import Tuple
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import HTMLResponse, PlainTextResponse
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives import serialization
+
+from templates import Template, StaticAsset, html_response
 
 app = FastAPI()
 
 DB_FILE     = "/root/rel/bot_database.db"              # твой абсолютный путь
 XRAY_CONFIG = Path("/usr/local/etc/xray/config.json")
-XRAY_BIN    = "/usr/local/bin/xray"
 DOMAIN_OR_IP = "64.188.64.214"                          # хост для vless://
 
 def db_has_token(token: str) -> bool:
@@ -37,14 +40,17 @@ def read_vless() -> Tuple[str,int,str,str,str]:
     if not all([uuid, sni, sid, prv]): raise RuntimeError("incomplete realitySettings")
     return uuid, port, sni, sid, prv
 
+@functools.lru_cache(maxsize=16)
 def derive_public_key(private_key: str) -> str:
-    # xray x25519 -i <private>
-    cmd = f"{shlex.quote(XRAY_BIN)} x25519 -i {shlex.quote(private_key)}"
-    out = subprocess.check_output(cmd, shell=True, text=True)
-    for line in out.splitlines():
-        if line.startswith("PublicKey:"):
-            return line.split(":",1)[1].strip()
-    raise RuntimeError("PublicKey not derived")
+    # то же, что `xray x25519 -i <private>`, но без запуска процесса (как в pub_key.py)
+    raw = base64.urlsafe_b64decode(private_key + "=" * (-len(private_key) % 4))
+    if len(raw) != 32:
+        raise RuntimeError("PublicKey not derived")
+    pub = x25519.X25519PrivateKey.from_private_bytes(raw).public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    return base64.urlsafe_b64encode(pub).decode().rstrip("=")
 
 def make_vless(uuid: str, host: str, port: int, sni: str, pbk: str, sid: str, use_flow: bool) -> str:
     base = (
@@ -56,26 +62,35 @@ def make_vless(uuid: str, host: str, port: int, sni: str, pbk: str, sid: str, us
         base += "&flow=xtls-rprx-vision"
     return base + "#Pro100VPN"
 
+# страница собирается один раз; на запрос подставляется только токен
+SUBS_CSS = StaticAsset(b"""body{font-family:Arial;text-align:center;margin-top:48px}
+.row{margin:10px}
+button{padding:10px 18px}
+""", "text/css; charset=utf-8", max_age=86400)
+
+SUBS_PAGE = Template(f"""<html><head><title>Подписка Pro100VPN</title>
+<link rel="stylesheet" href="/static/subs.css?v={SUBS_CSS.version}"/></head>
+<body>
+  <h2>Подписка Pro100VPN</h2>
+  <p>Выберите способ добавления в HappVPN:</p>
+  <div class="row">
+    <a href="happ://add/http://{DOMAIN_OR_IP}/sub/${{token}}?noflow=0"><button>Добавить (с flow)</button></a>
+  </div>
+  <div class="row">
+    <a href="happ://add/http://{DOMAIN_OR_IP}/sub/${{token}}?noflow=1"><button>Добавить (без flow)</button></a>
+  </div>
+</body></html>
+""")
+
+@app.get("/static/subs.css")
+async def subs_css(request: Request):
+    return SUBS_CSS.response(request.headers.get("accept-encoding"), request.headers.get("if-none-match"))
+
 @app.get("/subs/{token}", response_class=HTMLResponse)
-async def subs_page(token: str):
+async def subs_page(token: str, request: Request):
     if not db_has_token(token):
         raise HTTPException(status_code=404, detail="Подписка не найдена")
-    url_flow   = f"http://{DOMAIN_OR_IP}/sub/{token}?noflow=0"
-    url_noflow = f"http://{DOMAIN_OR_IP}/sub/{token}?noflow=1"
-    html = f"""
-    <html><head><title>Подписка Pro100VPN</title></head>
-    <body style="font-family:Arial; text-align:center; margin-top:48px;">
-      <h2>Подписка Pro100VPN</h2>
-      <p>Выберите способ добавления в HappVPN:</p>
-      <div style="margin:10px;">
-        <a href="happ://add/{url_flow}"><button style="padding:10px 18px;">Добавить (с flow)</button></a>
-      </div>
-      <div style="margin:10px;">
-        <a href="happ://add/{url_noflow}"><button style="padding:10px 18px;">Добавить (без flow)</button></a>
-      </div>
-    </body></html>
-    """
-    return HTMLResponse(html)
+    return html_response(SUBS_PAGE.render(token=html.escape(token)), request.headers.get("accept-encoding"))
 
 @app.get("/sub/{token}", response_class=PlainTextResponse)
 async def sub_plain(token: str, noflow: int = Query(0)):
@@ -5,27 +5,43 @@ FastAPI-сервис, выдающий подписку для v2RayTun.
 Сохраняет совместимость: обычная /sub остается текстом VLESS, а /sub_v2raytun дублирует,
 плюс HTML-страница с deep-link "v2raytun://import-sub?url=...".
 """
-import os, base64, json
-from typing import Optional, Tuple
+import os, base64, json, time, hashlib, functools, html
+from typing import Optional, Tuple, NamedTuple
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import PlainTextResponse, HTMLResponse, RedirectResponse
-import aiosqlite
+from fastapi.responses import PlainTextResponse, HTMLResponse, RedirectResponse, Response
 from cryptography.hazmat.primitives.asymmetric import x25519
 from cryptography.hazmat.primitives import serialization
 
+from db_pool import SqlitePool
+from xray_shards import ShardStore
+from http_cache import sub_etag, etag_fresh, not_modified_since, sub_headers
+from templates import Template, StaticAsset, html_response
+
 # === Конфиг окружения (переопредели через env при деплое) ===
 DB_PATH     = os.getenv("DB_PATH", "/root/rel/bot_database.db")
 XRAY_CONFIG = os.getenv("XRAY_CONFIG", "/usr/local/etc/xray/config.json")
+# XRAY_SHARDS>1 — Reality inbound вынесен в XRAY_CONFDIR/reality_shard_NNN.json (см. xray_shards.py)
+XRAY_SHARDS  = int(os.getenv("XRAY_SHARDS", "0"))
+XRAY_CONFDIR = os.getenv("XRAY_CONFDIR", "/usr/local/etc/xray/conf.d")
 PUBLIC_HOST = os.getenv("PUBLIC_HOST", "64.188.64.214")   # куда будет указывать vless (твой IP/домен)
 PUBLIC_BASE = os.getenv("PUBLIC_BASE", f"https://{PUBLIC_HOST}")  # базовый URL для страницы/подписки
+DB_READERS  = int(os.getenv("DB_READERS", "4"))
+REALITY_RECHECK_SEC = float(os.getenv("REALITY_RECHECK_SEC", "1"))  # как часто сверять mtime/inode конфига
+ETAG_KEY    = hashlib.sha256(os.getenv("ETAG_SECRET", f"{DB_PATH}|{PUBLIC_HOST}").encode()).digest()
+SUB_UPDATE_INTERVAL_H = int(os.getenv("SUB_UPDATE_INTERVAL_H", "12"))  # profile-update-interval для клиентов
+ETAG_TTL    = int(os.getenv("ETAG_TTL", "900"))  # через сколько сек ETag снова сверяется с БД (досрочно снятые -> 404)
 
 app = FastAPI(title="rel-v2raytun-sub")
 
+# сервис только читает БД: пул без писателя, соединения открываются при первом запросе
+DB = SqlitePool(DB_PATH, readers=DB_READERS, writer=False)
+
 # === Утилиты Reality ===
 def _b64u_nopad(b: bytes) -> str:
     s = base64.urlsafe_b64encode(b).decode().rstrip("=")
     return s
 
+@functools.lru_cache(maxsize=16)
 def pbk_from_private_key(pk_str: str) -> str:
     """
     Reality privateKey обычно хранится base64 (raw 32 bytes).
@@ -42,20 +58,27 @@ def pbk_from_private_key(pk_str: str) -> str:
                                          format=serialization.PublicFormat.Raw)
     return _b64u_nopad(pub)
 
-def read_xray_reality() -> Tuple[int, str, str, str, str]:
-    """
-    Возвращает (port, network, sni, sid, pbk) из XRAY_CONFIG.
-    Берём первый inbound со security=reality.
-    """
-    with open(XRAY_CONFIG, "r", encoding="utf-8") as f:
-        data = json.load(f)
+class RealitySnapshot(NamedTuple):
+    version: str   # хэш параметров, стабилен между процессами
+    port: int
+    network: str
+    sni: str
+    sid: str
+    pbk: str
+
+_reality: Optional[RealitySnapshot] = None
+_reality_stamp: Optional[tuple] = None
+_reality_checked = 0.0
+_reality_since = 0.0   # mtime конфига, когда параметры в последний раз поменялись (Last-Modified)
+
+def _reality_from(data: dict) -> RealitySnapshot:
     inbound = None
     for ib in data.get("inbounds", []):
         ss = ib.get("streamSettings", {}) or {}
         if ss.get("security") == "reality" or ss.get("realitySettings"):
             inbound = ib; break
     if not inbound:
-        raise RuntimeError("Reality inbound not found in config.json")
+        raise RuntimeError("Reality inbound not found in " + _reality_path())
 
     port = int(inbound.get("port"))
     network = (inbound.get("streamSettings", {}) or {}).get("network", "tcp")
@@ -64,7 +87,58 @@ def read_xray_reality() -> Tuple[int, str, str, str, str]:
     sid = (rs.get("shortIds") or [""])[0]
     pk  = rs.get("privateKey") or ""
     pbk = pbk_from_private_key(pk) if pk else ""
-    return port, network, sni, sid, pbk
+    ver = hashlib.blake2b(f"{port}|{network}|{sni}|{sid}|{pbk}".encode(), digest_size=6).hexdigest()
+    return RealitySnapshot(ver, port, network, sni, sid, pbk)
+
+_shard_store: Optional[ShardStore] = None
+
+def _shards() -> ShardStore:
+    global _shard_store
+    if _shard_store is None:
+        _shard_store = ShardStore(XRAY_CONFDIR, XRAY_SHARDS, XRAY_CONFIG).load()
+    return _shard_store
+
+def _reality_path() -> str:
+    # после `xray_shards.py migrate` Reality-параметры лежат в шарде 0 (у всех шардов они одинаковые)
+    return _shards().path(0) if XRAY_SHARDS > 1 else XRAY_CONFIG
+
+def _shard_port(uuid: str) -> Optional[int]:
+    st = _shards()
+    port = st.port_for(uuid)
+    if port is None:
+        st.refresh(); port = st.port_for(uuid)   # клиента мог добавить бот
+    return port
+
+def reality_snapshot() -> RealitySnapshot:
+    """
+    Снапшот Reality-параметров. JSON конфига парсится заново только если
+    у файла поменялись inode/mtime/size (проверяем не чаще REALITY_RECHECK_SEC).
+    """
+    global _reality, _reality_stamp, _reality_checked, _reality_since
+    now = time.monotonic()
+    if _reality is not None and now - _reality_checked < REALITY_RECHECK_SEC:
+        return _reality
+    path = _reality_path()
+    st = os.stat(path)
+    stamp = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+    if _reality is None or stamp != _reality_stamp:
+        with open(path, "r", encoding="utf-8") as f:
+            st = os.fstat(f.fileno())
+            data = json.load(f)
+        snap = _reality_from(data)
+        if snap != _reality:
+            _reality, _reality_since = snap, st.st_mtime
+        _reality_stamp = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+    _reality_checked = now
+    return _reality
+
+def read_xray_reality() -> Tuple[int, str, str, str, str]:
+    """
+    Возвращает (port, network, sni, sid, pbk) из XRAY_CONFIG (или шарда 0).
+    Берём первый inbound со security=reality.
+    """
+    s = reality_snapshot()
+    return s.port, s.network, s.sni, s.sid, s.pbk
 
 async def token_valid(token: str) -> Tuple[Optional[int], Optional[str]]:
     """
@@ -74,7 +148,7 @@ async def token_valid(token: str) -> Tuple[Optional[int], Optional[str]]:
     if not os.path.exists(DB_PATH):
         return None, None
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with DB.read() as db:
             # subscriptions: token, user_id, expires_at
             async with db.execute("SELECT user_id, expires_at FROM subscriptions WHERE token = ?", (token,)) as cur:
                 row = await cur.fetchone()
@@ -107,21 +181,36 @@ def build_vless(host: str, port: int, uuid: str, network: str, sni: str, sid: st
 # ====== ENDPOINTS ======
 
 @app.get("/sub/{token}", response_class=PlainTextResponse)
-async def classic_sub(token: str, uuid: Optional[str] = None):
+async def classic_sub(token: str, uuid: Optional[str] = None, request: Request = None):
     """
     Классический текст подписки: 2 строки (NoFlow и Vision).
     Подходит для v2RayTun и любых клиентов.
+    Поддерживает If-None-Match / If-Modified-Since (304 без обращения к БД по ETag).
+    ETag меняется раз в ETAG_TTL сек: удалённый досрочно токен получит 404 не позже этого.
     """
-    user_id, _ = await token_valid(token)
+    snap = reality_snapshot()
+    inm = request.headers.get("if-none-match") if request is not None else None
+    extra = f"{uuid or ''}|{int(time.time()) // ETAG_TTL}"
+    fresh = etag_fresh(inm, ETAG_KEY, token, snap.version, extra=extra)
+    if fresh:
+        return Response(status_code=304, headers={"ETag": fresh, "Cache-Control": "private, no-cache"})
+    user_id, expires_at = await token_valid(token)
     if not user_id:
         raise HTTPException(404, "Token not found")
+    headers = {}
+    if expires_at:
+        headers = sub_headers(sub_etag(ETAG_KEY, token, int(expires_at), snap.version, extra=extra),
+                              _reality_since, SUB_UPDATE_INTERVAL_H)
+        if inm is None and request is not None and \
+                not_modified_since(request.headers.get("if-modified-since"), _reality_since):
+            return Response(status_code=304, headers=headers)
     port, network, sni, sid, pbk = read_xray_reality()
 
     # UUID берём из таблицы vpn_links, если есть; иначе принимаем из query ?uuid=
     real_uuid = uuid
     if not real_uuid and os.path.exists(DB_PATH):
         try:
-            async with aiosqlite.connect(DB_PATH) as db:
+            async with DB.read() as db:
                 async with db.execute("SELECT uuid FROM vpn_links WHERE token = ?", (token,)) as cur:
                     row = await cur.fetchone()
                     if row and row[0]:
@@ -130,7 +219,7 @@ async def classic_sub(token: str, uuid: Optional[str] = None):
             pass
     if not real_uuid:
         # в крайнем случае — первый клиент из конфига (не лучший вариант, но работает)
-        with open(XRAY_CONFIG, "r", encoding="utf-8") as f:
+        with open(_reality_path(), "r", encoding="utf-8") as f:
             data = json.load(f)
         inb = [ib for ib in data.get("inbounds", []) if ib.get("protocol") == "vless"]
         if inb and inb[0].get("settings", {}).get("clients"):
@@ -138,60 +227,71 @@ async def classic_sub(token: str, uuid: Optional[str] = None):
 
     if not real_uuid:
         raise HTTPException(400, "UUID is required, but not found. Pass ?uuid=... or store in vpn_links.")
+    if XRAY_SHARDS > 1:
+        port = _shard_port(real_uuid) or port
 
     v_no   = build_vless(PUBLIC_HOST, port, real_uuid, network, sni, sid, pbk, False, f"user{user_id}-NoFlow")
     v_flow = build_vless(PUBLIC_HOST, port, real_uuid, network, sni, sid, pbk, True,  f"user{user_id}-Vision")
-    return PlainTextResponse(v_no + "\n" + v_flow, media_type="text/plain; charset=utf-8")
+    return PlainTextResponse(v_no + "\n" + v_flow, media_type="text/plain; charset=utf-8", headers=headers)
 
 @app.get("/sub_v2raytun/{token}", response_class=PlainTextResponse)
-async def sub_v2raytun(token: str, uuid: Optional[str] = None):
+async def sub_v2raytun(token: str, request: Request, uuid: Optional[str] = None):
     """
     То же самое, просто отдельный путь (удобно для ссылок/маркетинга).
     """
-    return await classic_sub(token, uuid)
+    return await classic_sub(token, uuid, request)
 
-@app.get("/subs/{token}", response_class=HTMLResponse)
-async def subs_page(token: str, request: Request, uuid: Optional[str] = None):
-    """
-    Проста страница с кнопками: "Добавить в v2RayTun", "Скопировать подписку".
-    """
-    # проверим токен, дадим короткий фидбэк на странице, даже если нет БД
-    uid, expire = await token_valid(token)
-    status_badge = f"<span style='color:#2ecc71'>Активна</span>" if uid else "<span style='color:#e67e22'>Проверка токена пропущена</span>"
-    sub_url  = f"{PUBLIC_BASE}/sub_v2raytun/{token}" + (f"?uuid={uuid}" if uuid else "")
-    deep     = f"v2raytun://import-sub?url={sub_url}"
+# === Страница /subs: шаблон и CSS компилируются один раз при старте ===
+SUBS_CSS = StaticAsset(b"""body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,sans-serif;background:#0b0f14;color:#fff;margin:0}
+.wrap{max-width:640px;margin:24px auto;padding:16px}
+.card{background:#0f151d;border-radius:14px;padding:16px;margin-bottom:16px;border:1px solid #1f2a38}
+.btn{display:inline-block;background:#1e90ff;color:#fff;padding:12px 16px;border-radius:12px;text-decoration:none;margin-right:8px}
+.muted{color:#a9b2be}
+code{background:#0b0f14;border:1px solid #1f2a38;border-radius:8px;padding:4px 6px}
+.st-ok{color:#2ecc71}.st-skip{color:#e67e22}
+""", "text/css; charset=utf-8")
 
-    html = f"""
-<!doctype html>
+SUBS_PAGE = Template(f"""<!doctype html>
 <html lang="ru"><head>
 <meta charset="utf-8"/>
 <meta name="viewport" content="width=device-width, initial-scale=1"/>
 <title>Информация о подписке</title>
-<style>
- body{{font-family:system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,sans-serif;background:#0b0f14;color:#fff;margin:0}}
- .wrap{{max-width:640px;margin:24px auto;padding:16px}}
- .card{{background:#0f151d;border-radius:14px;padding:16px;margin-bottom:16px;border:1px solid #1f2a38}}
- .btn{{display:inline-block;background:#1e90ff;color:#fff;padding:12px 16px;border-radius:12px;text-decoration:none;margin-right:8px}}
- .muted{{color:#a9b2be}}
- code{{background:#0b0f14;border:1px solid #1f2a38;border-radius:8px;padding:4px 6px}}
-</style>
+<link rel="stylesheet" href="/static/subs.css?v={SUBS_CSS.version}"/>
 </head><body><div class="wrap">
   <h2>Подписка</h2>
   <div class="card">
-    <div>Статус: {status_badge}</div>
-    <div class="muted">Ссылка на подписку для клиентов: <code>/sub_v2raytun/{token}</code></div>
+    <div>Статус: ${{status}}</div>
+    <div class="muted">Ссылка на подписку для клиентов: <code>/sub_v2raytun/${{token}}</code></div>
   </div>
 
   <div class="card">
     <h3>Приложение v2RayTun</h3>
-    <p><a class="btn" href="{deep}">Добавить подписку в v2RayTun</a>
+    <p><a class="btn" href="${{deep}}">Добавить подписку в v2RayTun</a>
        <a class="btn" href="https://play.google.com/store/apps/details?id=com.v2raytun">Скачать в Google Play</a></p>
     <p class="muted">Если не открывается deep-link — скопируйте URL подписки и импортируйте вручную:<br/>
-      <code>{sub_url}</code></p>
+      <code>${{sub_url}}</code></p>
   </div>
 </div></body></html>
-"""
-    return HTMLResponse(html)
+""")
+
+ST_OK   = "<span class='st-ok'>Активна</span>"
+ST_SKIP = "<span class='st-skip'>Проверка токена пропущена</span>"
+
+@app.get("/static/subs.css")
+async def subs_css(request: Request):
+    return SUBS_CSS.response(request.headers.get("accept-encoding"), request.headers.get("if-none-match"))
+
+@app.get("/subs/{token}", response_class=HTMLResponse)
+async def subs_page(token: str, request: Request, uuid: Optional[str] = None):
+    """
+    Проста страница с кнопками: "Добавить в v2RayTun", "Скопировать подписку".
+    """
+    # проверим токен, дадим короткий фидбэк на странице, даже если нет БД
+    uid, expire = await token_valid(token)
+    sub_url  = html.escape(f"{PUBLIC_BASE}/sub_v2raytun/{token}" + (f"?uuid={uuid}" if uuid else ""))
+    page = SUBS_PAGE.render(status=ST_OK if uid else ST_SKIP, token=html.escape(token),
+                            deep=f"v2raytun://import-sub?url={sub_url}", sub_url=sub_url)
+    return html_response(page, request.headers.get("accept-encoding"))
 
 # Удобный редирект: импорт ОДНОГО узла в v2RayTun
 @app.get("/v2raytun_import_one/{token}")
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight: параллельные вызовы с одним ключом делят одно выполнение.
+
+Первый вызов (лидер) запускает fn(), остальные ждут тот же Task и получают
+тот же результат (или то же исключение) с пометкой leader=False — по ней
+обработчик понимает, что сообщение пользователю уже отправляет лидер.
+Task защищён shield'ом: отмена одного ожидающего не прерывает общую работу.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        # метрики
+        self.calls = 0
+        self.shared = 0
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """(результат, leader)."""
+        t = self._calls.get(key)
+        if t is not None and not t.done():
+            self.shared += 1
+            return await asyncio.shield(t), False
+        t = self._calls[key] = asyncio.create_task(fn())
+        t.add_done_callback(lambda task: self._done(key, task))
+        self.calls += 1
+        return await asyncio.shield(t), True
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._calls), "calls": self.calls, "shared": self.shared}
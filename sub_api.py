@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API подписок: /sub, /sub_v2raytun, /subs, /v2raytun_import_one, /health, /metrics.
+
+Отдельная точка входа для реплик, которые только раздают подписки: нужны
+FastAPI, aiosqlite и cryptography — без aiogram, SDK платёжек и токена бота.
+
+    python sub_api.py                     # uvicorn на API_HOST:API_PORT, API_WORKERS процессов
+    uvicorn sub_api:app --port 8001
+
+main.py импортирует этот модуль и достраивает то же приложение: вебхуки
+платёжек и Telegram, запись конфига Xray, расширения /health (HEALTH).
+"""
+import os, json, time, base64, asyncio, contextlib, hashlib, functools, html
+from typing import Optional, Tuple, Dict, List, Callable, NamedTuple
+from urllib.parse import quote
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, HTMLResponse, RedirectResponse, Response
+
+from cryptography.hazmat.primitives.asymmetric import x25519
+from cryptography.hazmat.primitives import serialization
+
+from db_pool import SqlitePool
+from xray_shards import ShardStore
+from http_cache import sub_etag, etag_fresh, not_modified_since, sub_headers
+from templates import Template, StaticAsset, html_response
+from sub_formats import Renderer, negotiate, MEDIA
+from metrics import Registry, AsgiTimer, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import Tracer, TraceAsgi
+from traffic import TRAFFIC_SQL, userinfo
+from nodes import NODES_SQL, Node, load_nodes, nodes_version
+
+# ===================== Конфигурация =====================
+DB_PATH     = os.getenv("DB_PATH", "/root/rel/bot_database.db")
+DB_READERS  = int(os.getenv("DB_READERS", "4"))   # read-only соединений в пуле
+XRAY_CONFIG = os.getenv("XRAY_CONFIG", "/usr/local/etc/xray/config.json")
+# XRAY_SHARDS>1 — клиенты разложены по N inbound'ам в XRAY_CONFDIR (см. xray_shards.py)
+XRAY_SHARDS   = int(os.getenv("XRAY_SHARDS", "0"))
+XRAY_CONFDIR  = os.getenv("XRAY_CONFDIR", "/usr/local/etc/xray/conf.d")
+
+API_WORKERS = int(os.getenv("API_WORKERS", "2"))
+PUBLIC_HOST = os.getenv("PUBLIC_HOST", "127.0.0.1")
+PUBLIC_BASE = os.getenv("PUBLIC_BASE", f"http://{PUBLIC_HOST}:8001")  # все ссылки, пока нет nginx
+API_HOST    = os.getenv("API_HOST", "0.0.0.0")
+API_PORT    = int(os.getenv("API_PORT", "8001"))
+
+# как часто (сек) сверять mtime/inode конфига xray для кэша Reality-параметров
+REALITY_RECHECK_SEC = float(os.getenv("REALITY_RECHECK_SEC", "1"))
+# условные GET подписки: ключ для mac в ETag и интервал обновления профиля у клиентов (часы)
+ETAG_KEY = hashlib.sha256(os.getenv("ETAG_SECRET", f"{DB_PATH}|{PUBLIC_HOST}").encode()).digest()
+SUB_UPDATE_INTERVAL_H = int(os.getenv("SUB_UPDATE_INTERVAL_H", "12"))
+# учёт трафика (traffic.py): квота на подписку (0 — без квоты; ведёт лидер в main.py) и заголовок
+# subscription-userinfo. ETag живёт не дольше USERINFO_TTL сек, чтобы 304 не держал расход устаревшим;
+# 0 — заголовок не отдаётся
+TRAFFIC_QUOTA_GB = float(os.getenv("TRAFFIC_QUOTA_GB", "0"))
+TRAFFIC_QUOTA    = int(TRAFFIC_QUOTA_GB * 1024**3)
+USERINFO_TTL     = int(os.getenv("USERINFO_TTL", "900"))
+# 304 по ETag отдаётся без чтения БД, поэтому подписку, снятую досрочно (квота, expire_batch), клиент
+# с ETag увидит как 404/410 только со сменой эпохи — не позже чем через ETAG_TTL сек
+ETAG_TTL         = int(os.getenv("ETAG_TTL", str(USERINFO_TTL or 900)))
+# несколько серверов (nodes.py): как часто перечитывать реестр узлов и их здоровье, сек
+NODES_RECHECK_SEC = float(os.getenv("NODES_RECHECK_SEC", "5"))
+
+# трассировка (см. tracing.py): пустой TRACE_FILE — выключена
+TRACE_FILE    = os.getenv("TRACE_FILE", "")
+TRACE_SAMPLE  = float(os.getenv("TRACE_SAMPLE", "0.01"))     # доля трасс, которые пишутся всегда
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))    # медленнее — пишется независимо от выборки
+TRACE_MAX_MB  = float(os.getenv("TRACE_MAX_MB", "50"))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "5"))
+
+# ===================== База =====================
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+  user_id    INTEGER PRIMARY KEY,
+  balance    REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS subscriptions (
+  token      TEXT PRIMARY KEY,
+  user_id    INTEGER NOT NULL,
+  uuid       TEXT NOT NULL,
+  expires_at INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS referrals (
+  user_id    INTEGER PRIMARY KEY,
+  ref_by     INTEGER
+);
+CREATE TABLE IF NOT EXISTS payments (
+  payment_id TEXT PRIMARY KEY,
+  user_id    INTEGER NOT NULL,
+  method     TEXT NOT NULL,
+  plan_id    TEXT,
+  amount     REAL NOT NULL,
+  currency   TEXT NOT NULL,
+  status     TEXT NOT NULL,
+  meta       TEXT,
+  created_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pay_user ON payments(user_id);
+CREATE INDEX IF NOT EXISTS idx_pay_status ON payments(method, status);
+CREATE INDEX IF NOT EXISTS idx_sub_exp ON subscriptions(expires_at);
+"""
+
+# ===================== Метрики (/metrics) и трассировка ===============
+METRICS=Registry()
+M_HTTP=METRICS.histogram("http_request_duration_seconds", "Время ответа API по маршруту", ["route"])
+M_HTTP_CODES=METRICS.counter("http_requests_total", "Ответы API по маршруту и коду", ["route","code"])
+M_DB=METRICS.histogram("sqlite_seconds", "SQLite: ожидание соединения/лока писателя (wait) и работа с ним (hold)", ["kind","phase"])
+
+TRACER=Tracer(TRACE_FILE, sample=TRACE_SAMPLE, slow_ms=TRACE_SLOW_MS, max_bytes=int(TRACE_MAX_MB*1024*1024),
+              backups=TRACE_BACKUPS, resource={"service.name":"rel","process.role":os.getenv("ROLE","sub")})
+
+def _db_observe(kind:str, phase:str, secs:float):
+    M_DB.observe(secs, kind, phase)
+    TRACER.record(f"sqlite.{kind}.{phase}", secs)
+
+# один пул на процесс: WAL, read-only читатели + единственный писатель
+DB=SqlitePool(DB_PATH, readers=DB_READERS)
+DB.observe=_db_observe
+
+async def get_sub(token:str):
+    """(user_id, uuid, expires_at, up, down, node_ids); up/down — накопленный трафик из traffic_totals
+    (NULL — ещё не было), node_ids — "1,3": узлы, на которые назначен uuid (NULL — реестр пуст)."""
+    async with DB.read() as db:
+        cur=await db.execute("SELECT s.user_id, s.uuid, s.expires_at, t.up, t.down, "
+                             "(SELECT group_concat(node_id) FROM node_clients c WHERE c.uuid=s.uuid AND c.state!='remove') "
+                             "FROM subscriptions s LEFT JOIN traffic_totals t ON t.uuid=s.uuid WHERE s.token=?", (token,))
+        return await cur.fetchone()
+
+# ================= Reality / XRAY (чтение) =================
+def _b64u(b:bytes)->str: return base64.urlsafe_b64encode(b).decode().rstrip("=")
+
+@functools.lru_cache(maxsize=16)
+def pbk_from_private_key(pk_str:str)->str:
+    raw=None
+    with contextlib.suppress(Exception): raw=base64.urlsafe_b64decode(pk_str+"==")
+    if raw is None:
+        with contextlib.suppress(Exception): raw=bytes.fromhex(pk_str)
+    if raw is None or len(raw)!=32:
+        raise ValueError("Reality privateKey должен быть 32 байта (base64url/hex).")
+    priv=x25519.X25519PrivateKey.from_private_bytes(raw)
+    pub=priv.public_key().public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+    return _b64u(pub)
+
+def _cfg_stamp(st:os.stat_result)->tuple: return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _load_xray_stamped(path:Optional[str]=None)->Tuple[dict,tuple]:
+    with open(path or XRAY_CONFIG,"r",encoding="utf-8") as f:
+        return json.load(f), _cfg_stamp(os.fstat(f.fileno()))
+
+def _load_xray()->dict: return _load_xray_stamped()[0]
+
+_shard_store:Optional[ShardStore]=None
+
+def _shards()->ShardStore:
+    global _shard_store
+    if _shard_store is None: _shard_store=ShardStore(XRAY_CONFDIR, XRAY_SHARDS, XRAY_CONFIG).load()
+    return _shard_store
+
+def _reality_path()->str:
+    # при шардировании Reality-параметры берём из шарда 0 (у всех шардов они одинаковые)
+    return _shards().path(0) if XRAY_SHARDS>1 else XRAY_CONFIG
+
+def _get_reality_inbound(data:dict):
+    for ib in data.get("inbounds",[]):
+        ss=ib.get("streamSettings",{}) or {}
+        if ss.get("security")=="reality" or ss.get("realitySettings"):
+            return ib
+    return None
+
+# --- снапшот Reality-параметров (кэш на процесс) ---
+class RealitySnapshot(NamedTuple):
+    version:str   # хэш параметров: одинаков во всех процессах и после рестарта
+    port:int
+    network:str
+    sni:str
+    sid:str
+    pbk:str
+
+_reality:Optional[RealitySnapshot]=None
+_reality_stamp:Optional[tuple]=None     # (dev, ino, mtime_ns, size) файла, из которого собран снапшот
+_reality_checked=0.0
+_reality_since=0.0                      # когда (mtime файла) текущие параметры впервые увидели — для Last-Modified
+
+def _reality_from(data:dict)->RealitySnapshot:
+    inbound=_get_reality_inbound(data)
+    if not inbound: raise RuntimeError("Reality inbound не найден")
+    port=int(inbound.get("port"))
+    network=(inbound.get("streamSettings",{}) or {}).get("network","tcp")
+    rs=(inbound.get("streamSettings",{}) or {}).get("realitySettings",{}) or {}
+    sni=(rs.get("serverNames") or [""])[0]
+    sid=(rs.get("shortIds") or [""])[0]
+    pk=rs.get("privateKey") or ""
+    pbk=pbk_from_private_key(pk) if pk else ""
+    ver=hashlib.blake2b(f"{port}|{network}|{sni}|{sid}|{pbk}".encode(), digest_size=6).hexdigest()
+    return RealitySnapshot(ver, port, network, sni, sid, pbk)
+
+def _set_reality(data:dict, stamp:tuple)->RealitySnapshot:
+    global _reality, _reality_stamp, _reality_checked, _reality_since
+    snap=_reality_from(data)
+    if _reality is not None and snap==_reality: snap=_reality
+    else: _reality_since=stamp[2]/1e9
+    _reality, _reality_stamp, _reality_checked = snap, stamp, time.monotonic()
+    return snap
+
+def reality_snapshot()->RealitySnapshot:
+    """Параметры Reality из XRAY_CONFIG. Файл перечитывается только при смене mtime/inode/size
+    (проверка не чаще REALITY_RECHECK_SEC) или после _save_xray."""
+    global _reality_checked
+    now=time.monotonic()
+    if _reality is not None and now-_reality_checked<REALITY_RECHECK_SEC:
+        return _reality
+    path=_reality_path()
+    if _reality is not None and _cfg_stamp(os.stat(path))==_reality_stamp:
+        _reality_checked=now
+        return _reality
+    data, stamp = _load_xray_stamped(path)
+    return _set_reality(data, stamp)
+
+def _shard_port(user_uuid:str)->Optional[int]:
+    st=_shards(); p=st.port_for(user_uuid)
+    if p is None:
+        st.refresh(); p=st.port_for(user_uuid)   # клиента мог добавить другой процесс
+    return p
+
+def read_xray_reality(user_uuid:Optional[str]=None)->Tuple[int,str,str,str,str]:
+    """(port, network, sni, sid, pbk); при шардировании port — порт шарда этого клиента."""
+    s=reality_snapshot()
+    port=s.port
+    if user_uuid and XRAY_SHARDS>1: port=_shard_port(user_uuid) or port
+    return port, s.network, s.sni, s.sid, s.pbk
+
+# --- реестр узлов (кэш на процесс): пока пуст — один сервер из XRAY_CONFIG ---
+class NodeView(NamedTuple):
+    version:str          # nodes_version: меняется с параметрами и здоровьем узлов — идёт в ETag
+    since:float          # последнее изменение реестра — для Last-Modified
+    nodes:List[Node]     # включённые узлы, и здоровые, и нет
+
+_node_view=NodeView("", 0.0, [])
+_node_view_at=float("-inf")
+
+async def node_view()->NodeView:
+    global _node_view, _node_view_at
+    now=time.monotonic()
+    if now-_node_view_at>=NODES_RECHECK_SEC:
+        _node_view_at=now                # до await: параллельные запросы не перечитывают реестр
+        async with DB.read() as db: nodes=await load_nodes(db)
+        _node_view=NodeView(nodes_version(nodes), float(max(n.changed_at for n in nodes)), nodes) if nodes else NodeView("", 0.0, [])
+    return _node_view
+
+def _user_nodes(view:NodeView, node_ids:Optional[str])->List[Node]:
+    """Узлы подписки: назначенные ей и здоровые; если здоровых нет — все назначенные (лучше, чем ничего)."""
+    ids={int(x) for x in (node_ids or "").split(",") if x}
+    mine=[n for n in view.nodes if n.id in ids]
+    return [n for n in mine if n.healthy] or mine
+
+def build_vless(host,port,uuid,network,sni,sid,pbk,vision:bool,name:Optional[str]):
+    base=f"vless://{uuid}@{host}:{port}?type={network}&security=reality&fp=chrome&alpn=h2,http/1.1"
+    if pbk: base+=f"&pbk={pbk}"
+    if sni: base+=f"&sni={sni}"
+    if sid: base+=f"&sid={sid}"
+    if vision: base+="&flow=xtls-rprx-vision"; name=name or "Reality Vision"
+    else: name=name or "Reality NoFlow"
+    return f"{base}#{name}"
+
+# ====================== FastAPI =========================
+app=FastAPI(title="rel v2raytun")
+
+# доп. секции /health: main.py регистрирует сюда xray, expiry, платёжки и т.д.; fn может быть async
+HEALTH:Dict[str,Callable[[],object]]={}
+
+@app.get("/health")
+async def health():
+    out={"ok":True,"ts":int(time.time()),"role":os.getenv("ROLE","sub"),"db":DB.stats(),"tracing":TRACER.stats()}
+    for k,fn in HEALTH.items():
+        v=fn()
+        out[k]=await v if asyncio.iscoroutine(v) else v
+    return out
+
+# --- gauges: считаются при скрейпе ---
+_active_subs_cache=(0.0, 0)
+async def _active_subs()->int:
+    global _active_subs_cache
+    ts, n = _active_subs_cache
+    if time.time()-ts>15:            # count(*) по subscriptions не на каждый скрейп
+        async with DB.read() as db:
+            cur=await db.execute("SELECT COUNT(*) FROM subscriptions WHERE expires_at>?", (int(time.time()),))
+            n=(await cur.fetchone())[0]
+        _active_subs_cache=(time.time(), n)
+    return n
+
+METRICS.gauge("subscriptions_active", "Подписки с expires_at в будущем (кэш 15 с)", _active_subs)
+
+# метки маршрутов для метрик/трасс; main.py дописывает свои (/pay, вебхук бота) до первого запроса —
+# Starlette собирает middleware при первом вызове приложения
+API_ROUTES=["/sub","/subs","/sub_v2raytun","/v2raytun_import_one","/static","/health","/metrics"]
+app.add_middleware(TraceAsgi, tracer=TRACER, routes=API_ROUTES)
+app.add_middleware(AsgiTimer, hist=M_HTTP, codes=M_HTTP_CODES, routes=API_ROUTES)
+
+@app.get("/metrics")
+async def metrics(): return Response(await METRICS.render(), media_type=METRICS_CONTENT_TYPE)
+
+# шаблоны форматов подписки собираются раз на версию Reality-конфига (или реестра узлов)
+SUB_RENDER=Renderer(build_vless)
+
+@app.get("/sub/{token}", response_class=PlainTextResponse)
+async def sub_plain(token:str, request:Request=None, format:Optional[str]=None):
+    view=await node_view()
+    snap=None if view.nodes else reality_snapshot()
+    ver, since = (view.version, view.since) if view.nodes else (snap.version, _reality_since)
+    fmt, by_ua = negotiate(format, request.headers.get("user-agent") if request is not None else None)
+    inm=request.headers.get("if-none-match") if request is not None else None
+    # эпоха в mac: раз в ETAG_TTL ревалидация идёт в БД — свежий subscription-userinfo, а досрочно
+    # снятая подписка получает 404/410 вместо 304 (окно до ETAG_TTL сек принято ради 304 без БД)
+    tag_extra=f"{fmt}|{int(time.time())//ETAG_TTL}"
+    fresh=etag_fresh(inm, ETAG_KEY, token, ver, extra=tag_extra)
+    vary={"Vary": "User-Agent"} if by_ua else {}
+    if fresh:
+        # профиль не менялся — 304 без чтения БД (ETag сам несёт версию и срок)
+        return Response(status_code=304, headers={"ETag": fresh, "Cache-Control": "private, no-cache", **vary})
+    row=await get_sub(token)
+    if not row: raise HTTPException(404,"Token not found")
+    uid, user_uuid, exp = int(row[0]), row[1], int(row[2])
+    if exp <= int(time.time()):
+        raise HTTPException(410, "Subscription expired")
+    nodes=_user_nodes(view, row[5]) if view.nodes else None
+    if nodes==[]: raise HTTPException(503, "Subscription is not provisioned on any node yet")
+    headers={**sub_headers(sub_etag(ETAG_KEY, token, exp, ver, extra=tag_extra), since, SUB_UPDATE_INTERVAL_H), **vary}
+    if USERINFO_TTL>0:
+        headers["subscription-userinfo"]=userinfo(row[3] or 0, row[4] or 0, TRAFFIC_QUOTA, exp)
+    if inm is None and request is not None and not_modified_since(request.headers.get("if-modified-since"), since):
+        return Response(status_code=304, headers=headers)
+    if nodes:
+        body=SUB_RENDER.render_nodes(fmt, ver, [n.params() for n in nodes], user_uuid, str(uid))
+    else:
+        port,network,sni,sid,pbk=read_xray_reality(user_uuid)
+        body=SUB_RENDER.render(fmt, snap.version, PUBLIC_HOST, port, network, sni, sid, pbk,
+                               user_uuid, f"user{uid}-NoFlow", f"user{uid}-Vision")
+    return PlainTextResponse(body, media_type=MEDIA[fmt], headers=headers)
+
+@app.get("/sub_v2raytun/{token}", response_class=PlainTextResponse)
+async def sub_v2(token:str, request:Request, format:Optional[str]=None): return await sub_plain(token, request, format)
+
+# --- страница /subs: скелет и CSS собираются один раз при импорте ---
+SUBS_CSS=StaticAsset("""body{font-family:system-ui,Segoe UI,Roboto,Ubuntu,sans-serif;background:#0b0f14;color:#fff;margin:0}
+.wrap{max-width:720px;margin:28px auto;padding:0 16px}.card{background:#0f151d;border:1px solid #1f2a38;border-radius:14px;padding:16px;margin:14px 0}
+.btn{display:inline-block;background:#1e90ff;color:#fff;padding:12px 16px;border-radius:12px;text-decoration:none}
+.muted{opacity:.7}.st-none{color:#e67e22}.st-exp{color:#e74c3c}.st-ok{color:#2ecc71}
+""".encode(), "text/css; charset=utf-8")
+
+SUBS_PAGE=Template(f"""<!doctype html><html lang="ru"><head><meta charset="utf-8"/>
+<meta name="viewport" content="width=device-width, initial-scale=1"/><title>Подписка</title>
+<link rel="stylesheet" href="/static/subs.css?v={SUBS_CSS.version}"/>
+</head><body><div class="wrap"><h2>Подписка</h2>
+<div class="card">Статус: ${{status}}</div>
+<div class="card">
+  <p><a class="btn" href="${{deep}}">Добавить подписку в v2RayTun</a></p>
+  <p class="muted">Если deep-link не сработал — импортируйте вручную:<br/><code>${{sub_url}}</code></p>
+</div></div></body></html>""")
+
+ST_NONE="<span class='st-none'>Не найдена</span>"
+ST_EXP ="<span class='st-exp'>Истекла</span>"
+ST_OK  ="<span class='st-ok'>Активна</span>"
+
+@app.get("/static/subs.css")
+async def subs_css(request:Request):
+    return SUBS_CSS.response(request.headers.get("accept-encoding"), request.headers.get("if-none-match"))
+
+@app.get("/subs/{token}", response_class=HTMLResponse)
+async def subs_page(token:str, request:Request):
+    row=await get_sub(token)
+    uid, exp = (int(row[0]), int(row[2])) if row else (None, None)
+    now=int(time.time())
+    if not uid: status=ST_NONE
+    elif exp and exp<=now: status=ST_EXP
+    else: status=ST_OK
+    # токен из пути — как есть в HTML нельзя
+    sub_url=html.escape(f"{PUBLIC_BASE}/sub_v2raytun/{token}")
+    page=SUBS_PAGE.render(status=status, deep=f"v2raytun://import-sub?url={sub_url}", sub_url=sub_url)
+    return html_response(page, request.headers.get("accept-encoding"))
+
+@app.get("/v2raytun_import_one/{token}")
+async def v2raytun_import_one(token:str, vision:int=0):
+    text=await sub_plain(token, None); links=text.body.decode().splitlines()
+    # без узлов строки — NoFlow и Vision; с узлами — по строке на узел с его flow
+    url=next((l for l in links if ("&flow=" in l)==bool(vision)), links[0])
+    return RedirectResponse(f"v2raytun://import/{quote(url, safe='')}")
+
+def run():
+    """Только подписки: uvicorn с API_WORKERS процессами (uvicorn импортируется здесь, не при импорте модуля)."""
+    import uvicorn
+    async def init():
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        await DB.open(SCHEMA_SQL + TRAFFIC_SQL + NODES_SQL); await DB.close()
+    asyncio.run(init())                  # схема — один раз в родителе, воркеры открывают пул лениво
+    os.environ.setdefault("ROLE","sub")
+    uvicorn.run("sub_api:app", host=API_HOST, port=API_PORT, workers=API_WORKERS, log_level="info",
+                app_dir=os.path.dirname(os.path.abspath(__file__)))
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Рендер подписки в нескольких форматах: plain (строки vless://), base64,
+Clash/Mihomo YAML и sing-box JSON.
+
+Для каждой версии Reality-конфига (и пары host/port — у шардов порт свой)
+шаблоны всех форматов собираются один раз; на запрос подставляются только
+uuid и имена профилей (Template из templates.py), т.е. цена — склейка строк.
+Формат выбирается по ?format=... или по User-Agent клиента.
+
+При нескольких узлах (nodes.py) render_nodes() даёт по одному профилю на узел
+с его flow (Vision или без flow); шаблоны кэшируются по набору узлов в пределах
+версии реестра.
+"""
+import base64, json
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from templates import Template
+
+FORMATS = ("plain", "base64", "clash", "singbox")
+_ALIASES = {"raw": "plain", "text": "plain", "b64": "base64", "v2ray": "base64",
+            "mihomo": "clash", "yaml": "clash", "sing-box": "singbox", "json": "singbox"}
+# подстроки User-Agent -> формат (побеждает первое совпадение)
+_UA = (("clash", "clash"), ("mihomo", "clash"), ("stash", "clash"),
+       ("sing-box", "singbox"), ("sfa/", "singbox"), ("sfi/", "singbox"), ("sfm/", "singbox"),
+       ("v2rayng", "base64"), ("v2rayn/", "base64"), ("shadowrocket", "base64"),
+       ("nekobox", "base64"), ("streisand", "base64"))
+MEDIA = {"plain": "text/plain; charset=utf-8", "base64": "text/plain; charset=utf-8",
+         "clash": "text/yaml; charset=utf-8", "singbox": "application/json; charset=utf-8"}
+
+U, N_NO, N_VIS = "${uuid}", "${name_no}", "${name_vis}"
+N_UID = "${uid}"
+
+# узел для render_nodes: (name, host, port, network, sni, sid, pbk, flow); name — [A-Za-z0-9_.-],
+# flow — как у клиентов узла в Xray ("" — без flow)
+NodeParams = Tuple[str, str, int, str, str, str, str, str]
+
+
+def negotiate(fmt: Optional[str], user_agent: Optional[str]) -> Tuple[str, bool]:
+    """(формат, выбран ли он по User-Agent — тогда ответу нужен Vary: User-Agent)."""
+    if fmt:
+        f = fmt.strip().lower()
+        f = _ALIASES.get(f, f)
+        if f in FORMATS:
+            return f, False
+    ua = (user_agent or "").lower()
+    for needle, f in _UA:
+        if needle in ua:
+            return f, True
+    return "plain", True
+
+
+def _clash_proxy(name: str, host: str, port: int, network: str, sni: str, sid: str, pbk: str, flow: bool) -> str:
+    return (f'  - name: "{name}"\n    type: vless\n    server: {host}\n    port: {port}\n'
+            f'    uuid: {U}\n    network: {network}\n    tls: true\n    udp: true\n'
+            + ("    flow: xtls-rprx-vision\n" if flow else "")
+            + f'    servername: "{sni}"\n    client-fingerprint: chrome\n'
+            f'    reality-opts:\n      public-key: "{pbk}"\n      short-id: "{sid}"\n')
+
+
+def _clash_doc(proxies: List[str], names: List[str]) -> str:
+    group = ", ".join(f'"{n}"' for n in names)
+    return ("proxies:\n" + "".join(proxies)
+            + f"proxy-groups:\n  - name: PROXY\n    type: select\n    proxies: [{group}]\n"
+            + "rules:\n  - MATCH,PROXY\n")
+
+
+def _clash(host: str, port: int, network: str, sni: str, sid: str, pbk: str) -> str:
+    return _clash_doc([_clash_proxy(N_NO, host, port, network, sni, sid, pbk, False),
+                       _clash_proxy(N_VIS, host, port, network, sni, sid, pbk, True)], [N_NO, N_VIS])
+
+
+def _singbox_out(tag: str, host: str, port: int, network: str, sni: str, sid: str, pbk: str, flow: bool) -> dict:
+    o = {"type": "vless", "tag": tag, "server": host, "server_port": port, "uuid": U,
+         "packet_encoding": "xudp",
+         "tls": {"enabled": True, "server_name": sni,
+                 "utls": {"enabled": True, "fingerprint": "chrome"},
+                 "reality": {"enabled": True, "public_key": pbk, "short_id": sid}}}
+    if flow:
+        o["flow"] = "xtls-rprx-vision"
+    if network and network != "tcp":
+        o["transport"] = {"type": network}
+    return o
+
+
+def _singbox_doc(outs: List[dict]) -> str:
+    doc = {"outbounds": outs + [{"type": "selector", "tag": "proxy", "outbounds": [o["tag"] for o in outs]},
+                                {"type": "direct", "tag": "direct"}],
+           "route": {"final": "proxy"}}
+    return json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
+
+
+def _singbox(host: str, port: int, network: str, sni: str, sid: str, pbk: str) -> str:
+    return _singbox_doc([_singbox_out(N_NO, host, port, network, sni, sid, pbk, False),
+                         _singbox_out(N_VIS, host, port, network, sni, sid, pbk, True)])
+
+
+class Renderer:
+    def __init__(self, build_vless: Callable[..., str]):
+        self.build_vless = build_vless
+        self._ver: Optional[str] = None
+        self._cache: Dict[Tuple[str, int], Dict[str, Template]] = {}
+        self._nodes_ver: Optional[str] = None
+        self._nodes_cache: Dict[Tuple[str, ...], Dict[str, Template]] = {}
+
+    def _templates(self, ver: str, host: str, port: int, network: str, sni: str, sid: str, pbk: str):
+        if ver != self._ver:          # конфиг поменялся — старые шаблоны больше не нужны
+            self._cache.clear(); self._ver = ver
+        key = (host, port)
+        t = self._cache.get(key)
+        if t is None:
+            plain = (self.build_vless(host, port, U, network, sni, sid, pbk, False, N_NO) + "\n"
+                     + self.build_vless(host, port, U, network, sni, sid, pbk, True, N_VIS))
+            t = self._cache[key] = {"plain": Template(plain),
+                                    "clash": Template(_clash(host, port, network, sni, sid, pbk)),
+                                    "singbox": Template(_singbox(host, port, network, sni, sid, pbk))}
+        return t
+
+    def render(self, fmt: str, ver: str, host: str, port: int, network: str, sni: str, sid: str, pbk: str,
+               uuid: str, name_no: str, name_vis: str) -> str:
+        t = self._templates(ver, host, port, network, sni, sid, pbk)
+        if fmt == "base64":
+            plain = t["plain"].render(uuid=uuid, name_no=name_no, name_vis=name_vis)
+            return base64.b64encode(plain.encode()).decode()
+        return t[fmt].render(uuid=uuid, name_no=name_no, name_vis=name_vis)
+
+    def _node_templates(self, ver: str, nodes: Sequence[NodeParams]):
+        if ver != self._nodes_ver:
+            self._nodes_cache.clear(); self._nodes_ver = ver
+        key = tuple(n[0] for n in nodes)
+        t = self._nodes_cache.get(key)
+        if t is None:
+            names = [f"user{N_UID}-{n[0]}" for n in nodes]
+            plain = "\n".join(self.build_vless(host, port, U, network, sni, sid, pbk, bool(flow), name)
+                              for name, (_, host, port, network, sni, sid, pbk, flow) in zip(names, nodes))
+            clash = _clash_doc([_clash_proxy(name, *n[1:7], bool(n[7])) for name, n in zip(names, nodes)], names)
+            singbox = _singbox_doc([_singbox_out(name, *n[1:7], bool(n[7])) for name, n in zip(names, nodes)])
+            t = self._nodes_cache[key] = {"plain": Template(plain), "clash": Template(clash),
+                                          "singbox": Template(singbox)}
+        return t
+
+    def render_nodes(self, fmt: str, ver: str, nodes: Sequence[NodeParams], uuid: str, uid: str) -> str:
+        """Одна строка vless:// на узел, с flow узла; ver — версия реестра узлов."""
+        t = self._node_templates(ver, nodes)
+        if fmt == "base64":
+            return base64.b64encode(t["plain"].render(uuid=uuid, uid=uid).encode()).decode()
+        return t[fmt].render(uuid=uuid, uid=uid)
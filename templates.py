@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Мини-шаблоны для HTML-страниц подписки.
+
+Template разбирает скелет страницы один раз при импорте: статичные куски
+склеены заранее, на запрос подставляются только слоты ${name}.
+StaticAsset — статичный файл (CSS) с заранее посчитанными gzip/brotli
+вариантами и ETag; отдаётся с долгим кэшем по версионированному URL.
+html_response() сжимает динамический HTML под Accept-Encoding клиента.
+"""
+import gzip, hashlib, re
+from typing import Dict, List, Optional
+
+from fastapi.responses import Response
+
+try:                       # brotli опционален: без него отдаём gzip
+    import brotli
+except ImportError:
+    brotli = None
+
+_SLOT = re.compile(r"\$\{(\w+)\}")
+MIN_COMPRESS = 256          # меньше — не жмём, заголовки дороже выигрыша
+
+
+class Template:
+    def __init__(self, src: str):
+        self.parts: List[str] = []
+        self.slots: List[str] = []
+        pos = 0
+        for m in _SLOT.finditer(src):
+            self.parts.append(src[pos:m.start()])
+            self.slots.append(m.group(1))
+            pos = m.end()
+        self.parts.append(src[pos:])
+
+    def render(self, **kw: str) -> str:
+        out = [self.parts[0]]
+        for name, part in zip(self.slots, self.parts[1:]):
+            out.append(kw[name]); out.append(part)
+        return "".join(out)
+
+
+def _accepts(accept_encoding: Optional[str], enc: str) -> bool:
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.lower().split(","):
+        name, *params = item.split(";")
+        if name.strip() != enc:
+            continue
+        q = 1.0
+        for p in params:
+            p = p.strip()
+            if p.startswith("q="):
+                try: q = float(p[2:])
+                except ValueError: q = 0.0
+        return q > 0
+    return False
+
+
+def _pick(accept_encoding: Optional[str], variants: Dict[str, bytes]) -> str:
+    for enc in ("br", "gzip"):
+        if enc in variants and _accepts(accept_encoding, enc):
+            return enc
+    return "identity"
+
+
+class StaticAsset:
+    def __init__(self, body: bytes, content_type: str, max_age: int = 31536000):
+        self.content_type = content_type
+        self.max_age = max_age
+        self.version = hashlib.blake2b(body, digest_size=6).hexdigest()
+        self.etag = f'"{self.version}"'
+        self.variants: Dict[str, bytes] = {"identity": body}
+        if len(body) >= MIN_COMPRESS:
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+
+    def response(self, accept_encoding: Optional[str] = None, if_none_match: Optional[str] = None) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={self.max_age}, immutable",
+                   "Vary": "Accept-Encoding"}
+        if if_none_match and self.etag in if_none_match:
+            return Response(status_code=304, headers=headers)
+        enc = _pick(accept_encoding, self.variants)
+        if enc != "identity":
+            headers["Content-Encoding"] = enc
+        return Response(self.variants[enc], media_type=self.content_type, headers=headers)
+
+
+def html_response(html: str, accept_encoding: Optional[str] = None, status_code: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> Response:
+    body = html.encode("utf-8")
+    h = {"Vary": "Accept-Encoding", **(headers or {})}
+    if len(body) >= MIN_COMPRESS:
+        if brotli is not None and _accepts(accept_encoding, "br"):
+            body = brotli.compress(body, quality=4); h["Content-Encoding"] = "br"
+        elif _accepts(accept_encoding, "gzip"):
+            body = gzip.compress(body, compresslevel=5, mtime=0); h["Content-Encoding"] = "gzip"
+    return Response(body, status_code=status_code, media_type="text/html; charset=utf-8", headers=h)
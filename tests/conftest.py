@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import asyncio, os, sys
+from types import SimpleNamespace
+
+import pytest
+
+# модули проекта лежат в корне репозитория, без пакета
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CRYPTO_TOKEN = "test-token"
+YOO_SECRET = "01234567890ABCDEF01234567890"
+
+
+@pytest.fixture(scope="session")
+def app_main(tmp_path_factory):
+    """main.py на SQLite в tmp: конфиг читается из env при импорте, поэтому импорт — один раз за сессию.
+    Пул и его локи живут в одном цикле — его и отдаём тестам: (main, loop)."""
+    pytest.importorskip("aiogram")
+    d = tmp_path_factory.mktemp("app")
+    os.environ.update(DB_PATH=str(d / "bot.db"), CRYPTO_TOKEN=CRYPTO_TOKEN, YOOMONEY_NOTIFY_SECRET=YOO_SECRET,
+                      XRAY_CONFIG=str(d / "config.json"))
+    import main
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(main.db_init())
+    yield main, loop
+    loop.run_until_complete(main.DB.close())
+    loop.close()
+
+
+@pytest.fixture
+def app(app_main, monkeypatch):
+    """Чистые таблицы; выдача в Xray не выполняется, а записывается в app.provisioned."""
+    main, loop = app_main
+
+    async def reset():
+        async with main.DB.write() as db:
+            for t in ("payments", "users", "referrals", "subscriptions", "outbox", "xray_jobs"):
+                await db.execute(f"DELETE FROM {t}")
+    loop.run_until_complete(reset())
+    provisioned = []
+
+    async def provision(token, new_uuid, exp):
+        provisioned.append((token, new_uuid, exp))
+    monkeypatch.setattr(main, "_provision", provision)
+    return SimpleNamespace(main=main, run=loop.run_until_complete, provisioned=provisioned)
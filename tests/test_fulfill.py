@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""main._fulfill_payment: зачисление ровно один раз и целиком (или ничего)."""
+import asyncio
+
+import pytest
+
+
+def _row(app, payment_id: str):
+    async def go():
+        async with app.main.DB.read() as db:
+            cur = await db.execute("SELECT status FROM payments WHERE payment_id=?", (payment_id,))
+            status = (await cur.fetchone())[0]
+            cur = await db.execute("SELECT COUNT(*) FROM subscriptions")
+            subs = (await cur.fetchone())[0]
+        return status, subs
+    return app.run(go())
+
+
+@pytest.mark.parametrize("plan_id", [None, "1m"])
+def test_concurrent_fulfill_credits_once(app, plan_id):
+    m = app.main
+    app.run(m.ensure_user(5)); app.run(m.ensure_user(6, ref_by=5))
+    app.run(m._record_payment("p1", 6, "crypto", plan_id, 200.0, "RUB", "paid"))
+
+    async def race():
+        return await asyncio.gather(*(m._fulfill_payment("p1") for _ in range(4)))
+    results = app.run(race())
+    done = [f for f in results if f is not None]
+    assert len(done) == 1 and done[0].user_id == 6
+    assert _row(app, "p1") == ("credited", 1 if plan_id else 0)
+    assert app.run(m.get_balance(6)) == (0.0 if plan_id else 200.0)
+    assert app.run(m.get_balance(5)) == round(200.0 * m.REFERRAL_PERCENT, 2)   # бонус тоже один раз
+    assert len(app.provisioned) == (1 if plan_id else 0)
+    assert app.run(m._fulfill_payment("p1")) is None
+
+
+def test_failure_after_claim_rolls_back(app, monkeypatch):
+    m = app.main
+    app.run(m.ensure_user(5)); app.run(m.ensure_user(6, ref_by=5))
+    app.run(m._record_payment("p2", 6, "yoomoney", "1m", 300.0, "RUB", "pending"))
+
+    async def boom(*a, **kw):
+        raise RuntimeError("disk full")
+    with monkeypatch.context() as mp:
+        mp.setattr(m, "_insert_subscription", boom)
+        with pytest.raises(RuntimeError):
+            app.run(m._fulfill_payment("p2"))
+    # ни статуса credited, ни реферального бонуса, ни подписки
+    assert _row(app, "p2") == ("pending", 0)
+    assert app.run(m.get_balance(5)) == 0.0
+    assert app.provisioned == []
+    # после сбоя платёж по-прежнему можно выдать
+    assert app.run(m._fulfill_payment("p2")) is not None
+    assert _row(app, "p2") == ("credited", 1)
+
+
+class TwoProcesses:
+    """Писатели бота и api — разные соединения к одному файлу: write() по очереди отдаёт то одно, то другое."""
+
+    def __init__(self, a, b):
+        self.pools, self.i = (a, b), 0
+
+    def read(self):
+        return self.pools[0].read()
+
+    def write(self):
+        self.i ^= 1
+        return self.pools[self.i].write()
+
+
+def test_two_writers_credit_once(app, monkeypatch):
+    from db_pool import SqlitePool
+    m = app.main
+    app.run(m.ensure_user(6))
+    app.run(m._record_payment("p3", 6, "crypto", None, 120.0, "RUB", "paid"))
+    other = SqlitePool(m.DB_PATH, readers=1)
+    app.run(other.open())
+    monkeypatch.setattr(m, "DB", TwoProcesses(m.DB, other))
+
+    async def race():
+        return await asyncio.gather(*(m._fulfill_payment("p3") for _ in range(4)))
+    try:
+        done = [f for f in app.run(race()) if f is not None]
+    finally:
+        app.run(other.close())
+    assert len(done) == 1
+    assert app.run(m.get_balance(6)) == 120.0
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Вебхуки оплаты: подписи CryptoBot/YooMoney по эталонным векторам и зачисление через /pay/*."""
+import hashlib, hmac, json
+from urllib.parse import urlencode
+
+import pytest
+
+from conftest import CRYPTO_TOKEN, YOO_SECRET
+from pay_hooks import CRYPTO_SIG_HEADER, cryptobot_verify, parse_form, yoomoney_accepted, yoomoney_verify
+
+# подпись посчитана независимо: HMAC-SHA256(key=sha256("test-token"), body) через openssl
+CRYPTO_BODY = b'{"update_id":1,"update_type":"invoice_paid","payload":{"invoice_id":101,"status":"paid"}}'
+CRYPTO_SIG = "66968d19f6d25fba8cd44cdbf7d9faaeaa4535ac979c41cc3bcb07f2c46f3da8"
+
+# пример из документации YooMoney (HTTP-уведомления), sha1_hash оттуда же
+YOO_FORM = {"notification_type": "p2p-incoming", "operation_id": "1234567", "amount": "300.00", "currency": "643",
+            "datetime": "2011-07-01T09:00:00.000+04:00", "sender": "41001XXXXXXXX", "codepro": "false",
+            "label": "YM.label.12345", "sha1_hash": "a2ee4a9195f4a90e893cff4f62eeba0b662321f9"}
+
+
+def test_cryptobot_signature_vector():
+    assert cryptobot_verify(CRYPTO_TOKEN, CRYPTO_BODY, CRYPTO_SIG)
+    assert cryptobot_verify(CRYPTO_TOKEN, CRYPTO_BODY, CRYPTO_SIG.upper() + "\n")
+    assert not cryptobot_verify(CRYPTO_TOKEN, CRYPTO_BODY.replace(b"101", b"102"), CRYPTO_SIG)
+    assert not cryptobot_verify("other-token", CRYPTO_BODY, CRYPTO_SIG)
+    assert not cryptobot_verify(CRYPTO_TOKEN, CRYPTO_BODY, None)
+    assert not cryptobot_verify(CRYPTO_TOKEN, CRYPTO_BODY, "")
+
+
+def test_yoomoney_signature_vector():
+    assert yoomoney_verify(YOO_FORM, YOO_SECRET)
+    assert yoomoney_verify(parse_form(urlencode(YOO_FORM).encode()), YOO_SECRET)
+    assert not yoomoney_verify({**YOO_FORM, "amount": "3000.00"}, YOO_SECRET)
+    assert not yoomoney_verify({**YOO_FORM, "label": "YM.label.other"}, YOO_SECRET)
+    assert not yoomoney_verify({k: v for k, v in YOO_FORM.items() if k != "sha1_hash"}, YOO_SECRET)
+    assert not yoomoney_verify(YOO_FORM, "")
+    assert yoomoney_accepted(YOO_FORM)
+    assert not yoomoney_accepted({**YOO_FORM, "codepro": "true"})
+    assert not yoomoney_accepted({**YOO_FORM, "unaccepted": "true"})
+
+
+# ---------- эндпоинты main.py ----------
+httpx = pytest.importorskip("httpx")
+
+
+def _yoo_signed(**kw) -> bytes:
+    form = {**{k: v for k, v in YOO_FORM.items() if k != "sha1_hash"}, **kw}
+    s = "&".join([form[k] for k in ("notification_type", "operation_id", "amount", "currency", "datetime",
+                                    "sender", "codepro")] + [YOO_SECRET, form["label"]])
+    return urlencode({**form, "sha1_hash": hashlib.sha1(s.encode()).hexdigest()}).encode()
+
+
+def _post(app, path: str, body: bytes, headers: dict):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app.main.app), base_url="http://api") as c:
+            return await c.post(path, content=body, headers=headers)
+    return app.run(go())
+
+
+def _state(app, payment_id: str, user_id: int):
+    async def go():
+        async with app.main.DB.read() as db:
+            cur = await db.execute("SELECT status FROM payments WHERE payment_id=?", (payment_id,))
+            status = (await cur.fetchone())[0]
+            cur = await db.execute("SELECT COUNT(*) FROM subscriptions WHERE user_id=?", (user_id,))
+            subs = (await cur.fetchone())[0]
+            cur = await db.execute("SELECT COUNT(*) FROM outbox WHERE chat_id=?", (user_id,))
+            msgs = (await cur.fetchone())[0]
+        return status, await app.main.get_balance(user_id), subs, msgs
+    return app.run(go())
+
+
+def _crypto(app, body=CRYPTO_BODY, sig=CRYPTO_SIG):
+    headers = {"Content-Type": "application/json"}
+    if sig is not None:
+        headers[CRYPTO_SIG_HEADER] = sig
+    return _post(app, "/pay/cryptobot", body, headers)
+
+
+def _yoo(app, body: bytes):
+    return _post(app, "/pay/yoomoney", body, {"Content-Type": "application/x-www-form-urlencoded"})
+
+
+def test_cryptobot_webhook_rejects_bad_signature(app):
+    app.run(app.main._record_payment("101", 7, "crypto", None, 150.0, "RUB", "pending"))
+    assert _crypto(app, sig=None).status_code == 401
+    assert _crypto(app, sig="0" * 64).status_code == 401
+    assert _crypto(app, body=CRYPTO_BODY + b" ").status_code == 401
+    assert _state(app, "101", 7) == ("pending", 0.0, 0, 0)
+
+
+def test_cryptobot_webhook_credits_once(app):
+    app.run(app.main._record_payment("101", 7, "crypto", None, 150.0, "RUB", "pending"))
+    for _ in range(2):
+        r = _crypto(app)
+        assert r.status_code == 200 and r.json() == {"ok": True}
+    assert _state(app, "101", 7) == ("credited", 150.0, 0, 1)
+
+
+def test_cryptobot_webhook_ignores_other_updates(app):
+    app.run(app.main._record_payment("101", 7, "crypto", None, 150.0, "RUB", "pending"))
+    body = json.dumps({"update_type": "invoice_expired", "payload": {"invoice_id": 101, "status": "expired"}}).encode()
+    key = hashlib.sha256(CRYPTO_TOKEN.encode()).digest()
+    assert _crypto(app, body=body, sig=hmac.new(key, body, hashlib.sha256).hexdigest()).status_code == 200
+    assert _state(app, "101", 7) == ("pending", 0.0, 0, 0)
+
+
+def test_yoomoney_webhook_rejects_bad_signature(app):
+    app.run(app.main._record_payment("YM.label.12345", 8, "yoomoney", "1m", 300.0, "RUB", "pending"))
+    assert _yoo(app, _yoo_signed().replace(b"sha1_hash=", b"sha1_hash=0")).status_code == 401
+    assert _yoo(app, urlencode({k: v for k, v in YOO_FORM.items() if k != "sha1_hash"}).encode()).status_code == 401
+    assert _state(app, "YM.label.12345", 8) == ("pending", 0.0, 0, 0)
+
+
+@pytest.mark.parametrize("flag", [{"codepro": "true"}, {"unaccepted": "true"}])
+def test_yoomoney_webhook_ignores_unaccepted(app, flag):
+    app.run(app.main._record_payment("YM.label.12345", 8, "yoomoney", "1m", 300.0, "RUB", "pending"))
+    r = _yoo(app, _yoo_signed(**flag))
+    assert r.status_code == 200 and r.text == "ok"
+    assert _state(app, "YM.label.12345", 8) == ("pending", 0.0, 0, 0)
+    assert app.provisioned == []
+
+
+def test_yoomoney_webhook_credits_once(app):
+    app.run(app.main._record_payment("YM.label.12345", 8, "yoomoney", "1m", 300.0, "RUB", "pending"))
+    for _ in range(2):
+        r = _yoo(app, _yoo_signed())
+        assert r.status_code == 200 and r.text == "ok"
+    status, _, subs, msgs = _state(app, "YM.label.12345", 8)
+    assert (status, subs, msgs) == ("credited", 1, 2)     # подписка одна; «оплата получена» + ключ
+    assert len(app.provisioned) == 1
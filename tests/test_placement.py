@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""placement.plan: минимум переездов, допуск по capacity, идемпотентность, пачки diff_batches."""
+from placement import NodeLoad, diff_batches, plan, rank
+
+USERS = [f"user-{i:05d}" for i in range(3000)]
+
+
+def nodes(*caps, ids=None):
+    return [NodeLoad(nid, cap, 0) for nid, cap in zip(ids or range(1, len(caps) + 1), caps)]
+
+
+def apply(current, p):
+    out = {u: set(s) for u, s in current.items()}
+    for nid, us in p.adds.items():
+        for u in us:
+            out[u].add(nid)
+    for nid, us in p.removes.items():
+        for u in us:
+            out[u].discard(nid)
+    return out
+
+
+def placed(ns, k, users=USERS):
+    empty = {u: set() for u in users}
+    return apply(empty, plan(empty, ns, k))
+
+
+def test_adding_node_moves_only_uuids_that_rank_it_top_k():
+    ns = nodes(0, 0, 0, 0)
+    cur = placed(ns, 2)
+    bigger = ns + nodes(0, ids=[5])
+    p = plan(cur, bigger, 2)
+    expect = {u for u in USERS if 5 in rank(u, [n.id for n in bigger])[:2]}
+    assert set(p.adds) == {5} and set(p.adds[5]) == expect
+    assert p.moved == len(expect)
+    # у переехавших снята ровно одна реплика — та, что вытеснена узлом 5
+    assert sum(map(len, p.removes.values())) == len(expect)
+
+
+def test_removing_node_moves_only_its_uuids():
+    ns = nodes(0, 0, 0, 0)
+    cur = placed(ns, 2)
+    on2 = {u for u, s in cur.items() if 2 in s}
+    p = plan(cur, [n for n in ns if n.id != 2], 2)
+    assert p.moved == len(on2)
+    assert set(p.removes) == {2} and set(p.removes[2]) == on2
+    assert {u for us in p.adds.values() for u in us} == on2
+    after = apply(cur, p)
+    assert all(cur[u] - {2} <= after[u] and len(after[u]) == 2 for u in on2)
+
+
+def test_lowering_capacity_moves_exactly_the_excess():
+    ns = nodes(1000, 1000, 1000, 1000)
+    cur = placed(ns, 1)
+    on1 = sum(1 for s in cur.values() if 1 in s)
+    assert on1 > 500
+    p = plan(cur, nodes(500, 1000, 1000, 1000), 1)
+    assert p.moved == on1 - 500
+    assert set(p.removes) == {1} and len(p.removes[1]) == on1 - 500
+    assert p.after[1] == 500 and all(n <= 1000 for n in p.after.values())
+
+
+def test_plan_is_idempotent():
+    for ns, k in ((nodes(0, 0, 0), 2), (nodes(800, 1000, 1200, 0), 1), (nodes(2000, 2000, 2000), 2)):
+        cur = placed(ns, k)
+        again = plan(cur, ns, k)
+        assert again.moved == 0 and not again.adds and not again.removes
+    cur = placed(nodes(1000, 1000, 1000, 1000), 1)
+    shrunk = nodes(500, 1000, 1000, 1000)
+    assert plan(apply(cur, plan(cur, shrunk, 1)), shrunk, 1).moved == 0
+
+
+def test_tight_capacity_keeps_k_replicas():
+    # 3000 uuid x 2 реплики = 6000 мест ровно на трёх оставшихся узлах
+    ns = nodes(2000, 2000, 2000, 2000)
+    cur = placed(ns, 2)
+    rest = [n for n in ns if n.id != 2]
+    p = plan(cur, rest, 2)
+    after = apply(cur, p)
+    assert all(len(s) == 2 for s in after.values())
+    assert p.after == {1: 2000, 3: 2000, 4: 2000}
+    assert plan(after, rest, 2).moved == 0
+
+
+def test_diff_batches_keep_each_uuid_in_one_batch():
+    ns = nodes(0, 0, 0, 0)
+    cur = placed(ns, 2)
+    p = plan(cur, [n for n in ns if n.id != 3] + nodes(0, ids=[7]), 2)
+    seen, adds, removes = set(), set(), set()
+    for add, rem in diff_batches(p, 50):
+        batch = {u for u, _ in add} | {u for u, _ in rem}
+        assert len(batch) <= 50 and not batch & seen
+        seen |= batch
+        adds |= set(add); removes |= set(rem)
+    assert adds == {(u, nid) for nid, us in p.adds.items() for u in us}
+    assert removes == {(u, nid) for nid, us in p.removes.items() for u in us}
+    assert len(seen) == p.moved
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""/sub: 304 по ETag без БД и окно ETAG_TTL для подписок, снятых раньше срока."""
+import base64, json, time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+
+@pytest.fixture
+def sub(app):
+    from cryptography.hazmat.primitives.asymmetric import x25519
+    from cryptography.hazmat.primitives import serialization
+    import sub_api
+    pk = x25519.X25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.Raw, serialization.PrivateFormat.Raw, serialization.NoEncryption())
+    inbound = {"tag": "vless-reality", "port": 443, "protocol": "vless", "settings": {"clients": []},
+               "streamSettings": {"network": "tcp", "security": "reality",
+                                  "realitySettings": {"serverNames": ["example.com"], "shortIds": ["ab"],
+                                                      "privateKey": base64.b64encode(pk).decode()}}}
+    with open(sub_api.XRAY_CONFIG, "w", encoding="utf-8") as f:
+        json.dump({"inbounds": [inbound]}, f)
+    token = app.run(app.main.create_subscription(9, days=30))
+    return app, sub_api, token
+
+
+def _get(app, sub_api, token, etag=None):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=sub_api.app), base_url="http://api") as c:
+            return await c.get(f"/sub/{token}", headers={"If-None-Match": etag} if etag else {})
+    return app.run(go())
+
+
+def test_early_removal_is_seen_after_etag_ttl(sub, monkeypatch):
+    app, sub_api, token = sub
+    start = time.time() // sub_api.ETAG_TTL * sub_api.ETAG_TTL
+    monkeypatch.setattr(time, "time", lambda: start + 1)
+    r = _get(app, sub_api, token)
+    assert r.status_code == 200 and r.text.startswith("vless://")
+    etag = r.headers["etag"]
+    assert _get(app, sub_api, token, etag).status_code == 304
+
+    async def drop():   # как expire_batch при выборе квоты
+        async with app.main.DB.write() as db:
+            await db.execute("DELETE FROM subscriptions WHERE token=?", (token,))
+    app.run(drop())
+    # в пределах эпохи — ещё 304 без БД (принятое окно)
+    monkeypatch.setattr(time, "time", lambda: start + sub_api.ETAG_TTL - 1)
+    assert _get(app, sub_api, token, etag).status_code == 304
+    monkeypatch.setattr(time, "time", lambda: start + sub_api.ETAG_TTL)
+    assert _get(app, sub_api, token, etag).status_code == 404
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Вебхук-режим бота: WebhookFeeder + aiogram против fakes.telegram, без выхода в сеть."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+httpx = pytest.importorskip("httpx")
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import CommandStart
+from aiogram.types import Message
+from fastapi import FastAPI, Request
+
+from fakes.telegram import FakeTelegram, message_update
+from tg_webhook import SECRET_HEADER, WebhookFeeder
+
+SECRET = "s3cret"
+
+
+@pytest.fixture
+def tg():
+    fake = FakeTelegram()
+    port = fake.start()
+    fake.base = f"http://127.0.0.1:{port}"
+    yield fake
+    fake.stop()
+
+
+def _run(tg, body, **feeder_kw):
+    async def main():
+        bot = Bot("42:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(tg.base)))
+        dp = Dispatcher()
+
+        @dp.message(CommandStart())
+        async def start(m: Message):
+            await m.answer("hi")
+
+        feeder = WebhookFeeder(dp, bot, SECRET, **feeder_kw)
+        app = FastAPI()
+
+        @app.post("/tg/webhook")
+        async def hook(request: Request):
+            return await feeder.handle(request)
+
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api")
+        try:
+            return await body(bot, feeder, client)
+        finally:
+            await feeder.stop(drain=0)
+            await client.aclose()
+            await bot.session.close()
+    return asyncio.run(main())
+
+
+def test_update_is_handled_and_reply_reaches_api(tg):
+    async def body(bot, feeder, client):
+        await bot.set_webhook("http://api/tg/webhook", secret_token=SECRET)
+        assert tg.webhook_url == "http://api/tg/webhook"
+        feeder.start()
+        r = await client.post("/tg/webhook", json=message_update(1, 100, "/start"),
+                              headers={SECRET_HEADER: tg.webhook_secret})
+        assert r.status_code == 200
+        await asyncio.wait_for(feeder.queue.join(), 5)
+        return feeder.stats()
+
+    stats = _run(tg, body, workers=2)
+    assert stats["handled"] == 1 and stats["errors"] == 0
+    assert [(str(p["chat_id"]), p["text"]) for p in tg.sent()] == [("100", "hi")]
+
+
+def test_bad_secret_is_rejected(tg):
+    async def body(bot, feeder, client):
+        feeder.start()
+        r = await client.post("/tg/webhook", json=message_update(1, 100, "/start"), headers={SECRET_HEADER: "nope"})
+        assert r.status_code == 401
+        r = await client.post("/tg/webhook", content=b"{", headers={SECRET_HEADER: SECRET})
+        assert r.status_code == 400
+        return feeder.stats()
+
+    assert _run(tg, body)["rejected"] == 1
+    assert tg.sent() == []
+
+
+def test_full_queue_answers_503(tg):
+    async def body(bot, feeder, client):
+        # воркеры не запущены: первый апдейт занимает очередь, второй — 503, Telegram повторит
+        codes = [(await client.post("/tg/webhook", json=message_update(i, 100, "/start"),
+                                    headers={SECRET_HEADER: SECRET})).status_code for i in (1, 2)]
+        return codes, feeder.stats()
+
+    codes, stats = _run(tg, body, queue_size=1)
+    assert codes == [200, 503]
+    assert stats["dropped"] == 1 and stats["queued"] == 1
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""TrafficCollector: настоящий QueryStats к fakes.xray_api и SQLite в tmp_path."""
+import asyncio, contextlib, sqlite3
+
+import pytest
+
+pytest.importorskip("grpc")
+pytest.importorskip("aiosqlite")
+
+from db_pool import SqlitePool
+from fakes.xray_api import FakeXray
+from traffic import DAY, HOUR, TRAFFIC_SQL, USER_PREFIX, TrafficCollector
+from xray_api import XrayApi
+
+SUBS_SQL = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+  token      TEXT PRIMARY KEY,
+  user_id    INTEGER NOT NULL,
+  uuid       TEXT NOT NULL,
+  expires_at INTEGER NOT NULL
+);
+"""
+SUBS = [("tok-a", 1, "uuid-a", 2_000_000_000), ("tok-b", 2, "uuid-b", 2_000_000_000)]
+
+
+class FlakyPool:
+    """Пул, у которого следующие fail захватов писателя падают как занятая БД."""
+
+    def __init__(self, pool: SqlitePool):
+        self.pool = pool
+        self.fail = 0
+
+    def read(self):
+        return self.pool.read()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.pool.write() as db:
+            if self.fail:
+                self.fail -= 1
+                raise sqlite3.OperationalError("database is locked")
+            yield db
+
+
+@pytest.fixture
+def xray():
+    fx = FakeXray()
+    port = fx.start()
+    api = XrayApi(f"127.0.0.1:{port}")
+    yield fx, api
+    api.close(); fx.stop()
+
+
+def _run(tmp_path, body):
+    async def main():
+        pool = SqlitePool(str(tmp_path / "t.db"), readers=2)
+        await pool.open(SUBS_SQL + TRAFFIC_SQL)
+        async with pool.write() as db:
+            await db.executemany("INSERT INTO subscriptions(token,user_id,uuid,expires_at) VALUES(?,?,?,?)", SUBS)
+        try:
+            return await body(pool)
+        finally:
+            await pool.close()
+    return asyncio.run(main())
+
+
+async def _totals(pool):
+    async with pool.read() as db:
+        cur = await db.execute("SELECT uuid, up, down FROM traffic_totals ORDER BY uuid")
+        return [tuple(r) for r in await cur.fetchall()]
+
+
+def test_deltas_survive_failed_write(tmp_path, xray):
+    fx, api = xray
+
+    async def body(pool):
+        flaky = FlakyPool(pool)
+        tc = TrafficCollector(flaky, lambda: api.query_stats(USER_PREFIX, reset=True))
+        fx.add_traffic("uuid-a", up=100, down=1000)
+        flaky.fail = 1
+        with pytest.raises(sqlite3.OperationalError):
+            await tc.tick()
+        assert fx.counters["user>>>uuid-a>>>traffic>>>uplink"] == 0   # в Xray уже обнулено
+        assert await _totals(pool) == []
+        fx.add_traffic("uuid-a", up=1, down=10)
+        fx.add_traffic("uuid-b", up=5)
+        fx.add_traffic("manual@client", up=7)                       # не из subscriptions — не считаем
+        assert await tc.tick() == 3
+        assert await _totals(pool) == [("uuid-a", 101, 1010), ("uuid-b", 5, 0)]
+        assert tc.stats()["pending"] == 0
+
+    _run(tmp_path, body)
+
+
+def test_rollup_is_idempotent(tmp_path):
+    base = 1_700_000_000 - 1_700_000_000 % DAY
+
+    async def body(pool):
+        tc = TrafficCollector(pool, dict)
+        async with pool.write() as db:
+            await tc._write(db, {"uuid-a": [10, 1]}, base + 60)
+            await tc._write(db, {"uuid-a": [5, 2]}, base + 120)
+            await tc._write(db, {"uuid-a": [7, 3]}, base + HOUR + 60)
+            await tc._rollup(db, base + 2 * HOUR + 30)
+        first = await tc.series("uuid-a", HOUR)
+        assert first == [(base, 15, 3), (base + HOUR, 7, 3)]
+        # повторная свёртка тех же часов и свежий сборщик (курсор из БД) ничего не удваивают
+        tc._rolled = {HOUR: base}
+        async with pool.write() as db:
+            await tc._rollup(db, base + 2 * HOUR + 30)
+            await TrafficCollector(pool, dict)._rollup(db, base + 2 * HOUR + 40)
+        assert await tc.series("uuid-a", HOUR) == first
+        # день закрылся — дневная точка из часовых
+        async with pool.write() as db:
+            await tc._rollup(db, base + DAY + 5)
+        assert await tc.series("uuid-a", DAY) == [(base, 22, 6)]
+
+    _run(tmp_path, body)
+
+
+def test_over_quota(tmp_path, xray):
+    fx, api = xray
+    hits = []
+
+    async def over(rows):
+        hits.extend(rows)
+
+    async def body(pool):
+        tc = TrafficCollector(pool, lambda: api.query_stats(USER_PREFIX, reset=True), over, quota=1000)
+        fx.add_traffic("uuid-a", up=100, down=800)
+        fx.add_traffic("uuid-b", up=10)
+        await tc.tick()
+        assert hits == []
+        fx.add_traffic("uuid-a", down=100)
+        await tc.tick()
+        assert hits == [(2_000_000_000, "tok-a", "uuid-a")]
+        assert tc.quota_hits == 1
+
+    _run(tmp_path, body)
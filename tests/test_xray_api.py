@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Клиент HandlerService/StatsService (xray_api.py) против fakes.xray_api по настоящему gRPC."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("grpc")
+
+from fakes.xray_api import FakeXray
+from xray_api import XrayApi, XrayApiError
+from xray_ctl import XrayController
+
+TAG = "vless-reality"
+
+
+@pytest.fixture
+def xray():
+    fx = FakeXray()
+    port = fx.start()
+    api = XrayApi(f"127.0.0.1:{port}")
+    yield fx, api
+    api.close(); fx.stop()
+
+
+def test_add_remove_idempotent(xray):
+    fx, api = xray
+    api.add_user(TAG, "uuid-1", "uuid-1", flow="xtls-rprx-vision")
+    api.add_user(TAG, "uuid-1", "uuid-1")            # «already exists» — не ошибка
+    assert fx.users[TAG] == {"uuid-1": "uuid-1"}
+    api.remove_user(TAG, "uuid-1")
+    api.remove_user(TAG, "uuid-1")                   # «not found» — не ошибка
+    assert fx.users[TAG] == {}
+    assert fx.calls == 4
+
+
+def test_restart_is_visible_through_uptime(xray):
+    fx, api = xray
+    api.add_user(TAG, "uuid-1", "uuid-1")
+    fx.started -= 100
+    assert api.uptime() >= 100
+    fx.restart()
+    assert api.uptime() < 100 and fx.users == {}
+
+
+def test_unreachable_server_raises():
+    api = XrayApi("127.0.0.1:1", timeout=0.5)
+    try:
+        with pytest.raises(XrayApiError):
+            api.add_user(TAG, "uuid-1", "uuid-1")
+    finally:
+        api.close()
+
+
+def test_controller_batch_goes_through_api(xray):
+    fx, api = xray
+
+    def apply(adds, removes):
+        for u, c in adds.items():
+            api.add_user(TAG, u, c["email"], c.get("flow", ""))
+        for u in removes:
+            api.remove_user(TAG, u)
+
+    async def main():
+        ctl = XrayController(apply, window=0.05)
+        await asyncio.gather(ctl.add("a", {"id": "a", "email": "a"}), ctl.add("b", {"id": "b", "email": "b"}),
+                             ctl.remove("b"))
+        await ctl.stop()
+        return ctl.stats()
+
+    stats = asyncio.run(main())
+    assert fx.users[TAG] == {"a": "a"}
+    assert stats["batches"] == 1 and stats["applied"] == 2
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""XrayController: схлопывание пачки и ответ всем ждущим при stop()."""
+import asyncio, time
+
+import pytest
+
+from xray_ctl import XrayController
+
+
+def test_batch_collapses_per_uuid():
+    calls = []
+
+    async def main():
+        ctl = XrayController(lambda adds, removes: calls.append((adds, removes)), window=0.05)
+        await asyncio.gather(ctl.add("a", {"id": "a"}), ctl.add("b", {"id": "b"}), ctl.remove("b"))
+        await ctl.stop()
+        return ctl.stats()
+
+    stats = asyncio.run(main())
+    assert calls == [({"a": {"id": "a"}}, {"b"})]
+    assert stats["batches"] == 1 and stats["ops"] == 3 and stats["applied"] == 2
+
+
+def test_stop_fails_pending_futures():
+    async def main():
+        ctl = XrayController(lambda adds, removes: time.sleep(0.3), window=0.01)
+        applying = ctl.submit("add", "a", {})
+        await asyncio.sleep(0.1)                      # пачка с "a" уже в apply
+        queued = ctl.submit("add", "b", {})
+        await ctl.stop()
+        idle = XrayController(lambda adds, removes: None, window=5)
+        collecting = idle.submit("remove", "c")       # ждёт окно сбора
+        await asyncio.sleep(0.05)
+        await idle.stop()
+        for fut in (applying, queued, collecting):
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(fut, 1)
+
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""YooReconciler против fakes.yoomoney по HTTP (без библиотеки yoomoney)."""
+import asyncio, json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import pytest
+
+from fakes.yoomoney import FakeYooMoney
+from yoo_reconcile import YooReconciler
+
+
+class HttpClient:
+    """Подмножество yoomoney.Client: operation_history по настоящему HTTP к фейку."""
+
+    def __init__(self, base: str):
+        self.base = base
+
+    def operation_history(self, type=None, from_date=None, start_record=None, records=None):
+        form = {"type": type, "records": records, "start_record": start_record,
+                "from": from_date.strftime("%Y-%m-%dT%H:%M:%S") if from_date else None}
+        body = urlencode({k: v for k, v in form.items() if v is not None}).encode()
+        with urlopen(self.base + "operation-history", data=body, timeout=5) as r:
+            res = json.load(r)
+        ops = [SimpleNamespace(**{**o, "datetime": datetime.strptime(o["datetime"], "%Y-%m-%dT%H:%M:%SZ")})
+               for o in res["operations"]]
+        return SimpleNamespace(operations=ops, next_record=res.get("next_record"))
+
+
+@pytest.fixture
+def fake():
+    f = FakeYooMoney()
+    port = f.start()
+    f.base = f"http://127.0.0.1:{port}/api/"
+    yield f
+    f.stop()
+
+
+def _reconciler(fake, pending, paid, **kw):
+    async def get_pending():
+        return {k: v for k, v in pending.items() if k not in paid}
+
+    async def mark_paid(found):
+        for label, amount, op_id in found:
+            paid[label] = (amount, op_id)
+
+    return YooReconciler(lambda: HttpClient(fake.base), get_pending, mark_paid, **kw)
+
+
+def test_matches_pending_labels(fake):
+    created = int(datetime.utcnow().timestamp()) - 60
+    pending, paid = {"a": created, "b": created}, {}
+    fake.pay("a", 150)
+    fake.pay("other", 99)
+    fake.pay("b", 300, status="in_progress")
+    rec = _reconciler(fake, pending, paid)
+    assert asyncio.run(rec.tick()) == 1
+    assert paid == {"a": (150.0, "op1")}
+    fake.pay("b", 300)
+    assert asyncio.run(rec.tick()) == 1
+    assert paid["b"][0] == 300.0
+
+
+def test_old_deposit_behind_many_pages_is_found(fake):
+    # старое пополнение в самом хвосте выдачи (история — от новых к старым)
+    t0 = datetime.utcnow() - timedelta(hours=1)
+    fake.pay("old", 500, when=t0)
+    for k in range(45):
+        fake.pay(f"noise{k}", 1, when=t0 + timedelta(seconds=k + 1))
+    pending, paid = {"old": int((t0 - datetime(1970, 1, 1)).total_seconds()) - 60}, {}
+    rec = _reconciler(fake, pending, paid, page=2)
+    assert asyncio.run(rec.tick()) == 1
+    assert paid["old"] == (500.0, "op1")
+    assert rec.api_calls == 23
+    # курсор сдвинулся, следующий проход уже не листает всю историю
+    pending["new"] = int((datetime.utcnow() - datetime(1970, 1, 1)).total_seconds())
+    fake.pay("new", 70)
+    assert asyncio.run(rec.tick()) == 1
+    assert rec.api_calls == 24
+
+
+def test_no_pending_means_no_api_calls(fake):
+    fake.pay("a", 1)
+    rec = _reconciler(fake, {}, {})
+    assert asyncio.run(rec.tick()) == 0
+    assert fake.requests == 0
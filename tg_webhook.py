@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Приём обновлений Telegram через вебхук на том же FastAPI-приложении.
+
+Telegram шлёт POST с заголовком X-Telegram-Bot-Api-Secret-Token; сверяем
+его, кладём Update в ограниченную очередь и сразу отвечаем 200 — обработку
+ведут workers корутин через dp.feed_update. Если очередь полна, отвечаем
+503: Telegram повторит доставку позже, память не растёт без границ.
+"""
+import asyncio, contextlib, hmac, json, logging, time
+from typing import List
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import Request
+from fastapi.responses import Response
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+log = logging.getLogger("tg_webhook")
+
+
+class WebhookFeeder:
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, workers: int = 16, queue_size: int = 1000):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        # метрики
+        self.received = 0
+        self.handled = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0
+        self.handle_ms_max = 0.0
+        self.handle_ms_total = 0.0
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: float = 5.0):
+        # даём дообработать уже принятое (Telegram их повторно не пришлёт)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.queue.join(), drain)
+        for t in self._tasks:
+            t.cancel()
+        for t in self._tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await t
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            upd = await self.queue.get()
+            self.busy += 1
+            t0 = time.perf_counter()
+            try:
+                await self.dp.feed_update(self.bot, upd)
+                self.handled += 1
+            except Exception:
+                self.errors += 1
+                log.exception("update %s failed", upd.update_id)
+            finally:
+                ms = (time.perf_counter() - t0) * 1000
+                self.handle_ms_total += ms
+                self.handle_ms_max = max(self.handle_ms_max, ms)
+                self.busy -= 1
+                self.queue.task_done()
+
+    async def handle(self, request: Request) -> Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.rejected += 1
+            return Response(status_code=401)
+        try:
+            upd = Update.model_validate(json.loads(await request.body()), context={"bot": self.bot})
+        except ValueError:
+            return Response(status_code=400)
+        try:
+            self.queue.put_nowait(upd)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return Response(status_code=503)
+        self.received += 1
+        return Response(status_code=200)
+
+    def stats(self) -> dict:
+        done = self.handled + self.errors
+        return {"received": self.received, "handled": self.handled, "errors": self.errors,
+                "rejected": self.rejected, "dropped": self.dropped, "queued": self.queue.qsize(),
+                "busy": self.busy, "workers": len(self._tasks),
+                "handle_ms_avg": round(self.handle_ms_total / done, 2) if done else 0.0,
+                "handle_ms_max": round(self.handle_ms_max, 2)}
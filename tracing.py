@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Лёгкая трассировка: корневой span на апдейт бота / HTTP-запрос, дочерние —
+SQLite, Xray, платёжки, Bot API. Без внешних зависимостей.
+
+Текущий span живёт в contextvar, поэтому дочерние span'ы находят родителя
+сами — и в корутинах, и в asyncio.to_thread (контекст копируется). Вне
+трассы span()/record() — почти бесплатный no-op.
+
+Решение о записи принимается в конце корневого span'а: трасса пишется,
+если попала в выборку (sample), была медленнее slow_ms или закончилась
+ошибкой. Одна строка JSONL = одна трасса в форме OTLP/JSON
+(ExportTraceServiceRequest: resourceSpans -> scopeSpans -> spans), её читает
+otlpjsonfile-ресивер OpenTelemetry Collector. Файл ротируется по размеру;
+несколько процессов могут писать в один файл (O_APPEND, одна запись на трассу).
+"""
+import contextvars, json, os, random, threading, time
+from typing import Dict, List, Optional, Sequence
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+MAX_SPANS = 1000                      # на трассу: длинные циклы не раздувают память
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def _attr(k: str, v) -> dict:
+    if isinstance(v, bool):
+        val = {"boolValue": v}
+    elif isinstance(v, int):
+        val = {"intValue": str(v)}
+    elif isinstance(v, float):
+        val = {"doubleValue": v}
+    else:
+        val = {"stringValue": str(v)}
+    return {"key": k, "value": val}
+
+
+class _Trace:
+    __slots__ = ("trace_id", "sampled", "spans", "error", "done")
+
+    def __init__(self, sampled: bool):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+        self.error = False
+        self.done = False
+
+
+class Span:
+    __slots__ = ("tracer", "trace", "name", "kind", "attrs", "span_id", "parent_id", "start", "end", "error",
+                 "is_root", "_token")
+
+    def __init__(self, tracer: "Tracer", trace: _Trace, name: str, parent: Optional["Span"], kind: int, attrs: dict,
+                 is_root: bool = False):
+        self.tracer = tracer
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.attrs = attrs
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else ""
+        self.start = self.end = 0
+        self.error = ""
+        self.is_root = is_root
+        self._token = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, et, e, tb):
+        self.end = time.time_ns()
+        _current.reset(self._token)
+        if et is not None:
+            self.error = f"{et.__name__}: {e}"
+        self._close()
+        return False
+
+    def _close(self):
+        tr = self.trace
+        if self.error:
+            tr.error = True
+        if not tr.done and len(tr.spans) < MAX_SPANS:
+            tr.spans.append(self)
+        if self.is_root:
+            self.tracer._finish(tr, self)
+
+    def otlp(self) -> dict:
+        d = {"traceId": self.trace.trace_id, "spanId": self.span_id, "name": self.name, "kind": self.kind,
+             "startTimeUnixNano": str(self.start), "endTimeUnixNano": str(self.end),
+             "attributes": [_attr(k, v) for k, v in self.attrs.items() if v is not None]}
+        if self.parent_id:
+            d["parentSpanId"] = self.parent_id
+        if self.error:
+            d["status"] = {"code": 2, "message": self.error}
+        return d
+
+
+class _Noop:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NOOP = _Noop()
+
+
+class Tracer:
+    def __init__(self, path: str = "", sample: float = 0.01, slow_ms: float = 1000.0,
+                 max_bytes: int = 50 * 1024 * 1024, backups: int = 5, resource: Optional[Dict[str, object]] = None):
+        self.path = path                      # пусто — трассировка выключена
+        self.sample = sample
+        self.slow_ms = slow_ms
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.resource: Dict[str, object] = dict(resource or {})
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+        # метрики
+        self.traces = 0
+        self.written = 0
+        self.write_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def root(self, name: str, kind: int = SPAN_KIND_SERVER, **attrs):
+        """Корневой span; внутри уже открытой трассы — обычный дочерний."""
+        if not self.path:
+            return NOOP
+        parent = _current.get()
+        if parent is not None and not parent.trace.done:
+            return Span(self, parent.trace, name, parent, kind, attrs)
+        self.traces += 1
+        return Span(self, _Trace(random.random() < self.sample), name, None, kind, attrs, is_root=True)
+
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attrs):
+        parent = _current.get()
+        if parent is None or parent.trace.done:
+            return NOOP
+        return Span(self, parent.trace, name, parent, kind, attrs)
+
+    def record(self, name: str, secs: float, kind: int = SPAN_KIND_INTERNAL, error: str = "", **attrs):
+        """Уже завершившийся span длиной secs, заканчивающийся сейчас (для хуков observe)."""
+        parent = _current.get()
+        if parent is None or parent.trace.done:
+            return
+        sp = Span(self, parent.trace, name, parent, kind, attrs)
+        sp.end = time.time_ns()
+        sp.start = sp.end - int(secs * 1e9)
+        sp.error = error
+        sp._close()
+
+    @staticmethod
+    def current() -> Optional[Span]:
+        return _current.get()
+
+    # --- запись ---
+    def _finish(self, tr: _Trace, root: Span):
+        tr.done = True
+        if not (tr.sampled or tr.error or (root.end - root.start) / 1e6 >= self.slow_ms):
+            return
+        doc = {"resourceSpans": [{
+            "resource": {"attributes": [_attr(k, v) for k, v in self.resource.items()] + [_attr("process.pid", os.getpid())]},
+            "scopeSpans": [{"scope": {"name": "rel"}, "spans": [s.otlp() for s in tr.spans]}],
+        }]}
+        line = (json.dumps(doc, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+        try:
+            self._write(line)
+            self.written += 1
+        except OSError:
+            self.write_errors += 1
+
+    def _open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _write(self, line: bytes):
+        with self._lock:
+            if self._fd is not None:
+                try:
+                    st = os.stat(self.path)
+                except FileNotFoundError:
+                    st = None
+                if st is None or st.st_ino != os.fstat(self._fd).st_ino:
+                    os.close(self._fd); self._fd = None       # файл ротировал другой процесс
+                elif st.st_size >= self.max_bytes:
+                    if self.backups > 0:
+                        self._rotate()
+                    else:
+                        os.truncate(self.path, 0)
+                    os.close(self._fd); self._fd = None
+            if self._fd is None:
+                self._open()
+            os.write(self._fd, line)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd); self._fd = None
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "sample": self.sample, "slow_ms": self.slow_ms,
+                "traces": self.traces, "written": self.written, "write_errors": self.write_errors}
+
+
+class TraceAsgi:
+    """ASGI-обёртка: корневой span на HTTP-запрос. В имени — маршрут (первый сегмент), не путь:
+    в пути лежат токены подписок."""
+
+    def __init__(self, app, tracer: Tracer, routes: Sequence[str]):
+        self.app = app
+        self.tracer = tracer
+        self.routes = frozenset(routes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            return await self.app(scope, receive, send)
+        seg = "/" + scope["path"].split("/", 2)[1]
+        route = seg if seg in self.routes else "other"
+        with self.tracer.root(f"{scope['method']} {route}", **{"http.method": scope["method"], "http.route": route}) as sp:
+            async def send_wrapped(msg):
+                if msg["type"] == "http.response.start":
+                    sp.set(**{"http.status_code": msg["status"]})
+                    if msg["status"] >= 500:
+                        sp.error = f"HTTP {msg['status']}"
+                await send(msg)
+            await self.app(scope, receive, send_wrapped)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Учёт трафика по пользователям из StatsService Xray.
+
+Раз в interval секунд лидер делает один QueryStats("user>>>", reset=true) —
+Xray отдаёт счётчики uplink/downlink всех клиентов за прошедший интервал и
+обнуляет их. Email клиента совпадает с uuid из subscriptions (см.
+_xray_client в main.py), по нему дельты и раскладываются:
+
+  traffic_totals — накопленные up/down на uuid (из них /sub отдаёт
+                   заголовок subscription-userinfo, по ним же квота);
+  traffic_series — (res, bucket, id, up, down): минутные точки пишет сборщик,
+                   часовые и дневные сворачиваются из них после закрытия
+                   периода. Ключ — целые числа (id строки traffic_totals вместо
+                   uuid), таблица WITHOUT ROWID; у каждого разрешения свой срок
+                   хранения.
+
+Если запись в БД не удалась, уже обнулённые в Xray дельты остаются в памяти
+и прибавляются к следующему проходу. Подписки, выбравшие квоту, уходят в
+over_quota(rows) — в main.py это тот же expire_batch, что снимает истёкшие.
+
+В конфиге Xray кроме API (см. xray_api.py) нужны статистика и политика:
+    "stats": {},
+    "policy": {"levels": {"0": {"statsUserUplink": true, "statsUserDownlink": true}}}
+"""
+import asyncio, time
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+TRAFFIC_SQL = """
+CREATE TABLE IF NOT EXISTS traffic_totals (
+  id         INTEGER PRIMARY KEY,
+  uuid       TEXT NOT NULL UNIQUE,
+  up         INTEGER NOT NULL DEFAULT 0,
+  down       INTEGER NOT NULL DEFAULT 0,
+  updated_at INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_traffic_used ON traffic_totals(up+down);
+CREATE TABLE IF NOT EXISTS traffic_series (
+  res    INTEGER NOT NULL,
+  bucket INTEGER NOT NULL,
+  id     INTEGER NOT NULL,
+  up     INTEGER NOT NULL,
+  down   INTEGER NOT NULL,
+  PRIMARY KEY (res, bucket, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_sub_uuid ON subscriptions(uuid);
+"""
+
+MINUTE, HOUR, DAY = 60, 3600, 86400
+USER_PREFIX = "user>>>"
+
+Row = Tuple[int, str, str]   # (expires_at, token, uuid), как в expiry.py
+
+
+def parse_user_stats(stats: Dict[str, int]) -> Dict[str, List[int]]:
+    """{"user>>>EMAIL>>>traffic>>>uplink": n, ...} -> {EMAIL: [up, down]}."""
+    out: Dict[str, List[int]] = {}
+    for name, value in stats.items():
+        parts = name.split(">>>")
+        if len(parts) != 4 or parts[0] != "user" or parts[2] != "traffic" or not value:
+            continue
+        if parts[3] == "uplink":
+            out.setdefault(parts[1], [0, 0])[0] += value
+        elif parts[3] == "downlink":
+            out.setdefault(parts[1], [0, 0])[1] += value
+    return out
+
+
+def userinfo(up: int, down: int, total: int, expire: int) -> str:
+    """Значение заголовка subscription-userinfo (total=0 — без лимита)."""
+    return f"upload={int(up)}; download={int(down)}; total={int(total)}; expire={int(expire)}"
+
+
+class TrafficCollector:
+    def __init__(self, pool, query: Callable[[], Dict[str, int]],
+                 over_quota: Optional[Callable[[List[Row]], Awaitable[None]]] = None,
+                 interval: float = 60.0, quota: int = 0,
+                 keep: Sequence[int] = (2 * DAY, 90 * DAY, 730 * DAY)):
+        self.pool = pool
+        self.query = query              # query() -> сырые счётчики Xray с обнулением (синхронно, в потоке)
+        self.over_quota = over_quota
+        self.interval = interval
+        self.quota = quota              # байт на подписку (up+down); 0 — без квоты
+        self.keep = dict(zip((MINUTE, HOUR, DAY), keep))
+        self._pending: Dict[str, List[int]] = {}
+        self._rolled: Dict[int, int] = {}   # res -> начало первого ещё не свёрнутого периода
+        self._pruned = 0.0
+        # метрики
+        self.ticks = 0
+        self.users = 0
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.quota_hits = 0
+        self.errors = 0
+        self.last_error = ""
+        self.last_tick_ms = 0.0
+
+    def _merge(self, deltas: Dict[str, List[int]]):
+        for email, (up, down) in deltas.items():
+            acc = self._pending.setdefault(email, [0, 0])
+            acc[0] += up; acc[1] += down
+
+    async def _write(self, db, deltas: Dict[str, List[int]], now: int):
+        bucket = now - now % MINUTE
+        # строки только для uuid из subscriptions: чужие email в Xray (ручные клиенты) не считаем
+        await db.executemany(
+            "INSERT INTO traffic_totals(uuid,up,down,updated_at) SELECT uuid,?,?,? FROM subscriptions WHERE uuid=? LIMIT 1 "
+            "ON CONFLICT(uuid) DO UPDATE SET up=up+excluded.up, down=down+excluded.down, updated_at=excluded.updated_at",
+            [(up, down, now, email) for email, (up, down) in deltas.items()])
+        await db.executemany(
+            "INSERT INTO traffic_series(res,bucket,id,up,down) SELECT ?,?,id,?,? FROM traffic_totals WHERE uuid=? AND updated_at=? "
+            "ON CONFLICT(res,bucket,id) DO UPDATE SET up=up+excluded.up, down=down+excluded.down",
+            [(MINUTE, bucket, up, down, email, now) for email, (up, down) in deltas.items()])
+
+    async def _rollup(self, db, now: int):
+        """Закрытые часы — из минут, закрытые дни — из часов; повторная свёртка периода идемпотентна."""
+        for res, src in ((HOUR, MINUTE), (DAY, HOUR)):
+            open_from = now - now % res
+            start = self._rolled.get(res)
+            if start is None:
+                cur = await db.execute("SELECT MAX(bucket) FROM traffic_series WHERE res=?", (res,))
+                last = (await cur.fetchone())[0]
+                if last is None:
+                    cur = await db.execute("SELECT MIN(bucket) FROM traffic_series WHERE res=?", (src,))
+                    first = (await cur.fetchone())[0]
+                    start = open_from if first is None else first - first % res
+                else:
+                    start = last + res
+            if start < open_from:
+                await db.execute(
+                    "INSERT OR REPLACE INTO traffic_series(res,bucket,id,up,down) "
+                    "SELECT ?, bucket - bucket % ?, id, SUM(up), SUM(down) FROM traffic_series "
+                    "WHERE res=? AND bucket>=? AND bucket<? GROUP BY bucket - bucket % ?, id",
+                    (res, res, src, start, open_from, res))
+            self._rolled[res] = open_from
+
+    async def _prune(self, db, now: int):
+        for res, keep in self.keep.items():
+            await db.execute("DELETE FROM traffic_series WHERE res=? AND bucket<?", (res, now - keep))
+        # итоги давно снятых подписок: их дневные точки к этому времени тоже удалены
+        await db.execute("DELETE FROM traffic_totals WHERE updated_at<? AND uuid NOT IN (SELECT uuid FROM subscriptions)",
+                         (now - self.keep[DAY],))
+
+    async def _over_quota(self) -> List[Row]:
+        async with self.pool.read() as db:
+            cur = await db.execute(
+                "SELECT s.expires_at, s.token, s.uuid FROM traffic_totals t JOIN subscriptions s ON s.uuid=t.uuid "
+                "WHERE t.up+t.down>=?", (self.quota,))
+            return [tuple(r) for r in await cur.fetchall()]
+
+    async def tick(self) -> int:
+        t0 = time.perf_counter()
+        raw = await asyncio.to_thread(self.query)      # счётчики в Xray уже обнулены
+        self._merge(parse_user_stats(raw))
+        deltas, self._pending = self._pending, {}
+        now = int(time.time())
+        try:
+            async with self.pool.write() as db:
+                if deltas:
+                    await self._write(db, deltas, now)
+                await self._rollup(db, now)
+                if now - self._pruned > HOUR:
+                    await self._prune(db, now)
+                    self._pruned = now
+        except BaseException:
+            self._merge(deltas)                        # не потерять: прибавим на следующем проходе
+            self._rolled = {}                          # курсоры свёртки — заново из БД
+            raise
+        self.ticks += 1
+        self.users = len(deltas)
+        self.bytes_up += sum(d[0] for d in deltas.values())
+        self.bytes_down += sum(d[1] for d in deltas.values())
+        if deltas and self.quota and self.over_quota is not None:
+            rows = await self._over_quota()
+            if rows:
+                await self.over_quota(rows)
+                self.quota_hits += len(rows)
+        self.last_tick_ms = (time.perf_counter() - t0) * 1000
+        return len(deltas)
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                self.errors += 1; self.last_error = repr(e)
+            await asyncio.sleep(self.interval)
+
+    async def series(self, uuid: str, res: int = HOUR, since: int = 0) -> List[Tuple[int, int, int]]:
+        """[(bucket, up, down)] одной подписки на разрешении res (60/3600/86400)."""
+        async with self.pool.read() as db:
+            cur = await db.execute(
+                "SELECT s.bucket, s.up, s.down FROM traffic_series s JOIN traffic_totals t ON t.id=s.id "
+                "WHERE s.res=? AND s.bucket>=? AND t.uuid=? ORDER BY s.bucket", (res, since, uuid))
+            return [tuple(r) for r in await cur.fetchall()]
+
+    def stats(self) -> dict:
+        return {"ticks": self.ticks, "users_last": self.users, "pending": len(self._pending),
+                "bytes_up": self.bytes_up, "bytes_down": self.bytes_down, "quota": self.quota,
+                "quota_hits": self.quota_hits, "errors": self.errors, "last_error": self.last_error,
+                "last_tick_ms": round(self.last_tick_ms, 3)}
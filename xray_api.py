@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Клиент gRPC API Xray (HandlerService, StatsService) без сгенерированных stub'ов.
+
+Нужные сообщения кодируются вручную — их всего несколько, и это избавляет
+от зависимости на protobuf-описания Xray. grpcio импортируется лениво:
+файловый backend в main.py работает и без него.
+
+В конфиге Xray должен быть включён API, например:
+    "api": {"tag": "api", "services": ["HandlerService", "StatsService"]},
+    + inbound dokodemo-door на 127.0.0.1:10085 с tag "api" и routing на outboundTag "api".
+"""
+from typing import Dict, Iterator, List, Optional, Tuple
+
+HANDLER_SERVICE = "xray.app.proxyman.command.HandlerService"
+T_ADD_USER      = "xray.app.proxyman.command.AddUserOperation"
+T_REMOVE_USER   = "xray.app.proxyman.command.RemoveUserOperation"
+T_VLESS_ACCOUNT = "xray.proxy.vless.Account"
+STATS_SERVICE   = "xray.app.stats.command.StatsService"
+
+
+# ---------- protobuf wire format (минимум) ----------
+def _varint(n: int) -> bytes:
+    n &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        b = n & 0x7F; n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b); return bytes(out)
+
+def pb_bytes(field: int, value) -> bytes:
+    if isinstance(value, str):
+        value = value.encode()
+    if not value:
+        return b""                      # proto3: пустые значения не пишем
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+def pb_uint(field: int, value: int) -> bytes:
+    return _varint(field << 3) + _varint(value) if value else b""
+
+def pb_fields(buf: bytes) -> Iterator[Tuple[int, int, object]]:
+    """Итерирует (номер поля, wire type, значение) для varint и length-delimited полей."""
+    i, n = 0, len(buf)
+    while i < n:
+        key, i = _read_varint(buf, i)
+        field, wt = key >> 3, key & 7
+        if wt == 0:
+            v, i = _read_varint(buf, i)
+        elif wt == 2:
+            ln, i = _read_varint(buf, i)
+            v = buf[i:i + ln]; i += ln
+        elif wt == 1:
+            v = buf[i:i + 8]; i += 8
+        elif wt == 5:
+            v = buf[i:i + 4]; i += 4
+        else:
+            raise ValueError(f"unsupported wire type {wt}")
+        yield field, wt, v
+
+def _read_varint(buf: bytes, i: int) -> Tuple[int, int]:
+    shift = res = 0
+    while True:
+        b = buf[i]; i += 1
+        res |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return res, i
+        shift += 7
+
+def typed_message(type_name: str, value: bytes) -> bytes:
+    # xray.common.serial.TypedMessage { string type = 1; bytes value = 2; }
+    return pb_bytes(1, type_name) + pb_bytes(2, value)
+
+def vless_user(uuid: str, email: str, flow: str = "", level: int = 0) -> bytes:
+    # xray.proxy.vless.Account { string id = 1; string flow = 2; string encryption = 3; }
+    account = pb_bytes(1, uuid) + pb_bytes(2, flow) + pb_bytes(3, "none")
+    # xray.common.protocol.User { uint32 level = 1; string email = 2; TypedMessage account = 3; }
+    return pb_uint(1, level) + pb_bytes(2, email) + pb_bytes(3, typed_message(T_VLESS_ACCOUNT, account))
+
+def query_stats_request(pattern: str, reset: bool) -> bytes:
+    # QueryStatsRequest { string pattern = 1; bool reset = 2; }
+    return pb_bytes(1, pattern) + pb_uint(2, int(reset))
+
+def parse_stats(buf: bytes) -> Dict[str, int]:
+    # QueryStatsResponse { repeated Stat stat = 1; }  Stat { string name = 1; int64 value = 2; }
+    out: Dict[str, int] = {}
+    for f, _, v in pb_fields(buf):
+        if f != 1:
+            continue
+        name, value = "", 0
+        for sf, _, sv in pb_fields(v):
+            if sf == 1:
+                name = sv.decode()
+            elif sf == 2:
+                value = sv
+        if name:
+            out[name] = value
+    return out
+
+def alter_inbound_request(tag: str, op_type: str, op: bytes) -> bytes:
+    # AlterInboundRequest { string tag = 1; TypedMessage operation = 2; }
+    return pb_bytes(1, tag) + pb_bytes(2, typed_message(op_type, op))
+
+
+# ---------- клиент ----------
+class XrayApiError(RuntimeError):
+    pass
+
+
+class XrayApi:
+    """Синхронный клиент (вызывается из потока XrayController)."""
+
+    def __init__(self, addr: str, timeout: float = 5.0):
+        import grpc  # опциональная зависимость: нужна только для XRAY_BACKEND=api
+        self._grpc = grpc
+        self.addr = addr
+        self.timeout = timeout
+        self._channel = grpc.insecure_channel(addr)
+        self._alter = self._channel.unary_unary(f"/{HANDLER_SERVICE}/AlterInbound")
+        self._query = self._channel.unary_unary(f"/{STATS_SERVICE}/QueryStats")
+        self._sys = self._channel.unary_unary(f"/{STATS_SERVICE}/GetSysStats")
+
+    def close(self):
+        self._channel.close()
+
+    def _call(self, method, req: bytes, ok_if: Tuple[str, ...] = ()) -> bytes:
+        try:
+            return method(req, timeout=self.timeout)
+        except self._grpc.RpcError as e:
+            msg = (e.details() if hasattr(e, "details") else "") or str(e)
+            if any(s in msg.lower() for s in ok_if):
+                return b""
+            raise XrayApiError(f"{self.addr}: {msg}") from e
+
+    def add_user(self, tag: str, uuid: str, email: str, flow: str = "", level: int = 0):
+        # AddUserOperation { User user = 1; }
+        req = alter_inbound_request(tag, T_ADD_USER, pb_bytes(1, vless_user(uuid, email, flow, level)))
+        self._call(self._alter, req, ok_if=("already exists",))
+
+    def remove_user(self, tag: str, email: str):
+        # RemoveUserOperation { string email = 1; }
+        req = alter_inbound_request(tag, T_REMOVE_USER, pb_bytes(1, email))
+        self._call(self._alter, req, ok_if=("not found",))
+
+    def query_stats(self, pattern: str = "", reset: bool = False) -> Dict[str, int]:
+        """{имя счётчика: значение} для счётчиков, чьё имя содержит pattern; reset — обнулить их."""
+        return parse_stats(self._call(self._query, query_stats_request(pattern, reset)))
+
+    def uptime(self) -> int:
+        """Секунды с запуска Xray (GetSysStats); заодно проверка, что API отвечает."""
+        # SysStatsResponse { ... uint32 Uptime = 10; }
+        return next((v for f, _, v in pb_fields(self._call(self._sys, b"")) if f == 10), 0)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Единственный писатель конфигурации Xray.
+
+Все добавления/удаления клиентов идут через очередь XrayController:
+фоновая задача собирает мутации за короткое окно (window), схлопывает их
+(для одного uuid побеждает последняя операция) и применяет одной пачкой
+через apply(adds, removes) в отдельном потоке — одна запись конфига и один
+reload на пачку. Вызывающий ждёт future своей мутации.
+"""
+import asyncio, contextlib, time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+# apply(adds: {uuid: client_dict}, removes: {uuid}) -> None; выполняется в потоке
+ApplyFn = Callable[[Dict[str, dict], Set[str]], None]
+
+
+class XrayController:
+    def __init__(self, apply: ApplyFn, window: float = 0.2, max_batch: int = 5000):
+        self.apply = apply
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: List[Tuple[str, str, Optional[dict], asyncio.Future]] = []
+        self.batches = 0       # применённых пачек
+        self.ops = 0           # принятых мутаций
+        self.applied = 0       # мутаций после схлопывания
+        self.errors = 0
+        self.last_apply_ms = 0.0
+
+    # ---------- жизненный цикл ----------
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._task = asyncio.create_task(self._run(), name="xray-controller")
+
+    async def stop(self):
+        """Остановить воркер; ждущие submit() (в очереди и в прерванной пачке) получают RuntimeError."""
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        pending, self._inflight = self._inflight, []
+        while self._queue is not None and not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for *_, fut in pending:
+            if not fut.done(): fut.set_exception(RuntimeError("XrayController остановлен"))
+
+    # ---------- API ----------
+    def submit(self, op: str, uuid: str, client: Optional[dict] = None) -> asyncio.Future:
+        """Поставить мутацию в очередь, не дожидаясь применения."""
+        if op not in ("add", "remove"):
+            raise ValueError(op)
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((op, uuid, client, fut))
+        self.ops += 1
+        return fut
+
+    async def add(self, uuid: str, client: dict):
+        await self.submit("add", uuid, client)
+
+    async def remove(self, uuid: str):
+        await self.submit("remove", uuid)
+
+    async def remove_many(self, uuids: Iterable[str]):
+        futs = [self.submit("remove", u) for u in uuids]
+        if futs:
+            await asyncio.gather(*futs)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize() if self._queue else 0, "ops": self.ops,
+                "applied": self.applied, "batches": self.batches, "errors": self.errors,
+                "last_apply_ms": round(self.last_apply_ms, 3)}
+
+    # ---------- фоновая задача ----------
+    async def _collect(self) -> List[Tuple[str, str, Optional[dict], asyncio.Future]]:
+        # собираемое сразу в _inflight: при stop() посреди окна эти мутации тоже получат ответ
+        batch = self._inflight = [await self._queue.get()]
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            last: Dict[str, Tuple[str, Optional[dict]]] = {}
+            for op, uuid, client, _ in batch:
+                last.pop(uuid, None)          # порядок: последняя операция по uuid
+                last[uuid] = (op, client)
+            adds = {u: c for u, (op, c) in last.items() if op == "add"}
+            removes = {u for u, (op, _) in last.items() if op == "remove"}
+            t0 = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.apply, adds, removes)
+            except Exception as e:
+                self.errors += 1
+                for *_, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+            else:
+                for *_, fut in batch:
+                    if not fut.done(): fut.set_result(None)
+            finally:
+                self.last_apply_ms = (time.perf_counter() - t0) * 1000
+                self.batches += 1
+                self.applied += len(last)
+            self._inflight = []       # при отмене посреди apply остаётся для stop()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Межпроцессная очередь мутаций Xray (таблица xray_jobs).
+
+Конфиг Xray пишет только воркер-лидер. Процессы api/bot не трогают его сами:
+JobQueue кладёт строку в xray_jobs, JobRunner в лидере забирает
+невыполненные задания пачкой, отдаёт их в XrayController (там они
+схлопываются в одну запись конфига) и только после успешного применения
+помечает done_at. Для add с token/expires_at лидер ещё и ставит таймер
+истечения — его heap живёт только в лидере.
+"""
+import asyncio, json, time
+from typing import Callable, Iterable, Optional
+
+XRAY_JOBS_SQL = """
+CREATE TABLE IF NOT EXISTS xray_jobs (
+  id         INTEGER PRIMARY KEY AUTOINCREMENT,
+  op         TEXT NOT NULL,
+  uuid       TEXT NOT NULL,
+  client     TEXT,
+  token      TEXT,
+  expires_at INTEGER,
+  created_at REAL NOT NULL,
+  done_at    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_xray_jobs_todo ON xray_jobs(id) WHERE done_at IS NULL;
+"""
+
+
+class JobQueue:
+    """Сторона производителя (процессы api/bot)."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.enqueued = 0
+
+    async def add(self, uuid: str, client: dict, token: Optional[str] = None, expires_at: Optional[int] = None):
+        async with self.pool.write() as db:
+            await db.execute(
+                "INSERT INTO xray_jobs(op,uuid,client,token,expires_at,created_at) VALUES('add',?,?,?,?,?)",
+                (uuid, json.dumps(client), token, expires_at, time.time()))
+        self.enqueued += 1
+
+    async def remove_many(self, uuids: Iterable[str]):
+        now = time.time()
+        rows = [(u, now) for u in uuids]
+        if rows:
+            async with self.pool.write() as db:
+                await db.executemany("INSERT INTO xray_jobs(op,uuid,created_at) VALUES('remove',?,?)", rows)
+            self.enqueued += len(rows)
+
+    def stats(self) -> dict:
+        return {"enqueued": self.enqueued}
+
+
+class JobRunner:
+    """Сторона лидера: xray_jobs -> XrayController."""
+
+    def __init__(self, pool, xray, schedule: Callable[[str, str, int], None], interval: float = 0.5,
+                 batch: int = 1000, keep: int = 86400):
+        self.pool = pool
+        self.xray = xray
+        self.schedule = schedule        # schedule(token, uuid, expires_at) — таймер истечения
+        self.interval = interval
+        self.batch = batch
+        self.keep = keep                # сколько хранить выполненные задания
+        self._pruned = 0.0
+        # метрики
+        self.applied = 0
+        self.errors = 0
+        self.last_error = ""
+        self.lag_max_s = 0.0
+
+    async def _pass(self) -> int:
+        async with self.pool.read() as db:
+            cur = await db.execute(
+                "SELECT id, op, uuid, client, token, expires_at, created_at FROM xray_jobs "
+                "WHERE done_at IS NULL ORDER BY id LIMIT ?", (self.batch,))
+            rows = await cur.fetchall()
+        if not rows:
+            return 0
+        futs = [self.xray.submit(op, uuid, json.loads(client) if client else None)
+                for _, op, uuid, client, _, _, _ in rows]
+        await asyncio.gather(*futs)
+        now = time.time()
+        for _, op, uuid, _, token, exp, created in rows:
+            if op == "add" and token and exp:
+                self.schedule(token, uuid, int(exp))
+            self.lag_max_s = max(self.lag_max_s, now - created)
+        async with self.pool.write() as db:
+            await db.executemany("UPDATE xray_jobs SET done_at=? WHERE id=?", [(now, r[0]) for r in rows])
+            if now - self._pruned > 3600:
+                await db.execute("DELETE FROM xray_jobs WHERE done_at IS NOT NULL AND done_at<?", (now - self.keep,))
+                self._pruned = now
+        self.applied += len(rows)
+        return len(rows)
+
+    async def run(self):
+        while True:
+            try:
+                n = await self._pass()
+            except Exception as e:
+                self.errors += 1; self.last_error = repr(e); n = 0
+            if n < self.batch:
+                await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"applied": self.applied, "errors": self.errors, "last_error": self.last_error,
+                "lag_max_s": round(self.lag_max_s, 3)}
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Шардированное хранение клиентов Reality по фрагментам confdir Xray.
+
+Вместо одного inbound'а с сотней тысяч клиентов в config.json держим N
+inbound'ов в отдельных файлах XRAY_CONFDIR/reality_shard_NNN.json:
+одинаковые streamSettings/realitySettings, порт = порт исходного inbound'а + i,
+tag шарда 0 — исходный, остальных — "<tag>-NNN". Порты, уже занятые другими
+inbound'ами (config.json и прочие файлы confdir), не берём — миграция/добавление
+шардов падает с ошибкой. Xray должен запускаться с `-confdir XRAY_CONFDIR`.
+
+В памяти — индекс uuid -> шард; мутация переписывает (компактным JSON)
+только те шарды, которые она затронула. Переход с одного файла:
+
+    python xray_shards.py migrate --shards 8
+
+Существующие клиенты уезжают в шард 0 с прежним портом — выданные ссылки
+не меняются; новые клиенты распределяются в наименее заполненный шард.
+"""
+import os, json, copy, contextlib, tempfile, threading
+from typing import Dict, List, Optional, Set, Tuple
+
+SHARD_FMT = "reality_shard_{:03d}.json"
+
+
+def _stamp(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _atomic_write(path: str, data: dict, indent: Optional[int] = None):
+    d = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".shard_", suffix=".json", dir=d)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            if indent is None:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            else:
+                json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError): os.unlink(tmp)
+        raise
+
+
+def _is_reality(ib: dict) -> bool:
+    ss = ib.get("streamSettings", {}) or {}
+    return ss.get("security") == "reality" or bool(ss.get("realitySettings"))
+
+
+def _inbound_ports(inbounds: List[dict]) -> Set[int]:
+    ports = set()
+    for ib in inbounds:
+        with contextlib.suppress(TypeError, ValueError):
+            ports.add(int(ib.get("port")))
+    return ports
+
+
+def _taken_ports(confdir: str, config_path: Optional[str] = None) -> Set[int]:
+    """Порты inbound'ов вне шардов: config.json и остальные *.json в confdir."""
+    paths = [config_path] if config_path else []
+    with contextlib.suppress(FileNotFoundError):
+        paths += [os.path.join(confdir, n) for n in sorted(os.listdir(confdir))
+                  if n.endswith(".json") and not n.startswith(("reality_shard_", "."))]
+    ports: Set[int] = set()
+    for p in paths:
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                ports |= _inbound_ports(json.load(f).get("inbounds", []) or [])
+        except (OSError, ValueError, AttributeError):
+            continue
+    return ports
+
+
+def _check_ports(ports: List[int], taken: Set[int]):
+    busy = sorted(set(ports) & taken)
+    if busy:
+        raise RuntimeError(f"порты шардов уже заняты другими inbound'ами: {busy} — уменьшите --shards или смените порт")
+
+
+class ShardStore:
+    def __init__(self, confdir: str, shards: int, config: Optional[str] = None):
+        self.confdir = confdir
+        self.config = config                                  # основной config.json — для проверки портов
+        self.n = int(shards)
+        self.docs: List[Optional[dict]] = [None] * self.n   # {"inbounds":[inbound]} по шардам
+        self.stamps: List[Optional[tuple]] = [None] * self.n
+        self.index: Dict[str, int] = {}                       # uuid -> номер шарда
+        self.counts: List[int] = [0] * self.n
+        self.lock = threading.Lock()
+
+    def path(self, i: int) -> str:
+        return os.path.join(self.confdir, SHARD_FMT.format(i))
+
+    def inbound(self, i: int) -> dict:
+        return self.docs[i]["inbounds"][0]
+
+    # ---------- загрузка / индекс ----------
+    def _load_shard(self, i: int):
+        with open(self.path(i), "r", encoding="utf-8") as f:
+            st = os.fstat(f.fileno())
+            doc = json.load(f)
+        old = self.docs[i]
+        if old is not None:
+            for c in old["inbounds"][0].get("settings", {}).get("clients", []):
+                if self.index.get(c.get("id")) == i:
+                    del self.index[c.get("id")]
+        clients = doc["inbounds"][0].setdefault("settings", {}).setdefault("clients", [])
+        for c in clients:
+            self.index[c.get("id")] = i
+        self.docs[i] = doc
+        self.counts[i] = len(clients)
+        self.stamps[i] = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        """Прочитать все шарды; недостающие (при увеличении N) создать по шаблону шарда 0."""
+        with self.lock:
+            if not os.path.exists(self.path(0)):
+                raise RuntimeError(f"нет {self.path(0)} — сначала: python xray_shards.py migrate --shards {self.n}")
+            for i in range(self.n):
+                if os.path.exists(self.path(i)):
+                    self._load_shard(i)
+            tpl = self.inbound(0)
+            base_tag = tpl.get("tag") or "reality"
+            if base_tag.endswith("-000"):   # шарды, созданные до сохранения исходного tag
+                base_tag = base_tag[:-4]
+            missing = [i for i in range(self.n) if self.docs[i] is None]
+            if missing:
+                _check_ports([int(tpl.get("port")) + i for i in missing], _taken_ports(self.confdir, self.config))
+            for i in missing:
+                self.docs[i] = {"inbounds": [self._shard_inbound(tpl, i, int(tpl.get("port")), base_tag)]}
+                _atomic_write(self.path(i), self.docs[i])
+                self.stamps[i] = _stamp(self.path(i))
+        return self
+
+    def refresh(self) -> List[int]:
+        """Перечитать шарды, изменённые другим процессом. Возвращает их номера."""
+        changed = []
+        with self.lock:
+            for i in range(self.n):
+                if _stamp(self.path(i)) != self.stamps[i]:
+                    self._load_shard(i); changed.append(i)
+        return changed
+
+    @staticmethod
+    def _shard_inbound(tpl: dict, i: int, base_port: int, base_tag: str) -> dict:
+        ib = copy.deepcopy(tpl)
+        ib.setdefault("settings", {})["clients"] = []
+        ib["tag"] = base_tag if i == 0 else f"{base_tag}-{i:03d}"
+        ib["port"] = base_port + i
+        return ib
+
+    # ---------- запросы ----------
+    def shard_of(self, uuid: str) -> Optional[int]:
+        return self.index.get(uuid)
+
+    def port_for(self, uuid: str) -> Optional[int]:
+        i = self.index.get(uuid)
+        return int(self.inbound(i).get("port")) if i is not None else None
+
+    def tag(self, i: int) -> str:
+        return self.inbound(i).get("tag") or ""
+
+    def _place(self) -> int:
+        return min(range(self.n), key=lambda i: (self.counts[i], i))
+
+    # ---------- мутации ----------
+    def apply(self, adds: Dict[str, dict], removes: Set[str]
+              ) -> Tuple[List[int], List[Tuple[str, dict]], List[Tuple[str, dict]]]:
+        """Применить пачку. Возвращает (затронутые шарды, [(tag, добавленный клиент)], [(tag, удалённый клиент)])."""
+        with self.lock:
+            for i in range(self.n):   # чужие изменения подтягиваем до мутации
+                if _stamp(self.path(i)) != self.stamps[i]:
+                    self._load_shard(i)
+            touched: Set[int] = set()
+            added: List[Tuple[str, dict]] = []
+            removed: List[Tuple[str, dict]] = []
+            by_shard: Dict[int, Set[str]] = {}
+            for u in removes:
+                i = self.index.get(u)
+                if i is not None:
+                    by_shard.setdefault(i, set()).add(u)
+            for i, uu in by_shard.items():
+                settings = self.inbound(i)["settings"]
+                keep = []
+                for c in settings["clients"]:
+                    if c.get("id") in uu:
+                        removed.append((self.tag(i), c)); self.index.pop(c.get("id"), None)
+                    else:
+                        keep.append(c)
+                settings["clients"] = keep
+                self.counts[i] = len(keep)
+                touched.add(i)
+            for u, c in adds.items():
+                if u in self.index:
+                    continue
+                i = self._place()
+                self.inbound(i)["settings"]["clients"].append(c)
+                self.index[u] = i; self.counts[i] += 1
+                added.append((self.tag(i), c)); touched.add(i)
+            for i in sorted(touched):
+                _atomic_write(self.path(i), self.docs[i])
+                self.stamps[i] = _stamp(self.path(i))
+            return sorted(touched), added, removed
+
+    def stats(self) -> dict:
+        return {"shards": self.n, "clients": sum(self.counts), "per_shard": list(self.counts)}
+
+
+def migrate(config_path: str, confdir: str, shards: int, rebalance: bool = False) -> ShardStore:
+    """
+    Вынести Reality inbound из config_path в N шардов confdir.
+    rebalance=False — все текущие клиенты в шард 0 (порт не меняется);
+    rebalance=True  — раскидать поровну (у части клиентов сменится порт в подписке).
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    inbounds = data.get("inbounds", [])
+    idx = next((k for k, ib in enumerate(inbounds) if _is_reality(ib)), None)
+    if idx is None:
+        raise RuntimeError("Reality inbound не найден в " + config_path)
+    tpl = inbounds[idx]
+    clients = (tpl.get("settings") or {}).get("clients", [])
+    base_port = int(tpl.get("port"))
+    taken = _inbound_ports(inbounds[:idx] + inbounds[idx + 1:]) | _taken_ports(confdir)
+    _check_ports([base_port + i for i in range(1, shards)], taken)
+    os.makedirs(confdir, exist_ok=True)
+    store = ShardStore(confdir, shards, config_path)
+    for i in range(shards):
+        ib = store._shard_inbound(tpl, i, base_port, tpl.get("tag") or "reality")
+        store.docs[i] = {"inbounds": [ib]}
+    for k, c in enumerate(clients):
+        i = k % shards if rebalance else 0
+        store.inbound(i)["settings"]["clients"].append(c)
+        store.index[c.get("id")] = i; store.counts[i] += 1
+    for i in range(shards):
+        _atomic_write(store.path(i), store.docs[i])
+        store.stamps[i] = _stamp(store.path(i))
+    # исходный inbound убираем из основного конфига только после записи шардов
+    del inbounds[idx]
+    _atomic_write(config_path, data, indent=2)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Шардирование клиентов Reality по confdir Xray")
+    ap.add_argument("cmd", choices=["migrate", "stats"])
+    ap.add_argument("--config", default=os.getenv("XRAY_CONFIG", "/usr/local/etc/xray/config.json"))
+    ap.add_argument("--confdir", default=os.getenv("XRAY_CONFDIR", "/usr/local/etc/xray/conf.d"))
+    ap.add_argument("--shards", type=int, default=int(os.getenv("XRAY_SHARDS", "8")))
+    ap.add_argument("--rebalance", action="store_true", help="раскидать текущих клиентов по всем шардам")
+    a = ap.parse_args()
+    if a.cmd == "migrate":
+        s = migrate(a.config, a.confdir, a.shards, a.rebalance)
+    else:
+        s = ShardStore(a.confdir, a.shards, a.config).load()
+    print(json.dumps(s.stats(), ensure_ascii=False))
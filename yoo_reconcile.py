@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Фоновая сверка платежей YooMoney.
+
+Раз в interval секунд (и только если есть ожидающие платежи) забираем историю
+входящих операций одним проходом — от курсора по времени, постранично через
+start_record до конца (next_record пуст) — и сопоставляем со всеми
+pending-платежами разом. Совпавшие помечаются в БД как paid; кнопка
+«Проверить оплату» после этого — просто чтение своей строки payments.
+
+Курсор: min(время последней увиденной операции, сейчас) - overlap; любая новая
+операция будет позже него, поэтому каждую операцию смотрим O(1) раз. История
+приходит от новых к старым, поэтому страницы не обрезаем: иначе старые пополнения
+выпали бы из прохода, а курсор уже ушёл бы за них.
+"""
+import asyncio, contextlib, time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# pending() -> {label: created_at}; mark_paid([(label, amount, operation_id)])
+PendingFn = Callable[[], Awaitable[Dict[str, int]]]
+MarkFn = Callable[[List[Tuple[str, float, str]]], Awaitable[None]]
+
+
+class YooReconciler:
+    def __init__(self, client_factory: Callable[[], object], pending: PendingFn, mark_paid: MarkFn,
+                 interval: float = 20.0, overlap: int = 600, page: int = 100, min_gap: float = 3.0):
+        self.client_factory = client_factory
+        self.pending = pending
+        self.mark_paid = mark_paid
+        self.interval = interval
+        self.overlap = timedelta(seconds=overlap)
+        self.page = page
+        self.min_gap = min_gap          # не чаще одного похода в API за min_gap при ручных refresh()
+        self._client = None
+        self._since: Optional[datetime] = None
+        self._tick: Optional[asyncio.Task] = None
+        self._last_tick = 0.0
+        # метрики
+        self.ticks = 0
+        self.api_calls = 0
+        self.matched = 0
+        self.errors = 0
+        self.last_error = ""
+        self.observe: Optional[Callable[[str, float, bool], None]] = None   # (метод API, секунды, успех)
+
+    def close(self):
+        if self._client is not None and hasattr(self._client, "close"):
+            self._client.close()
+        self._client = None
+
+    # ---------- один проход ----------
+    def _fetch(self, since: datetime) -> list:
+        if self._client is None:
+            self._client = self.client_factory()
+        ops, start = [], None
+        while True:
+            t0 = time.perf_counter(); ok = False
+            try:
+                h = self._client.operation_history(type="deposition", from_date=since,
+                                                   start_record=start, records=self.page)
+                ok = True
+            finally:
+                self.api_calls += 1
+                if self.observe is not None:
+                    self.observe("operation_history", time.perf_counter() - t0, ok)
+            ops.extend(h.operations or [])
+            start = getattr(h, "next_record", None)
+            if not start:
+                break
+        return ops
+
+    async def _run_tick(self) -> int:
+        self._last_tick = time.monotonic()
+        try:
+            return await self._reconcile()
+        except Exception as e:
+            self.errors += 1; self.last_error = repr(e)
+            self._client = None      # пересоздадим соединение на следующем проходе
+            return 0
+
+    async def _reconcile(self) -> int:
+        pending = await self.pending()
+        if not pending:
+            return 0
+        now = datetime.utcnow()
+        oldest = datetime.utcfromtimestamp(min(pending.values())) - self.overlap
+        since = oldest if self._since is None else max(self._since, oldest)
+        ops = await asyncio.to_thread(self._fetch, since)
+        found, newest = [], since
+        for op in ops:
+            if op.datetime and op.datetime > newest:
+                newest = op.datetime
+            lbl = getattr(op, "label", None)
+            if lbl in pending and op.status == "success" and op.direction == "in":
+                found.append((lbl, float(op.amount), str(op.operation_id or "")))
+        if found:
+            await self.mark_paid(found)
+            self.matched += len(found)
+        self._since = max(since, min(newest, now) - self.overlap)
+        self.ticks += 1
+        return len(found)
+
+    async def tick(self) -> int:
+        """Один проход; параллельные вызовы ждут уже идущий."""
+        if self._tick is None or self._tick.done():
+            self._tick = asyncio.create_task(self._run_tick())
+        return await asyncio.shield(self._tick)
+
+    async def refresh(self, timeout: float = 5.0):
+        """Внеочередная сверка по кнопке пользователя (не чаще min_gap, ждём не дольше timeout)."""
+        if (self._tick is None or self._tick.done()) and time.monotonic() - self._last_tick < self.min_gap:
+            return
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.tick(), timeout)
+
+    async def run(self):
+        while True:
+            await self.tick()
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"ticks": self.ticks, "api_calls": self.api_calls, "matched": self.matched,
+                "errors": self.errors, "last_error": self.last_error,
+                "cursor": self._since.isoformat() if self._since else None}